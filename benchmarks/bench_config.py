@@ -0,0 +1,63 @@
+"""
+Benchmark of config resolution for generated configs with many replications sharing few templates.
+
+Prints time of template instantiation, expansion and substitution per config size. Time per replication
+should stay flat when config grows, i.e. resolution scales linearly.
+
+Usage: PYTHONPATH=. python benchmarks/bench_config.py [--sizes 1000 2000 4000 8000] [--repeat 3]
+"""
+import argparse
+import time
+
+import dbrep.config
+
+def make_templates():
+    return {
+        'conn-pg': {'conn': 'pg', 'batch_size': 10000, 'options': {'template': 'session'}},
+        'conn-mysql': {'conn': 'mysql', 'batch_size': 5000, 'options': {'template': 'session'}},
+        'session': {'timeout': 600, 'tags': ['dbrep'], 'retry': {'attempts': 3, 'backoff': 1.0}},
+        'incremental': {'mode': 'incremental', 'commit_every': '10 batches', 'tags': ['inc']},
+    }
+
+def make_replications(size):
+    return {
+        'table_{}'.format(i): {
+            'template': 'incremental',
+            'src': {'template': 'conn-pg', 'table': 'src_{}'.format(i), 'rid': 'id'},
+            'dst': {'template': 'conn-mysql', 'table': 'dst_{}'.format(i), 'rid': 'id'},
+            'shards': ['s{}'.format(j) for j in range(4)],
+            'name': '${{replications.table_{}.src.table}}'.format(i),
+        }
+        for i in range(size)
+    }
+
+def resolve(templates, replications):
+    cache = {}
+    resolved = {k: dbrep.config.instantiate_templates(v, templates, cache=cache) for k,v in replications.items()}
+    num_expanded = sum(1 for v in resolved.values() for _ in dbrep.config.iter_expand_config(v, 'shards', 'shard'))
+    config = dbrep.config.substitute_config({'replications': resolved})
+    return config, num_expanded
+
+def bench(size, repeat):
+    templates = make_templates()
+    replications = make_replications(size)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        resolve(templates, replications)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark config resolution')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 4000, 8000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print('{:>10} {:>10} {:>14}'.format('tables', 'seconds', 'us per table'))
+    for size in args.sizes:
+        elapsed = bench(size, args.repeat)
+        print('{:>10} {:>10.3f} {:>14.1f}'.format(size, elapsed, elapsed / size * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark of fetch and insert through SQLAlchemy Core versus raw DBAPI cursor (`raw_dbapi: true` in connection config).
+
+Copies table of generated rows between two SQLite databases (or given connection strings) and prints throughput
+of fetch-only and fetch+insert runs for both paths.
+
+Usage: PYTHONPATH=. python benchmarks/bench_dbapi.py [--rows 200000] [--batch-size 10000] [--src sqlite:///src.db --dst sqlite:///dst.db]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from dbrep.engines.engine_sqlalchemy import SQLAlchemyEngine
+from dbrep.replication import run_pull_push
+
+def make_engine(conn_str, raw):
+    return SQLAlchemyEngine({'engine': 'sqlalchemy', 'conn-str': conn_str, 'raw_dbapi': raw})
+
+def execute(engine, query, params=None):
+    return engine._execute(engine.make_query(query), params) if params is not None else engine._execute(engine.make_query(query))
+
+def prepare(src_str, dst_str, num_rows):
+    src = make_engine(src_str, False)
+    dst = make_engine(dst_str, False)
+    for engine, table in [(src, 'bench_src'), (dst, 'bench_dst')]:
+        execute(engine, 'drop table if exists {}'.format(table))
+        execute(engine, 'create table {} (id integer, name varchar(64), amount float, created varchar(32), flag integer)'.format(table))
+    rows = [{'id': i, 'name': 'name_{}'.format(i), 'amount': i * 0.5, 'created': '2024-01-01 00:00:{:02d}'.format(i % 60), 'flag': i % 2}
+            for i in range(num_rows)]
+    execute(src, 'insert into bench_src values (:id, :name, :amount, :created, :flag)', rows)
+    src.close()
+    dst.close()
+
+def bench_fetch(src_str, raw, batch_size):
+    src = make_engine(src_str, raw)
+    start = time.perf_counter()
+    src.begin_full_fetch({'table': 'bench_src'})
+    num_rows = 0
+    while True:
+        _, batch = src.fetch_batch(batch_size)
+        if not batch:
+            break
+        num_rows += len(batch)
+    elapsed = time.perf_counter() - start
+    src.close()
+    return num_rows, elapsed
+
+def bench_copy(src_str, dst_str, raw, batch_size):
+    src = make_engine(src_str, raw)
+    dst = make_engine(dst_str, raw)
+    execute(dst, 'delete from bench_dst')
+    start = time.perf_counter()
+    src.begin_full_fetch({'table': 'bench_src'})
+    dst.begin_insert({'table': 'bench_dst'})
+    stats = run_pull_push(src, dst, batch_size, batch_size)
+    elapsed = time.perf_counter() - start
+    src.close()
+    dst.close()
+    return stats['rows'], elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SQLAlchemy Core versus raw DBAPI path')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--src', help='connection string of src (default is temporary SQLite file)')
+    parser.add_argument('--dst', help='connection string of dst (default is temporary SQLite file)')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        src_str = args.src or 'sqlite:///{}'.format(os.path.join(tmp, 'src.db'))
+        dst_str = args.dst or 'sqlite:///{}'.format(os.path.join(tmp, 'dst.db'))
+        prepare(src_str, dst_str, args.rows)
+        print('{:<8} {:<10} {:>10} {:>14}'.format('path', 'run', 'seconds', 'rows/s'))
+        for raw in [False, True]:
+            path = 'raw' if raw else 'core'
+            for name, (num_rows, elapsed) in [('fetch', bench_fetch(src_str, raw, args.batch_size)),
+                                              ('copy', bench_copy(src_str, dst_str, raw, args.batch_size))]:
+                print('{:<8} {:<10} {:>10.3f} {:>14.0f}'.format(path, name, elapsed, num_rows / elapsed))
+
+if __name__ == '__main__':
+    main()
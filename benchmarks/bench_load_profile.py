@@ -0,0 +1,68 @@
+"""
+Benchmark of `load_profile` (session settings for bulk load, see docs/concepts.md) on SQLite.
+
+Copies table of generated rows between two SQLite databases committing every batch, with and without `load_profile`
+on both connections, and prints throughput. Without the profile every commit waits for fsync of the journal and database.
+
+Usage: PYTHONPATH=. python benchmarks/bench_load_profile.py [--rows 200000] [--batch-size 100] [--commit-every 1]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from dbrep.engines.engine_sqlalchemy import SQLAlchemyEngine
+from dbrep.replication import run_replication
+
+def make_engine(conn_str, profile):
+    return SQLAlchemyEngine({'engine': 'sqlalchemy', 'conn-str': conn_str, 'load_profile': profile})
+
+def execute(engine, query, params=None):
+    return engine._execute(engine.make_query(query), params) if params is not None else engine._execute(engine.make_query(query))
+
+def prepare(src_str, dst_str, num_rows):
+    src = make_engine(src_str, False)
+    dst = make_engine(dst_str, False)
+    for engine, table in [(src, 'bench_src'), (dst, 'bench_dst')]:
+        execute(engine, 'drop table if exists {}'.format(table))
+        execute(engine, 'create table {} (id integer, name varchar(64), amount float, created varchar(32), flag integer)'.format(table))
+    execute(dst, 'create index bench_dst_id on bench_dst (id)')
+    rows = [{'id': i, 'name': 'name_{}'.format(i), 'amount': i * 0.5, 'created': '2024-01-01 00:00:{:02d}'.format(i % 60), 'flag': i % 2}
+            for i in range(num_rows)]
+    execute(src, 'insert into bench_src values (:id, :name, :amount, :created, :flag)', rows)
+    src.close()
+    dst.close()
+
+def bench_copy(src_str, dst_str, profile, batch_size, commit_every):
+    src = make_engine(src_str, profile)
+    dst = make_engine(dst_str, profile)
+    config = {
+        'mode': 'full-refresh',
+        'src': {'table': 'bench_src', 'batch_size': batch_size},
+        'dst': {'table': 'bench_dst', 'batch_size': batch_size, 'truncate': True, 'commit_every': commit_every},
+    }
+    start = time.perf_counter()
+    result = run_replication(src, dst, config)
+    elapsed = time.perf_counter() - start
+    src.close()
+    dst.close()
+    return result['rows'], result['commits'], elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark load_profile session settings on SQLite')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--commit-every', type=int, default=1, help='number of batches per commit')
+    parser.add_argument('--dir', help='directory of SQLite files (default is temporary directory)')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        src_str = 'sqlite:///{}'.format(os.path.join(tmp, 'src.db'))
+        dst_str = 'sqlite:///{}'.format(os.path.join(tmp, 'dst.db'))
+        prepare(src_str, dst_str, args.rows)
+        print('{:<14} {:>8} {:>10} {:>14}'.format('load_profile', 'commits', 'seconds', 'rows/s'))
+        for profile in [False, True]:
+            num_rows, commits, elapsed = bench_copy(src_str, dst_str, profile, args.batch_size, args.commit_every)
+            print('{:<14} {:>8} {:>10.3f} {:>14.0f}'.format(str(profile).lower(), commits, elapsed, num_rows / elapsed))
+
+if __name__ == '__main__':
+    main()
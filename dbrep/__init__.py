@@ -14,4 +14,18 @@ def create_engine(name, config):
     global engine_factories
     if name not in engine_factories:
         raise KeyError("Uknonwn engine: {}".format(name))
-    return engine_factories[name](config)
\ No newline at end of file
+    return engine_factories[name](config)
+
+def iter_batches(src_config, mode = 'full-refresh', rid = None, engine = None):
+    """
+    Return generator of `(names, rows)` batches of src, see `dbrep.batches.iter_batches`.
+    """
+    from .batches import iter_batches #imported on first use, since it depends on the rest of package
+    return iter_batches(src_config, mode, rid, engine)
+
+def write_batches(dst_config, batches, engine = None):
+    """
+    Insert `(names, rows)` batches into dst table, see `dbrep.batches.write_batches`.
+    """
+    from .batches import write_batches #imported on first use, since it depends on the rest of package
+    return write_batches(dst_config, batches, engine)
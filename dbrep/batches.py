@@ -0,0 +1,109 @@
+"""
+Generator API for using dbrep as library: `iter_batches` yields batches pulled from src lazily (with the same fetch,
+watermark, throttling and batch budget as replication), `write_batches` pushes any iterable of batches into dst.
+Batches are `(names, rows)` pairs as returned by `fetch_batch` of engines, so that they could be transformed in between:
+
+    batches = dbrep.iter_batches(src_config, 'incremental', rid=watermark)
+    dbrep.write_batches(dst_config, ((names, [fix(x) for x in rows]) for names, rows in batches))
+
+`conn` of config should be connection config (dict with `engine`), unless engine is passed explicitly.
+Engines made from config are closed when iteration (or writing) is finished.
+"""
+import logging
+import time
+
+from . import create_engine, engine_factories, init_factory
+from .cache import CachedEngine, SnapshotCache
+from .replication import make_pull_push_options, pull_batch, run_pull_push
+from .throttle import make_batch_budget, make_throttle
+
+logger = logging.getLogger(__name__)
+
+def open_engine(config, engine = None):
+    """
+    Return engine for config and whether it is made here (hence should be closed by caller).
+    """
+    if engine is not None:
+        return engine, False
+    conn = config.get('conn')
+    if not isinstance(conn, dict) or 'engine' not in conn:
+        raise ValueError('Config should contain connection config (dict with `engine`) in `conn`, or engine should be passed')
+    if conn['engine'] not in engine_factories:
+        init_factory()
+    return create_engine(conn['engine'], conn), True
+
+class IterableSource:
+    """
+    Source engine fetching batches from iterable of `(names, rows)` pairs (size of batches is kept as is).
+    """
+    def __init__(self, batches):
+        self.batches = iter(batches)
+
+    def fetch_batch(self, batch_size):
+        for names, batch in self.batches:
+            if len(batch) > 0: #empty batch would end replication
+                return names, batch
+        return None, []
+
+def iter_batches(src_config, mode = 'full-refresh', rid = None, engine = None):
+    """
+    Return generator of `(names, rows)` batches of src, which are fetched lazily. In `incremental` mode only rows with rid
+    (`rid` of config) greater than watermark `rid` are fetched ordered by rid (every row when watermark is None),
+    nothing if src has no newer rows.
+    """
+    if mode not in ('full-refresh', 'incremental'):
+        raise ValueError('Unsupported mode: {}. Should be full-refresh or incremental'.format(mode))
+    if mode == 'incremental' and not src_config.get('rid'):
+        raise ValueError('Incremental mode requires `rid` in src config')
+    return generate_batches(src_config, mode, rid, engine) #config is validated right away, engine is opened on first batch
+
+def generate_batches(src_config, mode, rid, engine):
+    engine, owned = open_engine(src_config, engine)
+    try:
+        if src_config.get('cache'):
+            cache_config = src_config['cache']
+            engine = CachedEngine(engine, SnapshotCache(cache_config['path'], cache_config.get('max_bytes')))
+            src_config = {k: v for k, v in src_config.items() if k != 'cache'}
+        if mode == 'incremental':
+            src_rid = engine.get_latest_rid(src_config)
+            logger.info('Latest rids: <src>={}, watermark={}'.format(src_rid, rid))
+            if src_rid is None or (rid is not None and rid >= src_rid):
+                return
+            engine.begin_incremental_fetch(src_config, rid)
+        else:
+            engine.begin_full_fetch(src_config)
+        batch_size = src_config.get('batch_size', 1000)
+        throttle = make_throttle(src_config)
+        budget = make_batch_budget(src_config)
+        while True:
+            names, batch = pull_batch(engine, batch_size, throttle, budget)
+            if batch is None or len(batch) == 0:
+                break
+            yield names, batch
+    finally:
+        if owned:
+            engine.close()
+
+def write_batches(dst_config, batches, engine = None):
+    """
+    Insert `(names, rows)` batches (e.g. from `iter_batches`) into dst table. Batches are pushed by `batch_size`
+    and committed by `commit_every` of dst config (aligned on change of `rid` of dst config, if it is set).
+    Returns run result with `batches`, `rows`, `commits`, `rid` (latest written) and `duration`.
+    """
+    start = time.perf_counter()
+    engine, owned = open_engine(dst_config, engine)
+    try:
+        if dst_config.get('truncate', False):
+            logger.info('Truncating <dst>...')
+            engine.truncate(dst_config)
+        engine.begin_insert(dst_config)
+        stats = run_pull_push(IterableSource(batches), engine, rid=dst_config.get('rid'), dst_config=dst_config,
+                              **make_pull_push_options({'src': {}, 'dst': dst_config}))
+        engine.end_insert()
+    finally:
+        if owned:
+            engine.close()
+    result = {k: stats[k] for k in ['batches', 'rows', 'commits', 'throttled', 'peak_batch_bytes'] if k in stats}
+    result['rid'] = stats['max_rid']
+    result['duration'] = time.perf_counter() - start
+    return result
@@ -0,0 +1,245 @@
+"""
+Local snapshot cache of pulled source rows (`cache` in src config), so that new or rebuilt destinations
+could be loaded without re-extracting the same rows from production source.
+
+    cache:
+      path: /var/cache/dbrep      # directory of cache
+      max_bytes: 10000000000      # size limit, least recently used snapshots are evicted
+
+Pulled batches are stored as segments (column-major pickle compressed with zlib) in snapshot keyed by source config
+(connection, table or query, columns, where and rid). Snapshot covers rid range (start, end]: fetch from rid covered by
+snapshot replays cached segments and queries source only for rows after its end, appending them to snapshot.
+Snapshot is updated only after source is read till the end, so it never ends in the middle of rows with the same rid.
+
+Like incremental mode, cache assumes that rows are not changed after they are pulled (append-only by rid),
+full refresh is served from cache only when src config has `rid`.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
+
+key_fields = ['conn', 'table', 'query', 'columns', 'where', 'rid']
+
+def make_cache_key(config):
+    """
+    Make key of snapshot from fields of src config affecting fetched rows.
+    """
+    data = json.dumps({k: config.get(k) for k in key_fields}, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+def encode_segment(names, rows):
+    columns = [list(x) for x in zip(*rows)] if rows else [[] for _ in names]
+    return zlib.compress(pickle.dumps({'names': list(names), 'columns': columns}, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+def decode_segment(data):
+    segment = pickle.loads(zlib.decompress(data))
+    return segment['names'], list(zip(*segment['columns']))
+
+class SnapshotCache:
+    """
+    Directory of snapshots, every one is subdirectory with index (pickled, since rids are of arbitrary types) and segment files.
+    """
+    def __init__(self, path, max_bytes = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def _dir(self, key):
+        return os.path.join(self.path, key)
+
+    def load_index(self, key):
+        try:
+            with open(os.path.join(self._dir(key), 'index.pickle'), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def save_index(self, key, index):
+        fname = os.path.join(self._dir(key), 'index.pickle')
+        with open(fname + '.tmp', 'wb') as f:
+            pickle.dump(index, f)
+        os.replace(fname + '.tmp', fname)
+
+    def write_segment(self, key, names, rows):
+        os.makedirs(self._dir(key), exist_ok=True)
+        data = encode_segment(names, rows)
+        fname = uuid.uuid4().hex + '.seg'
+        with open(os.path.join(self._dir(key), fname), 'wb') as f:
+            f.write(data)
+        return {'file': fname, 'rows': len(rows), 'bytes': len(data)}
+
+    def read_segment(self, key, segment):
+        with open(os.path.join(self._dir(key), segment['file']), 'rb') as f:
+            return decode_segment(f.read())
+
+    def remove_segments(self, key, segments):
+        for x in segments:
+            try:
+                os.remove(os.path.join(self._dir(key), x['file']))
+            except OSError:
+                pass
+
+    def remove(self, key):
+        shutil.rmtree(self._dir(key), ignore_errors=True)
+
+    def touch(self, key, index):
+        index['last_used'] = time.time()
+        self.save_index(key, index)
+
+    def evict(self, keep = None):
+        """
+        Remove least recently used snapshots (except `keep`) until total size is within `max_bytes`.
+        """
+        if self.max_bytes is None:
+            return
+        indexes = [(x, self.load_index(x)) for x in os.listdir(self.path) if os.path.isdir(self._dir(x))]
+        indexes = [(k, v) for k, v in indexes if v is not None]
+        total = sum(x['bytes'] for _, v in indexes for x in v['segments'])
+        for key, index in sorted(indexes, key=lambda x: x[1].get('last_used', 0)):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            logger.info('Evicting snapshot {} from cache'.format(key))
+            self.remove(key)
+            total -= sum(x['bytes'] for x in index['segments'])
+
+class CachedEngine:
+    """
+    Wrapper of src engine serving fetches from snapshot cache. Everything except fetching is delegated to wrapped engine.
+    """
+    def __init__(self, engine, cache):
+        self.engine = engine
+        self.cache = cache
+        self.cached_rows = 0
+        self._reset()
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def _reset(self):
+        self.key = None
+        self.config = None
+        self.index = None
+        self.replay = []
+        self.buffer = None
+        self.names = None
+        self.min_rid = None
+        self.tail = None
+        self.pending = []
+        self.writing = False
+
+    def _rid_getter(self, names, rid):
+        from .replication import make_rid_getter #replication is built on top of this module
+        return make_rid_getter(names, rid)
+
+    def begin_full_fetch(self, config):
+        if not config.get('rid'):
+            logger.warning('Snapshot cache requires rid in src config, fetching from <src>')
+            self._discard()
+            self._reset()
+            return self.engine.begin_full_fetch(config)
+        return self.begin_incremental_fetch(config, None)
+
+    def begin_incremental_fetch(self, config, min_rid):
+        self._discard()
+        self._reset()
+        self.key = make_cache_key(config)
+        self.config = config
+        self.min_rid = min_rid
+        index = self.cache.load_index(self.key)
+        covered = index is not None and index['end'] is not None \
+                    and (index['start'] is None or (min_rid is not None and min_rid >= index['start']))
+        if covered and (min_rid is None or min_rid <= index['end']):
+            self.index = index
+            self.replay = [x for x in index['segments'] if min_rid is None or x['hi'] > min_rid]
+            self.tail = index['end']
+            self.writing = True
+            self.cache.touch(self.key, index)
+            logger.info('Replaying {} rows from snapshot cache, fetching <src> after rid {}'.format(sum(x['rows'] for x in self.replay), self.tail))
+        elif covered: #rows between end of snapshot and min_rid are not cached, so new rows can not be appended
+            logger.info('Snapshot cache ends at rid {}, fetching <src> after rid {} without caching'.format(index['end'], min_rid))
+            self.tail = min_rid
+        else:
+            self.index = {'start': min_rid, 'end': None, 'names': None, 'segments': []}
+            self.tail = min_rid
+            self.writing = True
+        if not self.replay:
+            self.engine.begin_incremental_fetch(config, self.tail)
+
+    def begin_range_fetch(self, config, min_rid, max_rid):
+        self._discard()
+        self._reset()
+        self.engine.begin_range_fetch(config, min_rid, max_rid) #snapshots cover ranges up to the end of src only
+
+    def _next_cached(self):
+        segment = self.replay.pop(0)
+        names, rows = self.cache.read_segment(self.key, segment)
+        get_rid = self._rid_getter(names, self.config['rid'])
+        if self.min_rid is not None and get_rid is not None:
+            rows = rows[bisect.bisect_right([get_rid(x) for x in rows], self.min_rid):]
+        self.names = names
+        self.buffer = rows
+        if not self.replay:
+            self.engine.begin_incremental_fetch(self.config, self.tail)
+
+    def fetch_batch(self, batch_size):
+        while not self.buffer and self.replay:
+            self._next_cached()
+        if self.buffer:
+            batch, self.buffer = self.buffer[:batch_size], self.buffer[batch_size:]
+            self.cached_rows += len(batch)
+            return self.names, batch
+        names, batch = self.engine.fetch_batch(batch_size)
+        if self.writing:
+            self._write(names, batch)
+        return names, batch
+
+    def _write(self, names, batch):
+        if self.index['names'] is not None and list(names) != self.index['names']:
+            logger.warning('Columns of <src> differ from snapshot cache, dropping snapshot')
+            self._discard()
+            self.cache.remove(self.key)
+            self.writing = False
+            return
+        if batch:
+            get_rid = self._rid_getter(names, self.config['rid'])
+            if get_rid is None:
+                logger.warning('Rid {} is not among pulled columns, snapshot cache is not updated'.format(self.config['rid']))
+                self._discard()
+                self.writing = False
+                return
+            segment = self.cache.write_segment(self.key, names, batch)
+            segment['hi'] = get_rid(batch[-1])
+            self.pending.append(segment)
+            self.index['names'] = list(names)
+            return
+        # source is read till the end -- commit pending segments into snapshot
+        if self.pending or self.index['segments']:
+            old = self.cache.load_index(self.key)
+            if old is not None and old['segments'] is not self.index['segments'] and old['start'] != self.index['start']:
+                self.cache.remove_segments(self.key, old['segments']) #new snapshot starts before old one and covers it
+            self.index['segments'] = self.index['segments'] + self.pending
+            self.index['end'] = self.index['segments'][-1]['hi'] if self.index['segments'] else self.index['end']
+            self.pending = []
+            self.cache.touch(self.key, self.index)
+            self.cache.evict(keep=self.key)
+        self.writing = False
+
+    def _discard(self):
+        if self.pending:
+            self.cache.remove_segments(self.key, self.pending)
+            self.pending = []
+
+    def close(self):
+        self._discard()
+        self.engine.close()
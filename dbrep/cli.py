@@ -1,5 +1,6 @@
 import argparse
 import logging
+import os
 import sys
 from typing import Dict, Optional, Union
 
@@ -7,7 +8,9 @@ from cryptography.fernet import Fernet
 import yaml
 
 from .config import make_config, merge_config, substitute_config
-from .replication import full_refresh, incremental_update
+from .replication import run_replication, validate_run_config, make_dst_engine
+from .planner import plan_replication, format_plan
+from .profiling import profile_run
 from . import create_engine, add_engine_factory, init_factory
 
 logFormatter = logging.Formatter("%(asctime)s [%(levelname)-5.5s]  %(message)s")
@@ -35,6 +38,9 @@ def make_dbrep_argparser():
     parser_run = subparsers.add_parser('run', help='run replication between databases (and other entities)')
     parser_config = subparsers.add_parser('config', help='configure connections and templates (TBD), i.e. manage public data')
     parser_secret = subparsers.add_parser('secret', help='configure credentials and secrets, i.e. manage private data')
+    parser_serve = subparsers.add_parser('serve', help='run incremental replications continuously with warm connections')
+    parser_coordinator = subparsers.add_parser('coordinator', help='split replication into rid partitions and hand them out to workers')
+    parser_worker = subparsers.add_parser('worker', help='load partitions of replication leased from coordinator')
 
     parser_run.add_argument('-f', '--local', default='dbrep.yaml', help='Location of local configuration yaml (may reference global and credentials)')
     parser_run.add_argument('-g', '--globals', default=None, help='Location of global configuration yaml (may reference credentials)')
@@ -42,6 +48,42 @@ def make_dbrep_argparser():
     parser_run.add_argument('-s', '--secret', default=None, help='Location of file with crypto-key')
     parser_run.add_argument('-r', '--run', default=None, help='Specify name of replication to run')
     parser_run.add_argument('-o', '--options', default=None, action=StoreDictKeyPair, nargs="*", metavar="KEY=VAL", help='Override options')
+    parser_run.add_argument('--plan', action='store_true', help='Do not replicate, print increment size, sampled throughput, predicted duration and query plans')
+    parser_run.add_argument('--plan-batches', default=3, type=int, help='Number of batches to sample when planning')
+    parser_run.add_argument('--plan-insert', action='store_true', help='Sample insert throughput when planning: rows are inserted into dst and rolled back')
+    parser_run.add_argument('--profile', default=None, choices=['cpu', 'mem'], help='Profile replication run with cProfile of main thread and stack sampling of all threads (cpu) or tracemalloc (mem)')
+    parser_run.add_argument('--profile-output', default='dbrep-profile', help='Prefix of files with profiling results')
+    parser_run.add_argument('--profile-every', default=100, type=int, help='Take memory snapshot every N batches')
+    parser_run.add_argument('--profile-top', default=20, type=int, help='Number of entries in profiling summary')
+
+    parser_serve.add_argument('-f', '--local', default='dbrep.yaml', help='Location of local configuration yaml (may reference global and credentials)')
+    parser_serve.add_argument('-g', '--globals', default=None, help='Location of global configuration yaml (may reference credentials)')
+    parser_serve.add_argument('-c', '--credential', default='dbrep.cred', help='Location of dbrep credentials file')
+    parser_serve.add_argument('-s', '--secret', default=None, help='Location of file with crypto-key')
+    parser_serve.add_argument('-r', '--replications', default=None, nargs='*', help='Names of replications to serve (all from `replications` by default)')
+    parser_serve.add_argument('-i', '--interval', default=60.0, type=float, help='Default polling interval in seconds')
+    parser_serve.add_argument('-o', '--options', default=None, action=StoreDictKeyPair, nargs="*", metavar="KEY=VAL", help='Override options')
+
+    parser_coordinator.add_argument('-f', '--local', default='dbrep.yaml', help='Location of local configuration yaml (may reference global and credentials)')
+    parser_coordinator.add_argument('-g', '--globals', default=None, help='Location of global configuration yaml (may reference credentials)')
+    parser_coordinator.add_argument('-c', '--credential', default='dbrep.cred', help='Location of dbrep credentials file')
+    parser_coordinator.add_argument('-s', '--secret', default=None, help='Location of file with crypto-key')
+    parser_coordinator.add_argument('-r', '--run', default=None, help='Specify name of replication to run')
+    parser_coordinator.add_argument('-o', '--options', default=None, action=StoreDictKeyPair, nargs="*", metavar="KEY=VAL", help='Override options')
+    parser_coordinator.add_argument('--bind', default='127.0.0.1:8765', help='Address to listen for workers on (HOST:PORT)')
+    parser_coordinator.add_argument('--partitions', default=16, type=int, help='Number of rid partitions')
+    parser_coordinator.add_argument('--lease-timeout', default=60.0, type=float, help='Seconds without heartbeat after which partition is reassigned')
+    parser_coordinator.add_argument('--max-attempts', default=3, type=int, help='Number of attempts to load partition before run fails')
+    parser_coordinator.add_argument('--token', default=os.environ.get('DBREP_COORDINATOR_TOKEN'), help='Token shared with workers (DBREP_COORDINATOR_TOKEN by default), required unless bound to loopback')
+
+    parser_worker.add_argument('-f', '--local', default='dbrep.yaml', help='Location of local configuration yaml (may reference global and credentials)')
+    parser_worker.add_argument('-g', '--globals', default=None, help='Location of global configuration yaml (may reference credentials)')
+    parser_worker.add_argument('-c', '--credential', default='dbrep.cred', help='Location of dbrep credentials file')
+    parser_worker.add_argument('-s', '--secret', default=None, help='Location of file with crypto-key')
+    parser_worker.add_argument('-o', '--options', default=None, action=StoreDictKeyPair, nargs="*", metavar="KEY=VAL", help='Override options')
+    parser_worker.add_argument('--coordinator', default='http://127.0.0.1:8765', help='URL of coordinator')
+    parser_worker.add_argument('--name', default=None, help='Name of worker (host and pid by default)')
+    parser_worker.add_argument('--token', default=os.environ.get('DBREP_COORDINATOR_TOKEN'), help='Token shared with coordinator (DBREP_COORDINATOR_TOKEN by default)')
 
     parser_secret.add_argument('cmd', choices=['new', 'ls', 'rm', 'set'])
     parser_secret.add_argument('-s', '--secret', default=None, help='Location of file with crypto-key')
@@ -56,13 +98,24 @@ def cli_dbrep():
     parser = make_dbrep_argparser()
     args = parser.parse_args()
     if args.cmd_main == 'run':
-        secret = load_secret(args.secret)
-        local_config = load_config(args.local, secret) or {}
-        global_config = load_config(args.globals, secret)
-        cred_config = load_config(args.credential, secret) or {}        
-        options = make_config((args.options or {}).items())
-        config = substitute_config(merge_config(global_config, cred_config, local_config, options))
-        return run(config)
+        config = load_full_config(args)
+        if args.plan:
+            print(format_plan(run(config, plan=True, plan_batches=args.plan_batches, plan_insert=args.plan_insert)))
+            return
+        with profile_run(args.profile, args.profile_output, args.profile_top, args.profile_every):
+            run(config) #result is logged by replication, console-script exit code should not depend on it
+    elif args.cmd_main == 'serve':
+        init_factory()
+        from .serve import ReplicationServer #import only here when it will be actually used
+        server = ReplicationServer(lambda: load_full_config(args), make_engine, args.replications, args.interval)
+        server.install_signal_handlers()
+        server.serve_forever()
+    elif args.cmd_main == 'coordinator':
+        config = load_full_config(args)
+        host, _, port = args.bind.rpartition(':')
+        coordinate(config, (host or '127.0.0.1', int(port)), args.partitions, args.lease_timeout, args.max_attempts, token=args.token)
+    elif args.cmd_main == 'worker':
+        work(load_full_config(args), args.coordinator, args.name, args.token)
     elif args.cmd_main == 'secret':
         return manage_secrets(args)
     elif args.cmd_main == 'config':
@@ -70,6 +123,14 @@ def cli_dbrep():
     else:
         raise NotImplementedError('Unexpected command in dbrep')
 
+def load_full_config(args) -> Dict:
+    secret = load_secret(args.secret)
+    local_config = load_config(args.local, secret) or {}
+    global_config = load_config(args.globals, secret)
+    cred_config = load_config(args.credential, secret) or {}
+    options = make_config((args.options or {}).items())
+    return substitute_config(merge_config(global_config, cred_config, local_config, options))
+
 def load_secret(fname: Optional[str]) -> Optional[bytes]:
     if fname is None:
         return None
@@ -93,15 +154,17 @@ def manage_configs(args):
     print('Invoke configs with args: {}'.format(args))
 
 
-def make_engine(conn_config: Union[Dict, str], full_config: Dict):
+def resolve_connection(conn_config: Union[Dict, str], full_config: Dict) -> Dict:
     if isinstance(conn_config, str):
         if 'connections' not in full_config or conn_config not in full_config['connections']:
             raise KeyError('When specifying name of connection ({}), it should exist in `connections` section of config'.format(conn_config))
-        config = full_config['connections'][conn_config]
-    elif isinstance(conn_config, dict):
-        config = conn_config
-    else:
+        return full_config['connections'][conn_config]
+    if not isinstance(conn_config, dict):
         raise TypeError('conn_config should be dict or str, but got {}'.format(conn_config))
+    return conn_config
+
+def make_engine(conn_config: Union[Dict, str], full_config: Dict):
+    config = resolve_connection(conn_config, full_config)
 
     if not isinstance(config, dict):
         raise TypeError('Connection config should be dict with at least `engine` field, but got {}'.format(type(config)))
@@ -110,8 +173,7 @@ def make_engine(conn_config: Union[Dict, str], full_config: Dict):
 
     return create_engine(config['engine'], config)
 
-def run(config : Dict):
-    init_factory()
+def get_run_config(config : Dict) -> Dict:
     if 'run' not in config:
         raise ValueError("Must specify `run` parameter: either name of replication from config, or dictionary specifying replication!")
 
@@ -122,17 +184,43 @@ def run(config : Dict):
     else:
         raise TypeError('Inapproapriate type of `run`: {}, while expected either dict or str'.format(type(config['run'])))
     
-    if not isinstance(run_config, dict):
-        raise TypeError('Run should be dict, but got {}!'.format(type(run_config)))
-    if 'src' not in run_config or 'dst' not in run_config or 'mode' not in run_config:
-        raise ValueError('Run should contain mode, src and dst')
+    validate_run_config(run_config)
+    return run_config
 
+def run(config : Dict, plan : bool = False, plan_batches : int = 3, plan_insert : bool = False):
+    init_factory()
+    run_config = get_run_config(config)
     src_engine = make_engine(run_config['src']['conn'], config)
-    dst_engine = make_engine(run_config['dst']['conn'], config)
+    dst_engine = make_dst_engine(run_config['dst'], config, make_engine)
 
-    if run_config['mode'] == 'full-refresh':
-        return full_refresh(src_engine, dst_engine, run_config)
-    elif run_config['mode'] == 'incremental':
-        return incremental_update(src_engine, dst_engine, run_config)
-    else:
-        raise ValueError("Unsupported mode: {}. Should be full-refresh or incremental".format(run_config['mode']))
\ No newline at end of file
+    if plan:
+        if isinstance(dst_engine, list):
+            raise ValueError('Planning is not supported for multiple destinations')
+        return plan_replication(src_engine, dst_engine, run_config, plan_batches, plan_insert)
+    return run_replication(src_engine, dst_engine, run_config)
+
+def coordinate(config : Dict, bind = ('127.0.0.1', 8765), partitions : int = 16, lease_timeout : float = 60.0, max_attempts : int = 3,
+               ready = None, token : Optional[str] = None):
+    from .distributed import run_coordinator #import only here when it will be actually used
+    init_factory()
+    run_config = get_run_config(config)
+    if isinstance(run_config['dst'], list):
+        raise ValueError('Distributed replication does not support multiple destinations')
+    #workers load config themselves, so that only name of replication is sent to them
+    run_name = config['run'] if isinstance(config['run'], str) else None
+    src_engine = make_engine(run_config['src']['conn'], config)
+    try:
+        dst_engine = make_engine(run_config['dst']['conn'], config)
+        try:
+            return run_coordinator(src_engine, dst_engine, run_config, bind, partitions, lease_timeout, max_attempts, ready, run_name, token)
+        finally:
+            dst_engine.close()
+    finally:
+        src_engine.close()
+
+def work(config : Dict, url : str, name : Optional[str] = None, token : Optional[str] = None):
+    from .distributed import run_worker #import only here when it will be actually used
+    init_factory()
+    def get_run_config_(run):
+        return get_run_config(dict(config, run=run) if run is not None else config)
+    return run_worker(url, get_run_config_, lambda conn: make_engine(conn, config), name, token=token)
@@ -16,8 +16,7 @@ So there must be a way to combine these multiple configs into single one. This c
 """
 import string
 import functools
-import copy
-from typing import Any, Dict, List, Tuple, Union
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
 
 
 def make_config(list_of_pairs : List[Tuple[str, Any]]) -> dict:
@@ -85,7 +84,25 @@ def flatten_config(config : dict, prefix : str = '') -> dict:
                     for k2, v2 in flatten_config(v, formatter.format(k)).items()})
     return res
 
-def instantiate_templates(config: Union[dict, list], templates: dict, keywords = ['template', 'templates'], merge_handler = merge_handler_expand_or_override) -> Union[dict, list]:
+def _templates_to_use(config: dict, templates: dict, keywords) -> Tuple[str, ...]:
+    templates_to_use = []
+    for k in keywords:
+        if k in config:
+            if isinstance(config[k], str):
+                templates_to_use.append(config[k])
+            elif isinstance(config[k], list) or isinstance(config[k], tuple):
+                if not all(isinstance(x, str) for x in config[k]):
+                    raise TypeError('Template value should be list of strings or single string, but got list with inconsistent types')
+                templates_to_use += list(config[k])
+            else:
+                raise TypeError('Template value should be list of strings or single string, but got {}'.format(type(config[k])))
+    for t in templates_to_use:
+        if t not in templates:
+            raise ValueError('Template `{}` not present in templates dictionary'.format(t))
+    return tuple(templates_to_use)
+
+def instantiate_templates(config: Union[dict, list], templates: dict, keywords = ['template', 'templates'], merge_handler = merge_handler_expand_or_override,
+                          cache: Optional[dict] = None) -> Union[dict, list]:
     """
     Insert template values for `templates` dictionary into config, e.g.
     {
@@ -104,35 +121,47 @@ def instantiate_templates(config: Union[dict, list], templates: dict, keywords =
         "vc": 8,
         "val": 3
     }
+    Result shares unchanged parts with `config` and `templates` (no copies are made), so it should not be modified inplace.
+    Instantiated parts are memoized in `cache` by identity, so templates shared by many configs are instantiated once.
+    The same `cache` may be passed to several calls with the same `templates`, as long as neither configs nor templates
+    are modified in between (cached result of changed config would be returned as is).
     """
     if not config:
         return config
     if not templates:
         return config
+    if cache is None:
+        cache = {}
     if isinstance(config, list):
-        return [instantiate_templates(x, templates, keywords=keywords) for x in config]
+        return [instantiate_templates(x, templates, keywords=keywords, merge_handler=merge_handler, cache=cache) for x in config]
     if not isinstance(config, dict):
         return config
-    templates_to_use = []
-    for k in keywords:
-        if k in config:
-            if isinstance(config[k], str):
-                templates_to_use.append(config[k])
-            elif isinstance(config[k], list) or isinstance(config[k], tuple):
-                if not all(isinstance(x, str) for x in config[k]):
-                    raise TypeError('Template value should be list of strings or single string, but got list with inconsistent types')
-                templates_to_use += list(config[k])
-            else:
-                raise TypeError('Template value should be list of strings or single string, but got {}'.format(type(config[k])))
+    templates_to_use = _templates_to_use(config, templates, keywords)
     if not templates_to_use: #exit early
         return config
-    for t in templates_to_use:
-        if t not in templates:
-            raise ValueError('Template `{}` not present in templates dictionary'.format(t))
-    
-    result = merge_config(copy.deepcopy(config), *[templates[t] for t in templates_to_use], merge_handler=merge_handler)
-    return {k: instantiate_templates(v, templates, keywords=keywords) for k,v in result.items()}
-        
+    key = id(config)
+    if key not in cache: #keeps reference to config, so that its id is not reused while cache is alive
+        result = merge_config(config, *[templates[t] for t in templates_to_use], merge_handler=merge_handler)
+        result = {k: instantiate_templates(v, templates, keywords=keywords, merge_handler=merge_handler, cache=cache) for k,v in result.items()}
+        cache[key] = (config, result)
+    return cache[key][1]
+
+def iter_expand_config(config: dict, field_from: str, field_to: str, merge_handler = merge_handler_expand_or_override) -> Iterator[dict]:
+    """
+    Lazy version of `expand_config`: yields expanded configs one by one.
+    """
+    tmp = config
+    for p in field_from.split('.'):
+        if p not in tmp:
+            yield config
+            return
+        tmp = tmp[p]
+
+    if not isinstance(tmp, list):
+        raise TypeError('Config expansion can be made only on lists, but got {}'.format(type(tmp)))
+    for v in tmp:
+        yield merge_config(config, unflatten_config({field_to: v}), merge_handler=merge_handler)
+
 def expand_config(config: dict, field_from: str, field_to: str, merge_handler = merge_handler_expand_or_override) -> List[dict]:
     """
     Expand config into multiple items. E.g.
@@ -148,16 +177,9 @@ def expand_config(config: dict, field_from: str, field_to: str, merge_handler =
             "value": 8
         }
     ]
+    Expanded configs share unchanged parts with `config`, so they should not be modified inplace.
     """
-    tmp = config
-    for p in field_from.split('.'):
-        if p not in tmp:
-            return [config]
-        tmp = tmp[p]
-
-    if not isinstance(tmp, list):
-        raise TypeError('Config expansion can be made only on lists, but got {}'.format(type(tmp)))
-    return [merge_config(copy.deepcopy(config), unflatten_config({field_to: v}), merge_handler=merge_handler) for v in tmp]
+    return list(iter_expand_config(config, field_from, field_to, merge_handler=merge_handler))
 
 class TemplateDotted(string.Template):
     braceidpattern = r'[_a-z][_a-z0-9\.@\-]*'
@@ -177,7 +199,7 @@ def substitute_config(config : dict) -> dict:
         return {}
     flat_conf = flatten_config(config)
     while True:
-        new_conf = replace_template(flat_conf, copy.deepcopy(flat_conf))
+        new_conf = replace_template(flat_conf, flat_conf)
         if new_conf == flat_conf:
             break
         flat_conf = new_conf
@@ -0,0 +1,602 @@
+"""
+Distributed replication: coordinator splits rid range of replication into partitions and hands them out to worker
+processes (`dbrep worker`, on the same or other hosts) over HTTP with JSON bodies, so that large backfills are not
+limited by network bandwidth of one machine.
+
+    export DBREP_COORDINATOR_TOKEN=...                          # shared secret of coordinator and workers
+    dbrep coordinator -f dbrep.yaml -r big_table --bind 10.0.0.5:8765 --partitions 64
+    dbrep worker -f dbrep.yaml --coordinator http://10.0.0.5:8765   # any number of times, on any host
+
+Coordinator queries rid range to load (incremental: after latest rid of dst, full-refresh: whole src, truncating dst
+if configured) and splits it into `partitions` ranges (min_rid, max_rid]. Worker leases range, loads it with usual
+fetch/insert path (`batch_size`, `commit_every`, throttling and writers of config) and renews lease by heartbeats.
+When heartbeats of worker stop for `lease_timeout` seconds (worker died or hung), its range is leased to another worker,
+which first deletes rows of the range committed by previous attempt. Worker which lost its lease stops at next batch,
+but batch being inserted at that moment may still be committed, so `lease_timeout` should be well above duration
+of one batch. Range failing `max_attempts` times fails the whole run.
+
+Coordinator sends workers only name of replication and rid ranges, never connections or credentials: every worker loads
+config (and credentials) itself, like `dbrep run`, and refuses to work if its replication differs from coordinator's
+(fingerprint of run config without connections). Requests to coordinator carry shared token (`--token` or
+`DBREP_COORDINATOR_TOKEN`), which is required unless coordinator binds to loopback address (default).
+
+Incremental replication reuses partitioned loading within one process (`catch_up` option, see `catch_up`), when
+destination fell far behind: rid gap is loaded concurrently over several connections instead of one ordered stream.
+"""
+import concurrent.futures
+import datetime
+import hashlib
+import hmac
+import http.server
+import json
+import logging
+import numbers
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from .replication import add_stats, create_dst_table, make_pull_push_options, resolve_columns, run_pull_push
+from .writers import ChunkCancelled
+
+logger = logging.getLogger(__name__)
+
+class DistributedError(Exception):
+    """
+    Raised when some partition could not be loaded. Contains run result in `result`.
+    """
+    def __init__(self, message, result):
+        super().__init__(message)
+        self.result = result
+
+class LeaseLost(Exception):
+    """
+    Raised in worker when coordinator leased its partition to another worker.
+    """
+
+def split_rid_range(min_rid, max_rid, parts):
+    """
+    Split numeric rid range (min_rid, max_rid] into at most `parts` consecutive ranges of (almost) equal width.
+    """
+    if not isinstance(parts, int) or isinstance(parts, bool) or parts < 1:
+        raise ValueError('Number of partitions should be positive integer, but got {}'.format(parts))
+    if not isinstance(min_rid, numbers.Number) or not isinstance(max_rid, numbers.Number):
+        raise TypeError('Splitting rid range requires numeric rid, but got {} and {}'.format(type(min_rid), type(max_rid)))
+    if max_rid <= min_rid:
+        return []
+    if isinstance(min_rid, int) and isinstance(max_rid, int):
+        bounds = [min_rid + (max_rid - min_rid) * i // parts for i in range(parts + 1)]
+    else:
+        bounds = [min_rid + (max_rid - min_rid) * i / parts for i in range(parts)] + [max_rid]
+    bounds = [x for i, x in enumerate(bounds) if i == 0 or x != bounds[i - 1]]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def plan_partitions(src_engine, dst_engine, config, partitions):
+    """
+    Make list of rid ranges (min_rid, max_rid] to load, `min_rid` of the first one is None when it is unbounded.
+    """
+    max_rid = src_engine.get_latest_rid(config['src'])
+    if max_rid is None:
+        return []
+    min_rid = dst_engine.get_latest_rid(config['dst']) if config['mode'] == 'incremental' else None
+    if min_rid is not None:
+        return split_rid_range(min_rid, max_rid, partitions)
+    min_rid = src_engine.get_earliest_rid(config['src'])
+    ranges = split_rid_range(min_rid, max_rid, partitions) or [(min_rid, max_rid)]
+    return [(None, ranges[0][1])] + ranges[1:] #first range includes earliest rid itself
+
+def validate_distributed_config(config):
+    if config['mode'] not in ('full-refresh', 'incremental'):
+        raise ValueError('Distributed replication is supported only in full-refresh and incremental modes, but got {}'.format(config['mode']))
+    if isinstance(config['dst'], list):
+        raise ValueError('Distributed replication does not support multiple destinations')
+    if not config['src'].get('rid'):
+        raise ValueError('Distributed replication requires rid in src config to partition rows')
+    if isinstance(config['src']['rid'], (list, tuple)):
+        raise ValueError('Distributed replication requires single numeric rid column to split its range')
+    unsupported = [k for k in ['swap', 'defer_indexes'] if config['dst'].get(k)]
+    if unsupported:
+        raise ValueError('Options {} are not supported in distributed replication'.format(unsupported))
+
+def make_fingerprint(config):
+    """
+    Fingerprint of run config, so that workers could check that they load the same replication as coordinator.
+    Connections are excluded: they may differ between hosts and should not leak even hashed.
+    """
+    data = {k: ({x: y for x, y in v.items() if x != 'conn'} if isinstance(v, dict) else v) for k, v in config.items()}
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value) #e.g. Decimal, rendered into queries as is
+
+class Coordinator:
+    """
+    Bookkeeping of partitions leased to workers. All methods are thread-safe.
+    """
+    def __init__(self, job, ranges, lease_timeout = 60.0, max_attempts = 3, clock = time.monotonic):
+        if lease_timeout <= 0:
+            raise ValueError('lease_timeout should be positive, but got {}'.format(lease_timeout))
+        self.job = job #name of replication and fingerprint of its config, sent to workers along with partitions
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.tasks = [{'id': i, 'min_rid': lo, 'max_rid': hi, 'state': 'pending', 'worker': None, 'deadline': None,
+                       'attempts': 0, 'rows': 0, 'stats': None, 'error': None} for i, (lo, hi) in enumerate(ranges)]
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.reassigned = 0
+        self._check_finished()
+
+    def _check_finished(self):
+        states = [x['state'] for x in self.tasks]
+        if 'leased' not in states and ('pending' not in states or 'failed' in states):
+            self.finished.set()
+
+    def _release(self, task, error):
+        task['state'] = 'failed' if task['attempts'] >= self.max_attempts else 'pending'
+        task['error'] = error
+        if task['state'] == 'failed':
+            logger.error('Partition {} failed {} times: {}'.format(task['id'], task['attempts'], error))
+        self._check_finished()
+
+    def _expire(self):
+        now = self.clock()
+        for task in self.tasks:
+            if task['state'] == 'leased' and task['deadline'] < now:
+                logger.warning('Lease of partition {} by worker {} expired, reassigning it'.format(task['id'], task['worker']))
+                self.reassigned += 1
+                self._release(task, 'lease of worker {} expired'.format(task['worker']))
+
+    def lease(self, worker):
+        with self.lock:
+            self._expire()
+            failed = any(x['state'] == 'failed' for x in self.tasks)
+            task = next((x for x in self.tasks if x['state'] == 'pending'), None) if not failed else None
+            if task is None:
+                return {'task': None, 'finished': self.finished.is_set()}
+            task.update(state='leased', worker=worker, deadline=self.clock() + self.lease_timeout, rows=0)
+            task['attempts'] += 1
+            logger.info('Partition {} ({}, {}] leased by worker {}'.format(task['id'], task['min_rid'], task['max_rid'], worker))
+            return {
+                'task': {'id': task['id'], 'min_rid': task['min_rid'], 'max_rid': task['max_rid'], 'attempt': task['attempts']},
+                'job': self.job,
+                'heartbeat': self.lease_timeout / 4,
+            }
+
+    def _owned(self, worker, task_id):
+        if not isinstance(task_id, int) or not 0 <= task_id < len(self.tasks):
+            raise KeyError('Unknown partition {}'.format(task_id))
+        task = self.tasks[task_id]
+        return task if task['state'] == 'leased' and task['worker'] == worker else None
+
+    def heartbeat(self, worker, task_id, rows = 0):
+        with self.lock:
+            self._expire()
+            task = self._owned(worker, task_id)
+            if task is None:
+                return {'ok': False}
+            task['deadline'] = self.clock() + self.lease_timeout
+            task['rows'] = rows
+            return {'ok': True}
+
+    def complete(self, worker, task_id, stats):
+        with self.lock:
+            task = self._owned(worker, task_id)
+            if task is None:
+                return {'ok': False}
+            task.update(state='done', stats=stats, rows=stats.get('rows', 0), error=None)
+            logger.info('Partition {} loaded by worker {}: {} rows'.format(task_id, worker, task['rows']))
+            self._check_finished()
+            return {'ok': True}
+
+    def fail(self, worker, task_id, error):
+        with self.lock:
+            task = self._owned(worker, task_id)
+            if task is None:
+                return {'ok': False}
+            logger.warning('Partition {} failed on worker {}: {}'.format(task_id, worker, error))
+            self.reassigned += 1
+            self._release(task, error)
+            return {'ok': True}
+
+    def status(self):
+        with self.lock:
+            self._expire()
+            return {
+                'finished': self.finished.is_set(),
+                'partitions': [{k: v for k, v in x.items() if k != 'deadline'} for x in self.tasks],
+            }
+
+    def wait(self, poll = 1.0):
+        while not self.finished.wait(poll):
+            with self.lock:
+                self._expire()
+
+    def result(self):
+        result = {'batches': 0, 'rows': 0, 'commits': 0, 'retries': self.reassigned, 'partitions': len(self.tasks)}
+        for task in self.tasks:
+            if task['stats'] is not None:
+                add_stats(result, task['stats'])
+        result['failed'] = [x['id'] for x in self.tasks if x['state'] != 'done']
+        return result
+
+class CoordinatorHandler(http.server.BaseHTTPRequestHandler):
+    def _send(self, code, body):
+        data = json.dumps(body, default=_json_default).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        token = self.server.token
+        if token is None:
+            return True
+        return hmac.compare_digest(self.headers.get('Authorization', ''), 'Bearer {}'.format(token))
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._send(401, {'error': 'Invalid token'})
+        if self.path != '/status':
+            return self._send(404, {'error': 'Unknown path {}'.format(self.path)})
+        self._send(200, self.server.coordinator.status())
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._send(401, {'error': 'Invalid token'})
+        coordinator = self.server.coordinator
+        handlers = {
+            '/lease': lambda x: coordinator.lease(x['worker']),
+            '/heartbeat': lambda x: coordinator.heartbeat(x['worker'], x['task'], x.get('rows', 0)),
+            '/complete': lambda x: coordinator.complete(x['worker'], x['task'], x['stats']),
+            '/fail': lambda x: coordinator.fail(x['worker'], x['task'], x.get('error')),
+        }
+        if self.path not in handlers:
+            return self._send(404, {'error': 'Unknown path {}'.format(self.path)})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            response = handlers[self.path](request)
+        except (KeyError, TypeError, ValueError) as e:
+            return self._send(400, {'error': str(e)})
+        self._send(200, response)
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+class CoordinatorServer(socketserver.ThreadingMixIn, http.server.HTTPServer): #ThreadingHTTPServer is absent before Python 3.7
+    daemon_threads = True
+    def __init__(self, coordinator, bind = ('127.0.0.1', 8765), token = None):
+        super().__init__(bind, CoordinatorHandler)
+        self.coordinator = coordinator
+        self.token = token
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+def is_loopback(host):
+    return host in ('localhost', '127.0.0.1', '::1') or host.startswith('127.')
+
+def run_coordinator(src_engine, dst_engine, config, bind = ('127.0.0.1', 8765), partitions = 16, lease_timeout = 60.0,
+                    max_attempts = 3, ready = None, run = None, token = None):
+    """
+    Plan partitions of replication `config` and serve them to workers until all are loaded. Workers receive only name
+    of replication `run` (None if workers run their default replication) and fingerprint of its config.
+    `ready` is called with server once it listens.
+    """
+    start = time.perf_counter()
+    validate_distributed_config(config)
+    if token is None and not is_loopback(bind[0]):
+        raise ValueError('Coordinator listening on {} requires token shared with workers'.format(bind[0]))
+    job = {'run': run, 'fingerprint': make_fingerprint(config)}
+    if config['dst'].get('auto_create'):
+        create_dst_table(src_engine, dst_engine, config)
+    if config['mode'] == 'full-refresh' and config['dst'].get('truncate', False):
+        logger.info('Truncating <dst>...')
+        dst_engine.truncate(config['dst'])
+    ranges = plan_partitions(src_engine, dst_engine, config, partitions)
+    logger.info('Split replication into {} partitions: {}'.format(len(ranges), ranges))
+    coordinator = Coordinator(job, ranges, lease_timeout, max_attempts)
+    server = CoordinatorServer(coordinator, bind, token)
+    thread = threading.Thread(target=server.serve_forever, name='dbrep-coordinator', daemon=True)
+    thread.start()
+    try:
+        logger.info('Coordinator is listening on {}'.format(server.url))
+        if ready is not None:
+            ready(server)
+        coordinator.wait()
+    finally:
+        server.shutdown()
+        server.server_close()
+    result = coordinator.result()
+    result['rid'] = ranges[-1][1] if ranges and not result['failed'] else None
+    result['duration'] = time.perf_counter() - start
+    if result['failed']:
+        raise DistributedError('Partitions {} were not loaded'.format(result['failed']), result)
+    logger.info('Replication finished: {}'.format(result))
+    return result
+
+def call_coordinator(url, path, body, timeout = 30.0, token = None):
+    headers = {'Content-Type': 'application/json'}
+    if token is not None:
+        headers['Authorization'] = 'Bearer {}'.format(token)
+    request = urllib.request.Request(url.rstrip('/') + path, data=json.dumps(body, default=_json_default).encode('utf-8'), headers=headers)
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+class Heartbeat:
+    """
+    Background thread renewing lease of partition, marks it lost when coordinator rejects renewal.
+    """
+    def __init__(self, url, worker, task_id, interval, token = None):
+        self.url = url
+        self.token = token
+        self.worker = worker
+        self.task_id = task_id
+        self.interval = interval
+        self.rows = 0
+        self.lost = False
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='dbrep-heartbeat', daemon=True)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                response = call_coordinator(self.url, '/heartbeat', {'worker': self.worker, 'task': self.task_id, 'rows': self.rows},
+                                            token=self.token)
+            except (OSError, ValueError) as e:
+                logger.warning('Heartbeat of partition {} failed: {}'.format(self.task_id, e))
+                continue
+            if not response.get('ok'):
+                logger.warning('Lease of partition {} is lost'.format(self.task_id))
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop_event.set()
+        self.thread.join()
+
+class LeasedEngine:
+    """
+    Wrapper of src engine, which stops fetching when lease of partition is lost. Everything else is delegated.
+    """
+    def __init__(self, engine, heartbeat):
+        self.engine = engine
+        self.heartbeat = heartbeat
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def fetch_batch(self, batch_size):
+        if self.heartbeat.lost:
+            raise LeaseLost('Partition {} was leased to another worker'.format(self.heartbeat.task_id))
+        names, batch = self.engine.fetch_batch(batch_size)
+        self.heartbeat.rows += len(batch) if batch else 0
+        return names, batch
+
+def load_partition(src_engine, dst_engine, config, min_rid, max_rid, attempt = 1):
+    """
+    Load rows with rid in (min_rid, max_rid] from src into dst. Rows of the range left by previous attempt are deleted first.
+    """
+    if attempt > 1:
+        logger.info('Deleting rows with rid in ({}, {}] left by previous attempt from <dst>'.format(min_rid, max_rid))
+        dst_engine.delete_rows(dict(config['dst'], rid=config['src']['rid']), min_rid, max_rid)
+    src_engine.begin_range_fetch(config['src'], min_rid, max_rid)
+    dst_engine.begin_insert(config['dst'])
+    stats = run_pull_push(src_engine, dst_engine, rid=config['src']['rid'], dst_config=config['dst'], **make_pull_push_options(config))
+    dst_engine.end_insert()
+    return stats
+
+def prepare_worker_config(config, dst_engine):
+    """
+    Make run config of worker loading partitions: columns are resolved and snapshot cache is not used.
+    """
+    validate_distributed_config(config)
+    return dict(config, src={k: v for k, v in resolve_columns(config['src'], dst_engine, config['dst']).items() if k != 'cache'})
+
+def run_worker(url, get_run_config, make_engine, name = None, poll = 1.0, token = None):
+    """
+    Load partitions leased from coordinator at `url` until it reports that replication is finished (or goes away).
+    Coordinator sends only name of replication: `get_run_config(name)` returns its run config from config of worker
+    (default replication for None) and `make_engine(conn)` makes engines for its connections.
+    Returns number of loaded partitions.
+    """
+    worker = name or '{}-{}'.format(socket.gethostname(), os.getpid())
+    engines, job, config = None, None, None
+    loaded = 0
+    connected = False
+    try:
+        while True:
+            try:
+                response = call_coordinator(url, '/lease', {'worker': worker}, token=token)
+            except urllib.error.HTTPError: #e.g. invalid token
+                raise
+            except (urllib.error.URLError, ConnectionError):
+                if not connected:
+                    raise
+                logger.info('Coordinator is gone, stopping worker {}'.format(worker))
+                break
+            connected = True
+            task = response['task']
+            if task is None:
+                if response['finished']:
+                    break
+                time.sleep(poll)
+                continue
+            if job != response['job']:
+                run_config = get_run_config(response['job']['run'])
+                if make_fingerprint(run_config) != response['job']['fingerprint']:
+                    call_coordinator(url, '/fail', {'worker': worker, 'task': task['id'], 'error': 'config of worker differs'}, token=token)
+                    raise ValueError('Replication {} of worker {} differs from one of coordinator'.format(response['job']['run'], worker))
+                for engine in engines or []:
+                    engine.close()
+                engines = [make_engine(run_config['src']['conn'])]
+                engines.append(make_engine(run_config['dst']['conn']))
+                config = prepare_worker_config(run_config, engines[1])
+                job = response['job']
+            logger.info('Loading partition {} ({}, {}]'.format(task['id'], task['min_rid'], task['max_rid']))
+            with Heartbeat(url, worker, task['id'], response['heartbeat'], token) as heartbeat:
+                try:
+                    stats = load_partition(LeasedEngine(engines[0], heartbeat), engines[1], config, task['min_rid'], task['max_rid'], task['attempt'])
+                except LeaseLost as e:
+                    logger.warning(str(e))
+                    continue
+                except Exception as e:
+                    logger.exception('Partition {} failed'.format(task['id']))
+                    call_coordinator(url, '/fail', {'worker': worker, 'task': task['id'], 'error': str(e)}, token=token)
+                    for engine in engines:
+                        try:
+                            engine.reconnect()
+                        except Exception:
+                            logger.exception('Failed to reconnect engine')
+                    continue
+            if call_coordinator(url, '/complete', {'worker': worker, 'task': task['id'], 'stats': stats}, token=token).get('ok'):
+                loaded += 1
+            else:
+                logger.warning('Coordinator rejected partition {}, it was leased to another worker'.format(task['id']))
+    finally:
+        for engine in engines or []:
+            try:
+                engine.close()
+            except Exception:
+                logger.exception('Failed to close engine')
+    return loaded
+
+def parse_catch_up(value):
+    """
+    Parse `catch_up` option of incremental replication: dict with `min_gap` (width of rid gap to load concurrently),
+    `workers` (number of src/dst connection pairs) and `partitions` (number of rid ranges, 4 per worker by default).
+    """
+    policy = {'min_gap': None, 'workers': 4, 'partitions': None}
+    if not isinstance(value, dict):
+        raise TypeError('catch_up should be dict, but got {}'.format(type(value)))
+    unknown = set(value) - set(policy)
+    if unknown:
+        raise ValueError('Unexpected keys in catch_up: {}'.format(unknown))
+    policy.update(value)
+    if not isinstance(policy['min_gap'], numbers.Number) or policy['min_gap'] <= 0:
+        raise ValueError('catch_up requires positive min_gap, but got {}'.format(policy['min_gap']))
+    if not isinstance(policy['workers'], int) or isinstance(policy['workers'], bool) or policy['workers'] < 1:
+        raise ValueError('catch_up workers should be positive integer, but got {}'.format(policy['workers']))
+    if policy['partitions'] is None:
+        policy['partitions'] = policy['workers'] * 4
+    return policy
+
+class OrderedCommit:
+    """
+    Wrapper of dst engine loading range `seq` of catch-up: its transaction is committed only after transactions
+    of all lower ranges (like chunks of `writers.WriterPool`), and is rolled back if some lower range failed.
+    `state` is shared by ranges: condition, number of committed ranges and the lowest failed range.
+    """
+    def __init__(self, engine, seq, state):
+        self.engine = engine
+        self.seq = seq
+        self.state = state
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def commit(self):
+        with self.state['cond']:
+            while self.state['committed'] < self.seq and (self.state['failed'] is None or self.state['failed'] > self.seq):
+                self.state['cond'].wait()
+            if self.state['committed'] < self.seq: #committing after failed range would leave gap
+                raise ChunkCancelled()
+        self.engine.commit()
+        with self.state['cond']:
+            self.state['committed'] += 1
+            self.state['cond'].notify_all()
+
+def catch_up(src_engine, dst_engine, config, min_rid, max_rid):
+    """
+    Load rid gap (min_rid, max_rid] of incremental replication concurrently, if it is at least `min_gap` of `catch_up`:
+    gap is split into rid ranges loaded by clones of src and dst engines. Each range is loaded in single transaction
+    committed in order of ranges, so that committed rows never have holes. Returns run result (None if gap is narrow)
+    with `rid` -- end of committed ranges. On failure later ranges are rolled back and error is raised.
+    """
+    policy = parse_catch_up(config['catch_up'])
+    if isinstance(config['src']['rid'], (list, tuple)):
+        raise ValueError('catch_up requires single numeric rid column to split its range')
+    first = min_rid if min_rid is not None else src_engine.get_earliest_rid(config['src'])
+    if not isinstance(first, numbers.Number) or not isinstance(max_rid, numbers.Number):
+        raise TypeError('catch_up requires numeric rid, but got {} and {}'.format(type(first), type(max_rid)))
+    if max_rid - first < policy['min_gap']:
+        return None
+    ranges = split_rid_range(first, max_rid, policy['partitions'])
+    if min_rid is None: #first range includes earliest rid itself
+        ranges = [(None, ranges[0][1])] + ranges[1:]
+    logger.info('Catching up <dst>: loading rids ({}, {}] as {} ranges over {} connections'.format(
+        min_rid, max_rid, len(ranges), min(policy['workers'], len(ranges))))
+
+    start = time.perf_counter()
+    range_config = dict(config, dst=dict(config['dst'], commit_every='run', writers=1, writers_key=None))
+    pairs = queue.Queue()
+    engines = []
+    state = {'cond': threading.Condition(), 'committed': 0, 'failed': None}
+    def load_(seq, lo, hi):
+        if state['failed'] is not None: #ranges after failed one are not started
+            raise ChunkCancelled()
+        src, dst = pairs.get()
+        try:
+            return load_partition(src, OrderedCommit(dst, seq, state), range_config, lo, hi)
+        except Exception as e:
+            with state['cond']:
+                if not isinstance(e, ChunkCancelled) and (state['failed'] is None or state['failed'] > seq):
+                    state['failed'] = seq
+                state['cond'].notify_all()
+            raise
+        finally:
+            pairs.put((src, dst))
+
+    error = None
+    loaded = []
+    try:
+        for _ in range(min(policy['workers'], len(ranges))):
+            engines.append(src_engine.clone())
+            engines.append(dst_engine.clone())
+            pairs.put((engines[-2], engines[-1]))
+        with concurrent.futures.ThreadPoolExecutor(pairs.qsize(), thread_name_prefix='dbrep-catch-up') as executor:
+            futures = [executor.submit(load_, seq, lo, hi) for seq, (lo, hi) in enumerate(ranges)]
+            for future in futures:
+                try:
+                    loaded.append(future.result())
+                except ChunkCancelled:
+                    loaded.append(None)
+                except Exception as e:
+                    logger.error('Catch-up range failed: {}'.format(e))
+                    error = error or e
+                    loaded.append(None)
+    finally:
+        for engine in engines:
+            try:
+                engine.close()
+            except Exception:
+                logger.exception('Failed to close catch-up connection')
+
+    result = {'batches': 0, 'rows': 0, 'commits': 0}
+    watermark = min_rid
+    for (_, hi), stats in zip(ranges, loaded):
+        if stats is None:
+            break
+        add_stats(result, stats)
+        watermark = hi
+    if error is not None:
+        logger.warning('Catch-up failed, <dst> is loaded up to rid {}'.format(watermark))
+        raise error
+    result['rid'] = watermark
+    result['catch_up_ranges'] = len(ranges)
+    result['catch_up_duration'] = time.perf_counter() - start
+    logger.info('Caught up <dst> to rid {}: {}'.format(watermark, result))
+    return result
@@ -7,15 +7,135 @@ class BaseEngine:
     def __init__(self):
         pass
 
+    def features(self):
+        """
+        Set of supported capabilities, e.g. `full-refresh`, `incremental`, `merge`, `pushdown` (see docs/concepts.md).
+        """
+        return set()
+
+    def colocated(self, other):
+        return False
+
     def get_latest_rid(self, config):
         raise NotImplemented
 
+    def get_earliest_rid(self, config):
+        raise NotImplementedError
+
+    def rid_params(self, config, min_rid=None, max_rid=None):
+        """
+        Bind parameters of rid bounds, which should be passed along with rendered fetch (e.g. to `explain`).
+        """
+        return {}
+
+    def render_incremental_fetch(self, config, min_rid):
+        return None
+
+    def render_full_fetch(self, config):
+        return None
+
+    def render_range_fetch(self, config, min_rid, max_rid):
+        return None
+
     def begin_incremental_fetch(self, config, min_rid):
         raise NotImplemented
 
     def begin_full_fetch(self, config):
         raise NotImplemented
 
+    def begin_range_fetch(self, config, min_rid, max_rid):
+        raise NotImplementedError
+
+    def begin_key_fetch(self, config, key):
+        raise NotImplementedError
+
+    def is_retriable(self, exc):
+        return isinstance(exc, (ConnectionError, TimeoutError))
+
+    def clone(self):
+        raise NotImplementedError
+
+    def reconnect(self):
+        raise NotImplementedError
+
+    def begin_transaction(self):
+        raise NotImplementedError
+
+    def commit(self):
+        raise NotImplementedError
+
+    def rollback(self):
+        raise NotImplementedError
+
+    def begin_staging(self, config):
+        raise NotImplementedError
+
+    def merge_staging(self, config):
+        raise NotImplementedError
+
+    def begin_shadow(self, config):
+        raise NotImplementedError
+
+    def drop_shadow(self, config):
+        raise NotImplementedError
+
+    def swap_shadow(self, config):
+        raise NotImplementedError
+
+    def drop_indexes(self, config):
+        raise NotImplementedError
+
+    def rebuild_indexes(self, captured, workers=1):
+        raise NotImplementedError
+
+    def count_rows(self, config, min_rid=None):
+        raise NotImplementedError
+
+    def delete_rows(self, config, min_rid=None, max_rid=None):
+        raise NotImplementedError
+
+    def delete_keys(self, config, key, values):
+        raise NotImplementedError
+
+    def get_columns(self, config):
+        return None
+
+    def has_table(self, config):
+        raise NotImplementedError
+
+    def get_column_types(self, config):
+        return None
+
+    def create_table(self, config, column_types):
+        raise NotImplementedError
+
+    def estimate_rows(self, config):
+        return None
+
+    def explain(self, query, params=None):
+        return None
+
+    def end_insert(self):
+        """
+        Called when insert started by `begin_insert` is finished (e.g. to restore session settings).
+        """
+        pass
+
+    def end_fetch(self):
+        """
+        Called when fetch is abandoned before it is read till the end (e.g. to close cursor and restore session settings).
+        """
+        pass
+
+    def forget_tables(self):
+        """
+        Drop cached metadata of tables of this connection (e.g. when config is reloaded).
+        """
+        pass
+
+    def insert_select(self, config, columns, query, params=None, quote=False):
+        raise NotImplementedError
+
     def truncate(self, config):
         raise NotImplemented
 
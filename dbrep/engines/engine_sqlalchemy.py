@@ -10,11 +10,52 @@
 #
 # HENCE primary solution to test against pandas: mogrify inside python, insert with several simple executes
 
+import concurrent.futures
 import functools
+import re
+import threading
 
 from .engine_base import BaseEngine
 from .. import add_engine_factory
 
+def make_merge_on_conflict(table, staging, names, keys, updates):
+    # `where true` resolves INSERT ... SELECT ... ON CONFLICT parsing ambiguity in SQLite
+    action = 'do update set {}'.format(', '.join('{0} = excluded.{0}'.format(x) for x in updates)) if updates else 'do nothing'
+    return 'insert into {table} ({cols}) select {cols} from {staging} where true on conflict ({keys}) {action}'.format(
+        table=table, staging=staging, cols=', '.join(names), keys=', '.join(keys), action=action
+    )
+
+def make_merge_on_duplicate(table, staging, names, keys, updates):
+    action = ', '.join('{0} = values({0})'.format(x) for x in (updates or keys))
+    return 'insert into {table} ({cols}) select {cols} from {staging} on duplicate key update {action}'.format(
+        table=table, staging=staging, cols=', '.join(names), action=action
+    )
+
+def make_merge_into(table, staging, names, keys, updates, terminator=''):
+    action = ' when matched then update set {}'.format(', '.join('d.{0} = s.{0}'.format(x) for x in updates)) if updates else ''
+    return 'merge into {table} d using {staging} s on ({on}){action} when not matched then insert ({cols}) values ({vals}){term}'.format(
+        table=table, staging=staging,
+        on=' and '.join('d.{0} = s.{0}'.format(x) for x in keys),
+        action=action,
+        cols=', '.join(names), vals=', '.join('s.{}'.format(x) for x in names),
+        term=terminator
+    )
+
+def make_rowvalue_comparison(columns, op, prefix):
+    return '({}) {} ({})'.format(', '.join(columns), op, ', '.join(':{}{}'.format(prefix, i) for i in range(len(columns))))
+
+def make_expanded_comparison(columns, op, prefix):
+    # (a, b) > (x, y) is a > x or a = x and b > y, leading `a >= x` keeps it range scan of index on (a, b)
+    strict = op[0]
+    terms = [' and '.join(['{} = :{}{}'.format(columns[j], prefix, j) for j in range(i)]
+                          + ['{} {} :{}{}'.format(x, op if i == len(columns) - 1 else strict, prefix, i)])
+             for i, x in enumerate(columns)]
+    return '({} {}= :{}0 and ({}))'.format(columns[0], strict, prefix, ' or '.join('({})'.format(x) for x in terms))
+
+# Reflected destination tables shared by engines (and writer threads) of the process, keyed by (conn-str, table)
+reflected_tables = {}
+reflected_tables_lock = threading.Lock()
+
 class SQLAlchemyEngine(BaseEngine):
     id = 'sqlalchemy'
     def __init__(self, connection_config):
@@ -24,69 +65,685 @@ class SQLAlchemyEngine(BaseEngine):
                         *[sqlalchemy.Column(x) for x in col_names]
                     )
 
+        self.connection_config = connection_config
         self.engine = sqlalchemy.create_engine(connection_config['conn-str'])
         self.conn = self.engine.connect()
-        self.template_select_inc = 'select * from {src} where {rid} > {rid_value} order by {rid}'
-        self.template_select_inc_null = 'select * from {src} order by {rid}'
-        self.template_select_all = 'select * from {src}'
-        self.template_select_rid = 'select max({rid}) from {src}'
-        self.template_truncate = 'truncate table {src}'
+        self.dialect = self.engine.dialect.name
+        self.raw = connection_config.get('raw_dbapi', False) #fetch and insert through DBAPI cursor, bypassing SQLAlchemy rows and compilation
+        self.templates_placeholder = {
+            'qmark': lambda i, name: '?',
+            'numeric': lambda i, name: ':{}'.format(i + 1),
+            'named': lambda i, name: ':p{}'.format(i),
+            'format': lambda i, name: '%s',
+            'pyformat': lambda i, name: '%s',
+        }
+        self.template_insert = 'insert into {table} ({columns}) values ({values})'
+        self.template_insert_select = 'insert into {table} ({columns}) {query}'
+        self.template_select_inc = 'select {columns} from {src} where {rid_after}{filter} order by {rid}'
+        self.template_select_inc_null = 'select {columns} from {src}{where} order by {rid}'
+        self.template_select_all = 'select {columns} from {src}{where}'
+        self.template_select_range = 'select {columns} from {src} where {rid_after} and {rid_upto}{filter} order by {rid}'
+        self.template_select_range_null = 'select {columns} from {src} where {rid_upto}{filter} order by {rid}'
+        self.template_select_keys = 'select {columns} from {src}{where} order by {columns}'
+        self.template_select_rid = 'select max({rid}) from {src}{where}'
+        self.template_select_min_rid = 'select min({rid}) from {src}{where}'
+        self.templates_select_rid_row = { #composite rid -- latest / earliest row by order of index
+            'mssql': 'select top 1 {rid} from {src} where {rid_not_null}{filter} order by {rid_order}',
+            'oracle': 'select {rid} from {src} where {rid_not_null}{filter} order by {rid_order} fetch first 1 rows only',
+            'default': 'select {rid} from {src} where {rid_not_null}{filter} order by {rid_order} limit 1',
+        }
+        self.templates_rid_comparison = { #row-value comparison is not supported by MSSQL and Oracle
+            'mssql': make_expanded_comparison,
+            'oracle': make_expanded_comparison,
+            'default': make_rowvalue_comparison,
+        }
+        self.template_count_inc = 'select count(*) from {src} where {rid_after}{filter}'
+        self.template_count_all = 'select count(*) from {src}{where}'
+        self.template_delete_inc = 'delete from {src} where {rid_after}{filter}'
+        self.template_delete_all = 'delete from {src}{where}'
+        self.template_delete_range = 'delete from {src} where {rid_after} and {rid_upto}{filter}'
+        self.template_delete_range_null = 'delete from {src} where {rid_upto}{filter}'
+        self.template_delete_keys = 'delete from {table} where {condition}'
+        self.template_create_table = 'create table {table} ({columns})'
+        self.templates_estimate = {
+            'postgresql': 'select reltuples from pg_class where oid = cast(:table as regclass)',
+            'mysql': 'select table_rows from information_schema.tables where table_schema = database() and table_name = :name',
+        }
+        self.templates_explain = {
+            'postgresql': 'explain {query}',
+            'mysql': 'explain {query}',
+            'sqlite': 'explain query plan {query}',
+        }
+        self.template_truncate = 'delete from {src}' if self.dialect == 'sqlite' else 'truncate table {src}'
+        self.templates_session = { #(get, set) of session setting
+            'postgresql': ('show {name}', 'set {name} = {value}'),
+            'mysql': ('select @@session.{name}', 'set session {name} = {value}'),
+            'sqlite': ('pragma {name}', 'pragma {name} = {value}'),
+        }
+        self.templates_load_profile = { #session settings of `load_profile`, durability is traded for speed only while loading
+            'postgresql': {
+                'insert': {'synchronous_commit': 'off', 'work_mem': '256MB'},
+                'fetch': {'default_transaction_read_only': 'on', 'work_mem': '256MB'},
+            },
+            'mysql': {
+                'insert': {'unique_checks': 0},
+                'fetch': {'transaction_read_only': 1},
+            },
+            'sqlite': { #journal is kept in memory (not turned off), so that rollback still works
+                'insert': {'synchronous': 0, 'journal_mode': 'memory', 'temp_store': 2, 'cache_size': -262144},
+                'fetch': {'query_only': 1, 'temp_store': 2, 'cache_size': -262144, 'mmap_size': 268435456},
+            },
+        }
+        self.templates_staging = {
+            'postgresql': ('create temporary table {staging} as select * from {table} where 1=0', 'drop table if exists {staging}'),
+            'sqlite': ('create temporary table {staging} as select * from {table} where 1=0', 'drop table if exists {staging}'),
+            'mysql': ('create temporary table {staging} as select * from {table} where 1=0', 'drop temporary table if exists {staging}'),
+            'mssql': ('select * into {staging} from {table} where 1=0', 'drop table if exists {staging}'),
+            'oracle': ('create global temporary table {staging} on commit preserve rows as select * from {table} where 1=0',
+                       "begin execute immediate 'truncate table {staging}'; execute immediate 'drop table {staging}'; "
+                       "exception when others then if sqlcode != -942 then raise; end if; end;"), #no `if exists` before 23c
+            'default': ('create table {staging} as select * from {table} where 1=0', 'drop table if exists {staging}'),
+        }
+        self.templates_merge = {
+            'postgresql': make_merge_on_conflict,
+            'sqlite': make_merge_on_conflict,
+            'mysql': make_merge_on_duplicate,
+            'mssql': functools.partial(make_merge_into, terminator=';'),
+            'default': make_merge_into,
+        }
+        self.templates_shadow = { #elsewhere shadow table is created from reflected table and indexes are created by swap
+            'postgresql': 'create {unlogged}table {shadow} (like {table} including all)',
+            'mysql': 'create table {shadow} like {table}',
+        }
+        self.templates_drop_table = {
+            'oracle': "begin execute immediate 'drop table {table}'; exception when others then if sqlcode != -942 then raise; end if; end;",
+            'default': 'drop table if exists {table}',
+        }
+        self.templates_owned_sequences = { #sequences of serial columns, which are shared by defaults of shadow table
+            'postgresql': "select format('%I.%I', n.nspname, s.relname), a.attname from pg_depend d "
+                          "join pg_class s on s.oid = d.objid and s.relkind = 'S' join pg_namespace n on n.oid = s.relnamespace "
+                          "join pg_attribute a on a.attrelid = d.refobjid and a.attnum = d.refobjsubid "
+                          "where d.refobjid = cast(:table as regclass) and d.deptype = 'a'",
+        }
+        self.templates_swap = {
+            'mysql': ['rename table {table} to {old}, {shadow} to {table}', 'drop table {old}'],
+            'mssql': ["exec sp_rename '{table}', '{old_name}'", "exec sp_rename '{shadow}', '{table_name}'", 'drop table {old}'],
+            'default': ['alter table {table} rename to {old_name}', 'alter table {shadow} rename to {table_name}', 'drop table {old}'],
+        }
         self.make_query = sqlalchemy.text
+        self.exc = sqlalchemy.exc
+        self.reflect_table = lambda table_name, schema: sqlalchemy.Table(table_name, sqlalchemy.MetaData(), schema=schema, autoload_with=self.conn)
+        self.copy_table = lambda table, table_name, schema: table.to_metadata(sqlalchemy.MetaData(), schema=schema, name=table_name)
+        self.ddl = sqlalchemy.schema
+        self.inspect = sqlalchemy.inspect
         self.make_table = lambda table_name, col_names: make_table_(table_name, col_names)
         self.active_insert = None
         self.active_cursor = None
+        self.active_names = None
+        self.active_staging = None
+        self.active_transaction = None
+        self.active_raw_insert = None
+        self.active_statement = None
+        self.load_profile = connection_config.get('load_profile', False)
+        self.session_saved = {}
+        if self.load_profile and self.dialect not in self.templates_session:
+            raise ValueError('load_profile is not supported for dialect {}'.format(self.dialect))
 
     def _execute(self, *args, **kwargs):
         try:
             return self.conn.execute(*args, **kwargs)
         except ConnectionError:
+            if self.active_transaction is not None: #uncommitted data is lost with connection, can not retry silently
+                raise
             self.conn = self.engine.connect()
             return self.conn.execute(*args, **kwargs)
 
-    def get_latest_rid(self, config):
-        query = self.make_query(self.template_select_rid.format(
+    def _execute_script(self, statements, params=None):
+        if self.active_transaction is not None:
+            for stmt in statements:
+                self.conn.execute(self.make_query(stmt), params or {})
+            return
+        with self.conn.begin():
+            for stmt in statements:
+                self.conn.execute(self.make_query(stmt), params or {})
+
+    def _session_profile(self, kind):
+        """
+        Session settings of `load_profile` for `insert` or `fetch`: defaults of dialect updated by dict from config (None drops setting).
+        """
+        if not self.load_profile:
+            return {}
+        profile = dict(self.templates_load_profile.get(self.dialect, {}).get(kind, {}))
+        if isinstance(self.load_profile, dict):
+            profile.update(self.load_profile.get(kind) or {})
+        return {k: v for k, v in profile.items() if v is not None}
+
+    def _set_session(self, name, value):
+        value = value if isinstance(value, (int, float)) else "'{}'".format(str(value).replace("'", "''"))
+        query = self.make_query(self.templates_session[self.dialect][1].format(name=name, value=value))
+        self._execute(query.execution_options(autocommit=True)).close()
+
+    def _apply_session(self, kind):
+        """
+        Apply session settings of `load_profile`, saving current values to restore them afterwards.
+        """
+        settings = self._session_profile(kind)
+        if not settings or kind in self.session_saved:
+            return
+        saved = self.session_saved[kind] = {}
+        for name, value in settings.items():
+            saved[name] = self._execute(self.make_query(self.templates_session[self.dialect][0].format(name=name))).scalar()
+            self._set_session(name, value)
+
+    def _restore_session(self, kind):
+        saved = self.session_saved.pop(kind, {})
+        for name, value in reversed(list(saved.items())):
+            if value is not None:
+                self._set_session(name, value)
+
+    def is_retriable(self, exc):
+        if isinstance(exc, (ConnectionError, TimeoutError)):
+            return True
+        if self.raw and isinstance(exc, self.engine.dialect.dbapi.OperationalError): #raised by DBAPI cursor as is
+            return True
+        return isinstance(exc, self.exc.DBAPIError) and (exc.connection_invalidated or isinstance(exc, self.exc.OperationalError))
+
+    def features(self):
+        return {'full-refresh', 'incremental', 'merge', 'sync-deletes', 'pushdown'}
+
+    def colocated(self, other):
+        """
+        Check whether other engine is connected to the same database as the same user (with the same options, e.g. search_path),
+        so that its tables could be queried from this one.
+        """
+        if not isinstance(other, SQLAlchemyEngine):
+            return False
+        url, other_url = self.engine.url, other.engine.url
+        if url.database in (None, '', ':memory:'):
+            return False
+        return (url.get_backend_name(), url.host, url.port, url.database, url.username, dict(url.query)) \
+                == (other_url.get_backend_name(), other_url.host, other_url.port, other_url.database, other_url.username, dict(other_url.query))
+
+    def clone(self):
+        """
+        Make new engine with separate connection to the same database.
+        """
+        return type(self)(self.connection_config)
+
+    def reconnect(self):
+        try:
+            for kind in list(self.session_saved): #connection is returned to pool
+                self._restore_session(kind)
+            self.conn.close()
+        except Exception: #connection may be already broken
+            pass
+        self.conn = self.engine.connect()
+        self.session_saved = {}
+        self.active_transaction = None
+        self.active_cursor = None
+
+    def begin_transaction(self):
+        if self.active_transaction is None:
+            self.active_transaction = self.conn.begin()
+
+    def commit(self):
+        if self.active_transaction is not None:
+            self.active_transaction.commit()
+            self.active_transaction = None
+
+    def rollback(self):
+        if self.active_transaction is not None:
+            self.active_transaction.rollback()
+            self.active_transaction = None
+
+    def render_columns(self, columns, quote=False):
+        """
+        Render select list: `*` by default, string as is or list of column names (quoted when they are not plain identifiers).
+        With `quote` names are exact (e.g. reflected for `columns: auto`), so they are quoted by dialect whenever case needs it.
+        """
+        if not columns:
+            return '*'
+        if isinstance(columns, str):
+            return columns
+        if quote:
+            return ', '.join(self.engine.dialect.identifier_preparer.quote(x) for x in columns)
+        return ', '.join(x if re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', x) else self.engine.dialect.identifier_preparer.quote(x) for x in columns)
+
+    def _render(self, template, config, min_rid=None, max_rid=None, descending=True):
+        where = config.get('where')
+        rid = config.get('rid')
+        fields = {}
+        if isinstance(rid, (list, tuple)): #composite rid -- values are bound as :rid_min0, :rid_max0, ... (see `rid_params`)
+            columns = [self.render_columns([x]) for x in rid]
+            compare = self.templates_rid_comparison.get(self.dialect, self.templates_rid_comparison['default'])
+            fields['rid'] = ', '.join(columns)
+            fields['rid_after'] = compare(columns, '>', 'rid_min')
+            fields['rid_upto'] = compare(columns, '<=', 'rid_max')
+            fields['rid_not_null'] = ' and '.join('{} is not null'.format(x) for x in columns)
+            fields['rid_order'] = ', '.join(x + (' desc' if descending else '') for x in columns)
+        else:
+            fields['rid'] = rid
+            fields['rid_after'] = '{} > {}'.format(rid, min_rid)
+            fields['rid_upto'] = '{} <= {}'.format(rid, max_rid)
+        return template.format(
             src='({}) t'.format(config['query']) if 'query' in config else config['table'],
-            rid=config['rid']
-        ))
+            rid_value=min_rid,
+            rid_max=max_rid,
+            columns=self.render_columns(config.get('columns'), config.get('quote_columns', False)),
+            where=' where ({})'.format(where) if where else '',
+            filter=' and ({})'.format(where) if where else '',
+            **fields
+        )
+
+    def rid_params(self, config, min_rid=None, max_rid=None):
+        """
+        Bind parameters of rid bounds for rendered queries: values of composite rid (tuples), empty for single column rid.
+        """
+        rid = config.get('rid')
+        if not isinstance(rid, (list, tuple)):
+            return {}
+        params = {}
+        for prefix, value in [('rid_min', min_rid), ('rid_max', max_rid)]:
+            if value is None:
+                continue
+            if not isinstance(value, (list, tuple)) or len(value) != len(rid):
+                raise ValueError('Value of composite rid {} should be tuple of {} values, but got {}'.format(rid, len(rid), value))
+            params.update({'{}{}'.format(prefix, i): x for i, x in enumerate(value)})
+        return params
+
+    def _get_rid_row(self, config, descending):
+        template = self.templates_select_rid_row.get(self.dialect, self.templates_select_rid_row['default'])
+        row = self._execute(self.make_query(self._render(template, config, descending=descending))).first()
+        return tuple(row) if row is not None else None
+
+    def get_latest_rid(self, config):
+        if isinstance(config.get('rid'), (list, tuple)):
+            return self._get_rid_row(config, descending=True)
+        query = self.make_query(self._render(self.template_select_rid, config))
         res = self._execute(query).fetchall()
         if res is None or len(res) == 0:
             return None
         return res[0][0]
 
+    def get_earliest_rid(self, config):
+        if isinstance(config.get('rid'), (list, tuple)):
+            return self._get_rid_row(config, descending=False)
+        return self._execute(self.make_query(self._render(self.template_select_min_rid, config))).scalar()
+
+    def render_incremental_fetch(self, config, min_rid):
+        template = self.template_select_inc if min_rid is not None else self.template_select_inc_null
+        return self._render(template, config, min_rid)
+
+    def render_full_fetch(self, config):
+        return self._render(self.template_select_all, config)
+
+    def render_range_fetch(self, config, min_rid, max_rid):
+        template = self.template_select_range if min_rid is not None else self.template_select_range_null
+        return self._render(template, config, min_rid, max_rid)
+
+    def _execute_raw(self, query, params=None):
+        cursor = self.conn.connection.cursor()
+        if not params:
+            cursor.execute(query)
+            return cursor
+        compiled = self.make_query(query).compile(dialect=self.engine.dialect) #named binds into paramstyle of driver
+        values = compiled.construct_params(params)
+        cursor.execute(str(compiled), [values[x] for x in compiled.positiontup] if compiled.positional else values)
+        return cursor
+
+    def _execute_fetch(self, config, query, params=None, profile=True, stream=False):
+        if profile: #read-only settings are not applied to fetches of dst (e.g. keys to delete)
+            self._apply_session('fetch')
+        if self.raw:
+            return self._execute_raw(query, params)
+        query = self.make_query(query)
+        if config.get('reflect') and 'table' in config: #typed result, values are converted by reflected types of table
+            query = query.columns(**{x.name: x.type for x in self._reflected_table(config['table']).columns})
+        if (stream or self.load_profile or 'max_batch_bytes' in config) and self.engine.dialect.supports_server_side_cursors:
+            query = query.execution_options(stream_results=True) #rows are streamed instead of buffered by driver
+        return self._execute(query, params or {})
+
     def begin_incremental_fetch(self, config, min_rid):
-        template = self.template_select_inc if min_rid else self.template_select_inc_null
-        query = self.make_query(template.format(
-            src='({}) t'.format(config['query']) if 'query' in config else config['table'],
-            rid=config['rid'],
-            rid_value=min_rid
-        ))
-        self.active_cursor = self._execute(query)
+        query = self.render_incremental_fetch(config, min_rid)
+        self.active_cursor = self._execute_fetch(config, query, self.rid_params(config, min_rid))
 
     def begin_full_fetch(self, config):
-        query = self.make_query(self.template_select_all.format(
-            src='({}) t'.format(config['query']) if 'query' in config else config['table']
-        ))
-        self.active_cursor = self._execute(query)
+        query = self.render_full_fetch(config)
+        self.active_cursor = self._execute_fetch(config, query)
+
+    def begin_range_fetch(self, config, min_rid, max_rid):
+        """
+        Fetch rows with rid in (`min_rid`, `max_rid`] ordered by rid (without lower bound if `min_rid` is None).
+        """
+        query = self.render_range_fetch(config, min_rid, max_rid)
+        self.active_cursor = self._execute_fetch(config, query, self.rid_params(config, min_rid, max_rid))
+
+    def begin_key_fetch(self, config, key):
+        """
+        Fetch values of key columns (list) ordered by them.
+        """
+        query = self._render(self.template_select_keys, dict(config, columns=key))
+        self.active_cursor = self._execute_fetch(config, query, profile=False, stream=True) #keys of the whole table
+
+    def count_rows(self, config, min_rid=None):
+        template = self.template_count_inc if min_rid is not None else self.template_count_all
+        return self._execute(self.make_query(self._render(template, config, min_rid)), self.rid_params(config, min_rid)).scalar()
+
+    def delete_rows(self, config, min_rid=None, max_rid=None):
+        """
+        Delete rows with rid greater than `min_rid` (every row if it is None) and not greater than `max_rid` (if given).
+        """
+        if max_rid is not None:
+            template = self.template_delete_range if min_rid is not None else self.template_delete_range_null
+        else:
+            template = self.template_delete_inc if min_rid is not None else self.template_delete_all
+        self._execute_script([self._render(template, dict(config, columns=None), min_rid, max_rid)], self.rid_params(config, min_rid, max_rid))
+
+    def delete_keys(self, config, key, values):
+        """
+        Delete rows with given values (list of tuples) of key columns (list) by single executemany.
+        """
+        if not values:
+            return
+        condition = ' and '.join('{} = :k{}'.format(self.render_columns([x]), i) for i, x in enumerate(key))
+        query = self.make_query(self.template_delete_keys.format(table=config['table'], condition=condition))
+        params = [{'k{}'.format(i): x for i, x in enumerate(row)} for row in values]
+        if self.active_transaction is not None:
+            self._execute(query, params)
+            return
+        with self.conn.begin():
+            self.conn.execute(query, params)
+
+    def has_table(self, config):
+        schema, _, name = config['table'].rpartition('.')
+        return self.inspect(self.conn).has_table(name, schema=schema or None)
+
+    def get_column_types(self, config):
+        """
+        Reflect columns of table as list of (name, type), types are converted to generic SQLAlchemy types
+        where possible, so that they could be rendered by other dialect. None for query.
+        """
+        if 'query' in config:
+            return None
+        def generic_(x):
+            try:
+                return x.as_generic()
+            except NotImplementedError:
+                return x
+        return [(x.name, generic_(x.type)) for x in self._reflected_table(config['table']).columns]
+
+    def create_table(self, config, column_types):
+        """
+        Create table from list of (name, type). Types are rendered by dialect or by `type_map` of config,
+        mapping name of type (e.g. `String`) to DDL of column type.
+        """
+        type_map = config.get('type_map') or {}
+        columns = ', '.join('{} {}'.format(self.render_columns([name]),
+                                           type_map.get(type(x).__name__) or x.compile(dialect=self.engine.dialect))
+                            for name, x in column_types)
+        self._execute_script([self.template_create_table.format(table=config['table'], columns=columns)])
+        self.forget_table(config['table'])
+
+    def get_columns(self, config):
+        """
+        Reflect names of columns of table (None for query).
+        """
+        if 'query' in config:
+            return None
+        schema, _, name = config['table'].rpartition('.')
+        return [x['name'] for x in self.inspect(self.conn).get_columns(name, schema=schema or None)]
+
+    def estimate_rows(self, config):
+        """
+        Estimate number of rows in table from database statistics (None if not available, or rows are filtered by `where`).
+        """
+        if 'query' in config or config.get('where') or self.dialect not in self.templates_estimate:
+            return None
+        schema, _, name = config['table'].rpartition('.')
+        res = self._execute(self.make_query(self.templates_estimate[self.dialect]), {'table': config['table'], 'name': name}).fetchall()
+        if not res or res[0][0] is None or res[0][0] < 0:
+            return None
+        return int(res[0][0])
+
+    def explain(self, query, params=None):
+        if self.dialect not in self.templates_explain:
+            return None
+        res = self._execute(self.make_query(self.templates_explain[self.dialect].format(query=query)), params or {}).fetchall()
+        return '\n'.join(' '.join(str(v) for v in row) for row in res)
+
+    def _reflected_table(self, table_name, col_names=None):
+        key = (self.connection_config['conn-str'], table_name)
+        with reflected_tables_lock:
+            if key not in reflected_tables:
+                schema, _, name = table_name.rpartition('.')
+                reflected_tables[key] = self.reflect_table(name, schema or None)
+            return reflected_tables[key]
+
+    def forget_table(self, table_name):
+        """
+        Drop reflected table from cache of process (e.g. after its DDL changed).
+        """
+        with reflected_tables_lock:
+            reflected_tables.pop((self.connection_config['conn-str'], table_name), None)
+
+    def forget_tables(self):
+        with reflected_tables_lock:
+            for key in [x for x in reflected_tables if x[0] == self.connection_config['conn-str']]:
+                del reflected_tables[key]
 
     def begin_insert(self, config):
-        self.active_insert = functools.partial(self.make_table, table_name=config['table'])
+        """
+        Prepare insert into table. With `reflect: true` (or `auto_create`) in config table is reflected once per process,
+        so that insert is typed, otherwise it is built from bare names of columns.
+        """
+        make_table = self._reflected_table if config.get('reflect') or config.get('auto_create') else self.make_table
+        self.active_insert = functools.partial(make_table, table_name=config['table'])
+        self.active_statement = None
+        self._apply_session('insert')
+
+    def end_insert(self):
+        """
+        Finish insert started by `begin_insert`, restoring session settings changed by `load_profile`.
+        """
+        self._restore_session('insert')
+
+    def end_fetch(self):
+        """
+        Close unfinished fetch, so that its server-side cursor (and transaction holding it) is released.
+        """
+        if self.active_cursor is not None:
+            self.active_cursor.close()
+            self.active_cursor = None
+        self._restore_session('fetch')
 
     def fetch_batch(self, batch_size):
         if not self.active_cursor:
             raise Exception()
-        keys = list(self.active_cursor.keys())
-        return keys, self.active_cursor.fetchmany(batch_size)
+        if self.raw:
+            names, batch = [x[0] for x in self.active_cursor.description], self.active_cursor.fetchmany(batch_size)
+        else:
+            names, batch = list(self.active_cursor.keys()), self.active_cursor.fetchmany(batch_size)
+        if not batch and 'fetch' in self.session_saved: #fetch is read till the end
+            self._restore_session('fetch')
+        return names, batch
+
+    def begin_staging(self, config):
+        table = config['table']
+        staging = config.get('staging_table', ('#' if self.dialect == 'mssql' else '') + table.split('.')[-1] + '_dbrep_stage')
+        template_create, template_drop = self.templates_staging.get(self.dialect, self.templates_staging['default'])
+        self._execute_script([
+            template_drop.format(staging=staging),
+            template_create.format(staging=staging, table=table),
+        ])
+        self.active_staging = template_drop.format(staging=staging)
+        self.active_names = None
+        self.active_insert = functools.partial(self.make_table, table_name=staging)
+        self.active_statement = None
+
+    def merge_staging(self, config):
+        if not self.active_staging:
+            raise Exception('Staging table was not created, call begin_staging first')
+        keys = [config['key']] if isinstance(config['key'], str) else list(config['key'])
+        names = self.active_names
+        statements = []
+        if names:
+            missing = [k for k in keys if k not in names]
+            if missing:
+                raise ValueError('Merge keys {} are absent from replicated columns {}'.format(missing, names))
+            updates = [x for x in names if x not in keys]
+            template = self.templates_merge.get(self.dialect, self.templates_merge['default'])
+            statements.append(template(config['table'], self.active_insert.keywords['table_name'], names, keys, updates))
+        statements.append(self.active_staging)
+        self._execute_script(statements)
+        self.active_staging = None
+
+    def _shadow_names(self, config):
+        table = config['table']
+        shadow = config.get('shadow_table', table + '_dbrep_shadow')
+        return table, shadow, table + '_dbrep_old'
+
+    def _drop_table(self, table):
+        return self.templates_drop_table.get(self.dialect, self.templates_drop_table['default']).format(table=table)
+
+    def _reflect_shadow(self, config):
+        """
+        Return (DDL of shadow table, DDL of indexes) copied from reflected table: columns with declared types, nullability,
+        defaults, primary key, unique and check constraints (unnamed, as names are unique per schema), but not foreign keys.
+        Indexes keep their names, so they are created on swapped table after the old one is dropped.
+        """
+        table, shadow, _ = self._shadow_names(config)
+        schema, _, name = table.rpartition('.')
+        source = self.reflect_table(name, schema or None)
+        shadow_schema, _, shadow_name = shadow.rpartition('.')
+        target = self.copy_table(source, shadow_name, shadow_schema or None)
+        for constraint in target.constraints:
+            constraint.name = None
+        compile_ = lambda x: str(x.compile(dialect=self.engine.dialect))
+        return compile_(self.ddl.CreateTable(target, include_foreign_key_constraints=[])), [compile_(self.ddl.CreateIndex(x)) for x in source.indexes]
+
+    def begin_shadow(self, config):
+        table, shadow, _ = self._shadow_names(config)
+        unlogged = config.get('shadow_unlogged', False) and self.dialect == 'postgresql'
+        if 'shadow_create' in config or self.dialect in self.templates_shadow:
+            template = config.get('shadow_create', self.templates_shadow.get(self.dialect))
+            create = template.format(shadow=shadow, table=table, unlogged='unlogged ' if unlogged else '')
+        else:
+            create, _ = self._reflect_shadow(config)
+        self._execute_script([self._drop_table(shadow), create])
+        self.forget_table(shadow)
+        return dict(config, table=shadow)
+
+    def drop_shadow(self, config):
+        _, shadow, _ = self._shadow_names(config)
+        self._execute_script([self._drop_table(shadow)])
+
+    def swap_shadow(self, config):
+        table, shadow, old = self._shadow_names(config)
+        statements = []
+        if config.get('shadow_unlogged', False) and self.dialect == 'postgresql':
+            statements.append('alter table {} set logged'.format(shadow))
+        if self.dialect in self.templates_owned_sequences: #otherwise old table could not be dropped, as its sequences are used by shadow
+            owned = self._execute(self.make_query(self.templates_owned_sequences[self.dialect]), {'table': table}).fetchall()
+            quote = self.engine.dialect.identifier_preparer.quote
+            statements += ['alter sequence {} owned by {}.{}'.format(seq, shadow, quote(col)) for seq, col in owned]
+        templates = self.templates_swap.get(self.dialect, self.templates_swap['default'])
+        statements += [x.format(table=table, shadow=shadow, old=old,
+                                table_name=table.split('.')[-1], old_name=old.split('.')[-1])
+                        for x in templates]
+        if 'shadow_create' not in config and self.dialect not in self.templates_shadow: #indexes of reflected table
+            statements += self._reflect_shadow(config)[1]
+        self._execute_script(statements)
+        self.forget_table(table)
+
+    def drop_indexes(self, config):
+        """
+        Drop secondary indexes and foreign keys of destination table.
+        Returns DDL to rebuild them later with `rebuild_indexes`.
+        """
+        schema, _, name = config['table'].rpartition('.')
+        table = self.reflect_table(name, schema or None)
+        compile_ = lambda x: str(x.compile(dialect=self.engine.dialect))
+        fkeys = [] if self.dialect == 'sqlite' else [x for x in table.foreign_key_constraints if x.name]
+        indexes = list(table.indexes)
+        drop = [compile_(self.ddl.DropConstraint(x)) for x in fkeys] + [compile_(self.ddl.DropIndex(x)) for x in indexes]
+        if drop:
+            self._execute_script(drop)
+        return {
+            'indexes': [compile_(self.ddl.CreateIndex(x)) for x in indexes],
+            'constraints': [compile_(self.ddl.AddConstraint(x)) for x in fkeys],
+        }
+
+    def rebuild_indexes(self, captured, workers=1):
+        def execute_(stmt):
+            with self.engine.connect() as conn:
+                with conn.begin():
+                    conn.execute(self.make_query(stmt))
+        indexes = captured.get('indexes', [])
+        if workers > 1 and len(indexes) > 1:
+            with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+                list(executor.map(execute_, indexes))
+        elif indexes:
+            self._execute_script(indexes)
+        if captured.get('constraints'): #foreign keys may depend on rebuilt indexes
+            self._execute_script(captured['constraints'])
+
+    def _insert_batch_raw(self, names, batch):
+        table = self.active_insert.keywords['table_name']
+        if self.active_raw_insert is None or self.active_raw_insert[:2] != (table, names):
+            make_placeholder = self.templates_placeholder[self.engine.dialect.paramstyle]
+            query = self.template_insert.format(
+                table=table,
+                columns=', '.join(self.engine.dialect.identifier_preparer.quote(x) for x in names),
+                values=', '.join(make_placeholder(i, x) for i, x in enumerate(names))
+            )
+            self.active_raw_insert = (table, names, query)
+        query = self.active_raw_insert[2]
+        if self.engine.dialect.paramstyle == 'named':
+            batch = [{'p{}'.format(i): v for i, v in enumerate(x)} for x in batch]
+        cursor = self.conn.connection.cursor()
+        try:
+            cursor.executemany(query, batch)
+        finally:
+            cursor.close()
+        if self.active_transaction is None: #same as autocommit of SQLAlchemy
+            self.conn.connection.commit()
 
     def insert_batch(self, names, batch):
-        self._execute(self.active_insert(col_names=names).insert(), [dict(zip(names, x)) for x in batch])
+        self.active_names = names
+        if self.raw:
+            self._insert_batch_raw(names, batch)
+            return
+        if self.active_statement is None or self.active_statement[0] != names: #statement is built once per insert, so compiled one is reused from cache
+            table = self.active_insert(col_names=names)
+            if self.active_insert.func == self._reflected_table and any(x not in table.c for x in names):
+                self.forget_table(self.active_insert.keywords['table_name']) #values of columns absent from stale reflection would be silently dropped
+                table = self.active_insert(col_names=names)
+                missing = [x for x in names if x not in table.c]
+                if missing:
+                    raise ValueError('Columns {} are absent from table {}'.format(missing, table.fullname))
+            self.active_statement = (names, table.insert())
+        self._execute(self.active_statement[1], [dict(zip(names, x)) for x in batch])
+
+    def insert_select(self, config, columns, query, params=None, quote=False):
+        """
+        Insert result of query (e.g. rendered fetch of colocated src) into table on server side. Returns number of rows (if known).
+        """
+        res = self._execute(self.make_query(self.template_insert_select.format(
+            table=config['table'], columns=self.render_columns(columns, quote), query=query)), params or {})
+        return res.rowcount if res.rowcount is not None and res.rowcount >= 0 else None
 
     def truncate(self, config):
-        self._execute(self.truncate_template.format(config['table']))
+        self._execute_script([self.template_truncate.format(src=config['table'])])
 
     def create(self, config):
         self._execute(config['create'])
+        if 'table' in config:
+            self.forget_table(config['table'])
     
     def close(self):
+        if self.active_cursor is not None: #unfinished fetch (e.g. after failed insert) may keep lock after connection is closed
+            self.active_cursor.close()
+            self.active_cursor = None
         self.conn.close()
         self.engine.dispose()
 
@@ -0,0 +1,175 @@
+"""
+Fan-out replication: single scan of source pushed to several destinations (`dst` is list of destination configs).
+
+Each batch pulled from src is pushed to all destinations concurrently (one thread per destination).
+Every destination has its own `batch_size`, `commit_every`, throttling and watermark: in incremental mode src is
+fetched from the minimal latest rid over destinations and each destination skips rows it already has.
+Failure of one destination does not stop the others -- it is rolled back to its last commit and reported at the end.
+"""
+import concurrent.futures
+import logging
+import time
+
+from .replication import CommitTracker, batch_callbacks, make_rid_getter, new_stats, pull_batch, push_batch
+from .throttle import make_batch_budget, make_throttle
+
+logger = logging.getLogger(__name__)
+
+class FanoutError(Exception):
+    """
+    Raised when some of destinations failed, while others were replicated. Contains run result in `result`.
+    """
+    def __init__(self, message, result):
+        super().__init__(message)
+        self.result = result
+
+class Sink:
+    def __init__(self, idx, engine, config):
+        self.idx = idx
+        self.engine = engine
+        self.config = config
+        self.batch_size = config.get('batch_size', 1000)
+        self.throttle = make_throttle(config)
+        self.budget = make_batch_budget(config)
+        self.stats = new_stats()
+        self.tracker = CommitTracker(engine, config.get('commit_every'), self.stats)
+        self.rid = None
+        self.error = None
+
+    @property
+    def name(self):
+        return '<dst[{}]> {}'.format(self.idx, self.config.get('table', ''))
+
+    def push(self, names, batch, get_rid):
+        if not batch:
+            return
+        self.tracker.before_push(get_rid(batch[0]) if get_rid else None)
+        push_batch(self.engine, names, batch, self.batch_size, self.throttle, self.budget)
+        self.tracker.after_push(len(batch), get_rid(batch[-1]) if get_rid else None)
+
+    def fail(self, exc):
+        logger.error('Replication to {} failed: {}'.format(self.name, exc))
+        self.error = exc
+        try:
+            self.tracker.abort()
+        except Exception:
+            logger.exception('Failed to rollback {}'.format(self.name))
+
+def skip_written(batch, get_rid, rid):
+    """
+    Drop rows with rid not greater than `rid` from batch ordered by rid.
+    """
+    if rid is None or get_rid is None or not batch:
+        return batch
+    lo, hi = 0, len(batch)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if get_rid(batch[mid]) <= rid:
+            lo = mid + 1
+        else:
+            hi = mid
+    return batch[lo:]
+
+def validate_fanout_config(config):
+    if config['mode'] not in ('full-refresh', 'incremental'):
+        raise ValueError('Multiple destinations are supported only in full-refresh and incremental modes, but got {}'.format(config['mode']))
+    if config['src'].get('columns') == 'auto':
+        raise ValueError('columns: auto is not supported with multiple destinations, list columns explicitly')
+    for dst in config['dst']:
+        unsupported = [k for k in ['swap', 'defer_indexes', 'writers_key', 'auto_create'] if dst.get(k)] + (['writers'] if dst.get('writers', 1) != 1 else [])
+        if unsupported:
+            raise ValueError('Options {} are not supported with multiple destinations'.format(unsupported))
+
+def fanout_replication(src_engine, dst_engines, config):
+    """
+    Replicate src into all destinations from `config['dst']` (list) reading src only once.
+    Returns run result with per-destination stats in `destinations`. Raises FanoutError if some destinations failed.
+    """
+    validate_fanout_config(config)
+    if len(dst_engines) != len(config['dst']):
+        raise ValueError('Expected {} destination engines, but got {}'.format(len(config['dst']), len(dst_engines)))
+    start = time.perf_counter()
+    sinks = [Sink(i, engine, cfg) for i, (engine, cfg) in enumerate(zip(dst_engines, config['dst']))]
+    incremental = config['mode'] == 'incremental'
+    rid = config['src']['rid'] if incremental else None
+    result = {'batches': 0, 'rows': 0}
+
+    if incremental:
+        src_rid = src_engine.get_latest_rid(config['src'])
+        for sink in sinks:
+            try:
+                sink.rid = sink.engine.get_latest_rid(sink.config)
+            except Exception as e:
+                sink.fail(e)
+        ready = [x for x in sinks if x.error is None]
+        logger.info('Latest rids: <src>={}, <dst>={}'.format(src_rid, [x.rid for x in ready]))
+        if src_rid is None or all(x.rid is not None and x.rid >= src_rid for x in ready):
+            logger.info('All destinations are up to date.')
+            ready = []
+        else:
+            min_rid = None if any(x.rid is None for x in ready) else min(x.rid for x in ready)
+            src_engine.begin_incremental_fetch(config['src'], min_rid)
+    else:
+        for sink in sinks:
+            try:
+                if sink.config.get('truncate', False):
+                    sink.engine.truncate(sink.config)
+            except Exception as e:
+                sink.fail(e)
+        ready = [x for x in sinks if x.error is None]
+        if ready:
+            src_engine.begin_full_fetch(config['src'])
+
+    active = []
+    for sink in ready:
+        try:
+            sink.engine.begin_insert(sink.config)
+            sink.tracker.begin()
+            active.append(sink)
+        except Exception as e:
+            sink.fail(e)
+
+    src_throttle = make_throttle(config['src'])
+    src_budget = make_batch_budget(config['src'])
+    get_rid = None
+    with concurrent.futures.ThreadPoolExecutor(max(len(sinks), 1), thread_name_prefix='dbrep-sink') as executor:
+        while active:
+            names, data = pull_batch(src_engine, config['src'].get('batch_size', 1000), src_throttle, src_budget)
+            if data is None or len(data) == 0:
+                break
+            if result['batches'] == 0:
+                get_rid = make_rid_getter(names, rid)
+                if incremental and get_rid is None: #destinations ahead of the minimal rid could not skip rows they have
+                    error = ValueError('Incremental replication to multiple destinations requires rid {} among pulled columns {}'.format(rid, names))
+                    for sink in active:
+                        sink.fail(error)
+                    raise error
+            futures = {executor.submit(x.push, names, skip_written(data, get_rid, x.rid), get_rid): x for x in active}
+            for future, sink in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    sink.fail(e)
+            active = [x for x in active if x.error is None]
+            result['batches'] += 1
+            result['rows'] += len(data)
+            logger.info('Processed %s batch of size %s for %s destinations.', result['batches'], len(data), len(active))
+            for callback in batch_callbacks:
+                callback(result)
+
+    for sink in active:
+        try:
+            sink.tracker.finish()
+            sink.engine.end_insert()
+        except Exception as e:
+            sink.fail(e)
+
+    if src_budget:
+        result['peak_batch_bytes'] = src_budget.peak
+    result['destinations'] = [dict(x.stats, error=None if x.error is None else str(x.error)) for x in sinks]
+    result['duration'] = time.perf_counter() - start
+    failed = [x for x in sinks if x.error is not None]
+    if failed:
+        raise FanoutError('Replication failed for destinations: {}'.format(', '.join(x.name for x in failed)), result) from failed[0].error
+    logger.info('Replication finished: {}'.format(result))
+    return result
@@ -0,0 +1,133 @@
+"""
+Dry-run planner for replications. It resolves increment size and samples throughput of src,
+so that duration of the run could be predicted without writing anything into dst.
+
+Insert throughput is sampled only on request (`insert`): rows are inserted inside dst transaction which is rolled back
+afterwards, hence it requires transactional dst (e.g. it would write data into MySQL MyISAM tables).
+"""
+import logging
+import time
+
+from .replication import can_pushdown, push_batch, resolve_columns
+
+logger = logging.getLogger(__name__)
+
+def sample_fetch(src_engine, batch_size, num_batches):
+    """
+    Fetch up to `num_batches` batches from active cursor of src engine.
+    Returns names, fetched rows, latency of first batch and duration of fetching the rest.
+    """
+    rows = []
+    names = None
+    latency, duration = 0.0, 0.0
+    for i in range(num_batches):
+        start = time.perf_counter()
+        names, batch = src_engine.fetch_batch(batch_size)
+        elapsed = time.perf_counter() - start
+        if i == 0:
+            latency = elapsed #includes query execution before first row
+        else:
+            duration += elapsed
+        if batch is None or len(batch) == 0:
+            break
+        rows += batch
+        if len(batch) < batch_size:
+            break
+    return names, rows, latency, duration
+
+def sample_insert(dst_engine, dst_config, names, rows, batch_size):
+    """
+    Insert sampled rows into dst and roll them back. Returns duration of insert.
+    """
+    if not rows:
+        return 0.0
+    dst_engine.begin_insert(dst_config)
+    dst_engine.begin_transaction()
+    start = time.perf_counter()
+    try:
+        push_batch(dst_engine, names, rows, batch_size)
+        return time.perf_counter() - start
+    finally:
+        dst_engine.rollback()
+        dst_engine.end_insert()
+
+def plan_replication(src_engine, dst_engine, config, sample_batches = 3, insert = False):
+    """
+    Make plan of replication without writing anything into dst. Returns dict with increment size (`rows`),
+    measured throughput (rows per second), predicted duration (seconds) and query plans of src.
+    Insert throughput (and hence duration) is unknown, unless `insert` is set to sample insert into dst (rolled back).
+    """
+    config = dict(config, src=resolve_columns(config['src'], dst_engine, config['dst']))
+    mode = config['mode']
+    src_batch_size = config['src'].get('batch_size', 1000)
+    dst_batch_size = config['dst'].get('batch_size', 1000)
+    plan = {'mode': mode, 'src_rid': None, 'dst_rid': None, 'pushdown': can_pushdown(src_engine, dst_engine, config)}
+
+    if mode == 'full-refresh':
+        plan['rows'] = src_engine.estimate_rows(config['src'])
+        plan['rows_estimated'] = plan['rows'] is not None
+        if plan['rows'] is None:
+            plan['rows'] = src_engine.count_rows(config['src'])
+        query = src_engine.render_full_fetch(config['src'])
+    elif mode in ('incremental', 'merge'):
+        if mode == 'incremental':
+            plan['src_rid'] = src_engine.get_latest_rid(config['src'])
+        plan['dst_rid'] = dst_engine.get_latest_rid(config['dst'])
+        plan['rows'] = src_engine.count_rows(config['src'], plan['dst_rid'])
+        plan['rows_estimated'] = False
+        query = src_engine.render_incremental_fetch(config['src'], plan['dst_rid'])
+    else:
+        raise ValueError("Unsupported mode: {}. Should be full-refresh, incremental or merge".format(mode))
+    plan['src_query'] = query
+    plan['src_plan'] = src_engine.explain(query, src_engine.rid_params(config['src'], plan['dst_rid'])) if query else None
+
+    logger.info('Sampling up to {} batches from <src>...'.format(sample_batches))
+    if mode == 'full-refresh':
+        src_engine.begin_full_fetch(config['src'])
+    else:
+        src_engine.begin_incremental_fetch(config['src'], plan['dst_rid'])
+    try:
+        names, rows, latency, fetch_duration = sample_fetch(src_engine, src_batch_size, sample_batches)
+    finally:
+        src_engine.end_fetch() #the rest of increment is not read
+    insert_duration = None
+    if insert:
+        logger.info('Sampling insert of {} rows into <dst> (rolled back)...'.format(len(rows)))
+        insert_duration = sample_insert(dst_engine, config['dst'], names, rows, dst_batch_size)
+
+    fetched_after_first = max(len(rows) - src_batch_size, 0)
+    plan['sampled_rows'] = len(rows)
+    plan['first_batch_latency'] = latency
+    if fetched_after_first > 0 and fetch_duration > 0:
+        plan['fetch_rows_per_sec'] = fetched_after_first / fetch_duration
+    else: #single batch sampled -- latency is the only measure
+        plan['fetch_rows_per_sec'] = len(rows) / latency if rows and latency > 0 else None
+    plan['insert_rows_per_sec'] = len(rows) / insert_duration if rows and insert_duration else None
+
+    if plan['rows'] == 0:
+        plan['duration'] = latency
+    elif plan['fetch_rows_per_sec'] and plan['insert_rows_per_sec']:
+        plan['duration'] = latency + plan['rows'] / plan['fetch_rows_per_sec'] + plan['rows'] / plan['insert_rows_per_sec']
+    else:
+        plan['duration'] = None
+    return plan
+
+def format_plan(plan):
+    def format_rate_(x):
+        return 'n/a' if x is None else '{:.0f} rows/s'.format(x)
+    lines = [
+        'Mode: {}'.format(plan['mode']),
+        'Latest rids: <src>={}, <dst>={}'.format(plan['src_rid'], plan['dst_rid']),
+        'Rows to replicate: {}{}'.format(plan['rows'], ' (estimate from statistics)' if plan['rows_estimated'] else ''),
+        'Sampled rows: {}'.format(plan['sampled_rows']),
+        'First batch latency: {:.3f}s'.format(plan['first_batch_latency']),
+        'Fetch throughput: {}'.format(format_rate_(plan['fetch_rows_per_sec'])),
+        'Insert throughput: {}'.format(format_rate_(plan['insert_rows_per_sec']) if plan['insert_rows_per_sec'] or plan['rows'] == 0
+                                       else 'unknown (sample it with --plan-insert)'),
+        'Predicted duration: {}'.format('n/a' if plan['duration'] is None else '{:.1f}s'.format(plan['duration'])),
+        'Server-side insert (pushdown): {}'.format('yes' if plan.get('pushdown') else 'no'),
+        'Source query: {}'.format(plan['src_query']),
+    ]
+    if plan['src_plan']:
+        lines += ['Source query plan:', plan['src_plan']]
+    return '\n'.join(lines)
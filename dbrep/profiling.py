@@ -0,0 +1,132 @@
+"""
+Profiling hooks for replication runs.
+
+- `cpu` -- deterministic profile with cProfile of the thread starting replication (saved as `<output>.pstats`) and
+  sampled stacks of all threads, i.e. writers, fan-out sinks and catch-up ranges as well (saved as `<output>.collapsed`
+  in collapsed-stack format with thread name as root frame, suitable for flamegraph.pl or speedscope)
+- `mem` -- tracemalloc snapshots (allocations of all threads) taken every N batches processed by any of runs (saved as `<output>.mem.txt`)
+
+Both modes log top-N summary at the end of the run.
+"""
+import collections
+import contextlib
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import tracemalloc
+
+from .replication import add_batch_callback, remove_batch_callback
+
+logger = logging.getLogger(__name__)
+
+class StackSampler:
+    """
+    Sampling profiler: periodically captures stacks of given thread (or of all threads but itself) and counts identical stacks.
+    """
+    def __init__(self, thread_id = None, interval = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='dbrep-sampler', daemon=True)
+
+    def _sample(self):
+        frames = sys._current_frames()
+        if self.thread_id is not None:
+            frames = {self.thread_id: frames[self.thread_id]} if self.thread_id in frames else {}
+        names = {x.ident: x.name for x in threading.enumerate()}
+        for thread_id, frame in frames.items():
+            if thread_id == self._thread.ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append('{}:{}'.format(frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            if stack:
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed(self, fname):
+        with open(fname, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+@contextlib.contextmanager
+def profile_cpu(output, top = 20, interval = 0.005):
+    profiler = cProfile.Profile()
+    sampler = StackSampler(interval=interval) #cProfile sees only this thread, so sampler covers the rest
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        profiler.dump_stats(output + '.pstats')
+        sampler.write_collapsed(output + '.collapsed')
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(top)
+        logger.info('CPU profile saved to {0}.pstats and {0}.collapsed ({1} samples). Top {2} by cumulative time:\n{3}'.format(
+            output, sum(sampler.stacks.values()), top, summary.getvalue()))
+
+@contextlib.contextmanager
+def profile_mem(output, top = 20, every = 100, frames = 10):
+    snapshots = []
+    def take_snapshot_(stats):
+        if stats['batches'] % every == 0:
+            snapshots.append((stats['batches'], tracemalloc.take_snapshot()))
+
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start(frames)
+    snapshots.append((0, tracemalloc.take_snapshot()))
+    add_batch_callback(take_snapshot_)
+    try:
+        yield
+    finally:
+        remove_batch_callback(take_snapshot_)
+        snapshots.append(('end', tracemalloc.take_snapshot()))
+        current, peak = tracemalloc.get_traced_memory()
+        if not was_tracing:
+            tracemalloc.stop()
+
+        base = snapshots[0][1]
+        with open(output + '.mem.txt', 'w') as f:
+            f.write('Traced memory: current={} bytes, peak={} bytes\n'.format(current, peak))
+            for label, snapshot in snapshots[1:]:
+                f.write('\nSnapshot after batch {}, top {} differences from start:\n'.format(label, top))
+                for stat in snapshot.compare_to(base, 'lineno')[:top]:
+                    f.write('{}\n'.format(stat))
+        summary = '\n'.join(str(x) for x in snapshots[-1][1].statistics('lineno')[:top])
+        logger.info('Memory profile saved to {} ({} snapshots), peak traced memory {} bytes. Top {} allocations at the end:\n{}'.format(
+            output + '.mem.txt', len(snapshots), peak, top, summary))
+
+@contextlib.contextmanager
+def profile_none():
+    yield
+
+def profile_run(kind, output = 'dbrep-profile', top = 20, every = 100):
+    """
+    Make context manager profiling everything run within it: `cpu`, `mem` or None (no profiling).
+    """
+    if kind is None:
+        return profile_none()
+    if kind == 'cpu':
+        return profile_cpu(output, top)
+    if kind == 'mem':
+        return profile_mem(output, top, every)
+    raise ValueError('Unsupported profile kind: {}. Should be cpu or mem'.format(kind))
@@ -1,58 +1,670 @@
 
-from asyncio.log import logger
 import functools
 import logging
+import time
 from typing import Callable
 
+from .cache import CachedEngine, SnapshotCache
+from .throttle import make_batch_budget, make_throttle
+
 logger = logging.getLogger(__name__)
 
-def push_batch(engine, names, data, batch_size):
+batch_callbacks = []
+
+def add_batch_callback(callback: Callable[[dict], None]):
+    """
+    Register callback invoked with run stats after every processed batch (e.g. by profilers).
+    """
+    batch_callbacks.append(callback)
+
+def remove_batch_callback(callback: Callable[[dict], None]):
+    batch_callbacks.remove(callback)
+
+# Logging in per-batch functions uses lazy %-formatting, so that disabled levels cost nothing in hot loop
+def push_batch(engine, names, data, batch_size, throttle=None, budget=None):
+    if budget:
+        budget.observe(data)
+        batch_size = min(batch_size, budget.rows())
     for off in range(0, len(data), batch_size):
         batch = data[off:(off + batch_size)]
-        logger.debug('Pushing dst-batch [{}:{}] of size {}'.format(off, min(len(batch), off+batch_size), len(batch)))
+        logger.debug('Pushing dst-batch [%s:%s] of size %s', off, off + len(batch), len(batch))
+        start = time.perf_counter()
         engine.insert_batch(names, batch)
-        logger.debug('Pushed dst-batch [{}:{}] of size {}'.format(off, min(len(batch), off+batch_size), len(batch)))
+        if throttle:
+            throttle(batch, time.perf_counter() - start)
+        logger.debug('Pushed dst-batch [%s:%s] of size %s', off, off + len(batch), len(batch))
 
-def pull_batch(engine, batch_size):
+def pull_batch(engine, batch_size, throttle=None, budget=None):
     logger.debug('Pulling src-batch')
-    names, batch = engine.fetch_batch(batch_size)
-    logger.debug('Pulled src-batch of size {}'.format(len(batch)))
+    start = time.perf_counter()
+    names, batch = engine.fetch_batch(min(batch_size, budget.rows()) if budget else batch_size)
+    if throttle and batch:
+        throttle(batch, time.perf_counter() - start)
+    if budget and batch:
+        budget.observe(batch)
+    logger.debug('Pulled src-batch of size %s', len(batch))
     return names, batch
 
-def run_pull_push(src_engine, dst_engine, src_batch_size = 1000, dst_batch_size = 1000):
-    counter = 0
-    while True:
-        names, data = pull_batch(src_engine, src_batch_size)
-        if data is None or len(data) == 0:
-            return
-        push_batch(dst_engine, names, data, dst_batch_size)
-        counter += 1
-        logging.info('Processed {} batch of size {}.'.format(counter, len(data)))
+def parse_commit_every(value):
+    """
+    Parse `commit_every` option into (unit, count), where unit is `batches`, `rows` or `run`.
+    Accepts integer (number of pulled batches), strings like `10 batches` / `50000 rows` or `run` (single transaction).
+    """
+    if value is None:
+        return 'batches', 1
+    if isinstance(value, int) and not isinstance(value, bool):
+        count, unit = value, 'batches'
+    elif isinstance(value, str) and value.strip() == 'run':
+        return 'run', None
+    elif isinstance(value, str):
+        parts = value.split()
+        if len(parts) not in (1, 2) or not parts[0].isdigit() or (len(parts) == 2 and parts[1] not in ('batches', 'rows')):
+            raise ValueError('commit_every should be `<N> batches`, `<N> rows` or `run`, but got {}'.format(value))
+        count, unit = int(parts[0]), parts[1] if len(parts) == 2 else 'batches'
+    else:
+        raise TypeError('commit_every should be int or str, but got {}'.format(type(value)))
+    if count <= 0:
+        raise ValueError('commit_every should be positive, but got {}'.format(value))
+    return unit, count
+
+def make_rid_getter(names, rid):
+    """
+    Make function extracting rid from row of pulled batch (or None if rid is not among pulled columns).
+    For composite rid (list of columns) rid of row is tuple.
+    """
+    if rid is None:
+        return None
+    if isinstance(rid, (list, tuple)):
+        getters = [make_rid_getter(names, x) for x in rid]
+        if not all(getters):
+            return None
+        return lambda row: tuple(f(row) for f in getters)
+    lowered = [x.lower() for x in names]
+    if rid in names:
+        idx = names.index(rid)
+    elif rid.lower() in lowered:
+        idx = lowered.index(rid.lower())
+    else:
+        logger.warning('Rid {} is not among pulled columns {}, commits will not be aligned with it'.format(rid, names))
+        return None
+    return lambda row: row[idx]
+
+def make_pull_push_options(config):
+    """
+    Make keyword arguments of `run_pull_push` from replication config.
+    """
+    return {
+        'src_batch_size': config['src'].get('batch_size', 1000),
+        'dst_batch_size': config['dst'].get('batch_size', 1000),
+        'commit_every': config['dst'].get('commit_every'),
+        'src_throttle': make_throttle(config['src']),
+        'dst_throttle': make_throttle(config['dst']),
+        'src_budget': make_batch_budget(config['src']),
+        'dst_budget': make_batch_budget(config['dst']),
+        'writers': config['dst'].get('writers', 1),
+        'writers_key': config['dst'].get('writers_key'),
+    }
+
+def new_stats():
+    return {'batches': 0, 'rows': 0, 'commits': 0, 'max_rid': None,
+            'committed_batches': 0, 'committed_rows': 0, 'committed_rid': None}
+
+def add_stats(result, stats, committed_only = False):
+    """
+    Accumulate stats of `run_pull_push` into run result (only committed part if run failed).
+    """
+    prefix = 'committed_' if committed_only else ''
+    for k in ['batches', 'rows']:
+        result[k] = result.get(k, 0) + stats[prefix + k]
+    result['commits'] = result.get('commits', 0) + stats['commits']
+    if 'throttled' in stats:
+        result['throttled'] = stats['throttled'] #throttles are shared between runs, so delay is cumulative
+    if 'peak_batch_bytes' in stats:
+        result['peak_batch_bytes'] = max(result.get('peak_batch_bytes', 0), stats['peak_batch_bytes'])
+    return result
+
+class CommitTracker:
+    """
+    Controls dst transaction according to `commit_every` and accounts pushed batches in `stats`.
+    When rids of pushed batches are given, commit is postponed until rid changes between batches,
+    so that committed rows always form complete prefix by rid.
+    """
+    def __init__(self, engine, commit_every, stats):
+        self.engine = engine
+        self.unit, self.count = parse_commit_every(commit_every)
+        self.stats = stats
+        self.uncommitted = 0
+        self.last_rid = None
+
+    def begin(self):
+        self.engine.begin_transaction()
+
+    def commit(self):
+        self.engine.commit()
+        self.stats['commits'] += 1
+        self.stats['committed_batches'] = self.stats['batches']
+        self.stats['committed_rows'] = self.stats['rows']
+        self.stats['committed_rid'] = self.last_rid
+        self.uncommitted = 0
+
+    def before_push(self, first_rid = None):
+        if self.unit != 'run' and self.uncommitted >= self.count \
+                and (first_rid is None or self.last_rid is None or first_rid != self.last_rid):
+            self.commit()
+            self.engine.begin_transaction()
+
+    def after_push(self, num_rows, last_rid = None):
+        self.uncommitted += num_rows if self.unit == 'rows' else 1
+        self.last_rid = last_rid
+        self.stats['batches'] += 1
+        self.stats['rows'] += num_rows
+
+    def finish(self):
+        self.commit()
+        self.stats['max_rid'] = self.last_rid
+
+    def abort(self):
+        self.engine.rollback()
+
+def run_pull_push(src_engine, dst_engine, src_batch_size = 1000, dst_batch_size = 1000, commit_every = None, rid = None,
+                  src_throttle = None, dst_throttle = None, stats = None, writers = 1, writers_key = None, dst_config = None,
+                  src_budget = None, dst_budget = None):
+    """
+    Pull batches from src and push them to dst, committing dst transaction according to `commit_every`.
+    When `rid` is given (data is ordered by it), commits are postponed until rid changes between batches,
+    so that committed rows always form complete prefix by rid and restart from max(rid) is correct.
+    Highest written rid is returned as `max_rid` (None if rid is not among pulled columns).
+    Throttles (see `dbrep.throttle`) limit throughput of src and dst, time spent in them is returned as `throttled`.
+    If `stats` dict is passed, it is updated in place, so that progress (`committed_rid`, `committed_rows`) is known on failure.
+    With `writers` > 1 batches are inserted concurrently by pool of dst connections (see `dbrep.writers`).
+    Budgets cap bytes of fetched and inserted batches, then estimated peak of bytes in flight is returned as `peak_batch_bytes`.
+    """
+    if writers != 1 or writers_key is not None:
+        from .writers import run_pull_push_pool #writers are built on top of this module
+        return run_pull_push_pool(src_engine, dst_engine, dst_config, writers, writers_key, src_batch_size, dst_batch_size,
+                                  commit_every, rid, src_throttle, dst_throttle, stats, src_budget, dst_budget)
+    if stats is None:
+        stats = new_stats()
+    tracker = CommitTracker(dst_engine, commit_every, stats)
+    get_rid = None
+    tracker.begin()
+    try:
+        while True:
+            names, data = pull_batch(src_engine, src_batch_size, src_throttle, src_budget)
+            if data is None or len(data) == 0:
+                break
+            if stats['batches'] == 0:
+                get_rid = make_rid_getter(names, rid)
+            tracker.before_push(get_rid(data[0]) if get_rid else None)
+            push_batch(dst_engine, names, data, dst_batch_size, dst_throttle, dst_budget)
+            tracker.after_push(len(data), get_rid(data[-1]) if get_rid else None)
+            logger.info('Processed %s batch of size %s.', stats['batches'], len(data))
+            for callback in batch_callbacks:
+                callback(stats)
+        tracker.finish()
+    except Exception:
+        tracker.abort()
+        raise
+    finally:
+        if src_throttle or dst_throttle:
+            stats['throttled'] = sum(x.delay for x in [src_throttle, dst_throttle] if x)
+        if src_budget or dst_budget: #single batch is in flight at a time
+            stats['peak_batch_bytes'] = max(x.peak for x in [src_budget, dst_budget] if x)
+    return stats
+
+def parse_retry(value):
+    """
+    Parse `retry` option of replication: number of attempts or dict with `attempts`, `backoff` (initial delay in seconds)
+    and `max_backoff`. Delay doubles after each consecutive failure.
+    """
+    policy = {'attempts': 0, 'backoff': 1.0, 'max_backoff': 60.0}
+    if value is None:
+        return policy
+    if isinstance(value, int) and not isinstance(value, bool):
+        policy['attempts'] = value
+    elif isinstance(value, dict):
+        unknown = set(value) - set(policy)
+        if unknown:
+            raise ValueError('Unexpected keys in retry policy: {}'.format(unknown))
+        policy.update(value)
+    else:
+        raise TypeError('retry should be int or dict, but got {}'.format(type(value)))
+    return policy
+
+def retry_after_error(exc, attempt, policy, src_engine, dst_engine):
+    """
+    Decide whether to retry after error. If so -- sleep with exponential backoff and reconnect engines.
+    """
+    if attempt >= policy['attempts'] or not (src_engine.is_retriable(exc) or dst_engine.is_retriable(exc)):
+        return False
+    delay = min(policy['backoff'] * 2 ** attempt, policy['max_backoff'])
+    logger.warning('Replication failed with retriable error ({}), retrying in {:.1f}s (attempt {} of {})'.format(
+        exc, delay, attempt + 1, policy['attempts']))
+    time.sleep(delay)
+    src_engine.reconnect()
+    dst_engine.reconnect()
+    return True
 
 def full_refresh(src_engine, dst_engine, config):
+    """
+    Load every record from src into dst. Returns run result with `rows`, `batches`, `duration`
+    and `rebuild_duration` (time spent on rebuilding indexes when `defer_indexes` is set).
+    """
+    start = time.perf_counter()
+    swap = config['dst'].get('swap', False)
+    dst_config = config['dst']
+    if swap:
+        logger.info('Creating shadow table for <dst>...')
+        dst_config = dst_engine.begin_shadow(config['dst'])
+    elif config['dst'].get('truncate', False):
+        logger.info('Truncating <dst>...')
+        dst_engine.truncate(config['dst'])
+
+    deferred = None
+    if config['dst'].get('defer_indexes', False):
+        logger.info('Dropping indexes and foreign keys of {}...'.format(dst_config['table']))
+        deferred = dst_engine.drop_indexes(dst_config)
+        logger.debug('Deferred indexes: {}'.format(deferred))
+
+    def rebuild_():
+        rebuild_start = time.perf_counter()
+        logger.info('Rebuilding indexes and foreign keys of {}...'.format(dst_config['table']))
+        dst_engine.rebuild_indexes(deferred, config['dst'].get('rebuild_workers', 1))
+        return time.perf_counter() - rebuild_start
+
+    # with retries enabled data is fetched ordered by rid, so that failed run is resumed from last committed rid
+    policy = parse_retry(config.get('retry'))
+    rid = config['src'].get('rid') if policy['attempts'] > 0 else None
+    options = make_pull_push_options(config)
+    result = {'batches': 0, 'rows': 0, 'commits': 0, 'retries': 0}
+    resume_rid = None
+    attempt = 0
     logger.info('Starting replication.')
-    src_engine.begin_full_fetch(config['src'])
-    dst_engine.begin_insert(config['dst'])        
-    run_pull_push(src_engine, dst_engine, config['src'].get('batch_size', 1000), config['dst'].get('batch_size', 1000))        
-    logger.info('Replication finished.')
+    while True:
+        stats = new_stats()
+        try:
+            if resume_rid is not None:
+                src_engine.begin_incremental_fetch(config['src'], resume_rid)
+            elif rid is not None:
+                src_engine.begin_incremental_fetch(config['src'], None)
+            else:
+                src_engine.begin_full_fetch(config['src'])
+            dst_engine.begin_insert(dst_config)
+            add_stats(result, run_pull_push(src_engine, dst_engine, rid=rid, stats=stats, dst_config=dst_config, **options))
+            break
+        except Exception as e:
+            add_stats(result, stats, committed_only=True)
+            resumable = stats['commits'] == 0 or stats['committed_rid'] is not None \
+                        or swap or config['dst'].get('truncate', False)
+            if not resumable or not retry_after_error(e, attempt, policy, src_engine, dst_engine):
+                if swap:
+                    logger.info('Replication failed, dropping shadow table {}'.format(dst_config['table']))
+                    try:
+                        dst_engine.drop_shadow(config['dst'])
+                    except Exception:
+                        logger.exception('Failed to drop shadow table {}'.format(dst_config['table']))
+                elif deferred:
+                    logger.info('Replication failed, restoring indexes of {}'.format(dst_config['table']))
+                    try:
+                        rebuild_()
+                    except Exception:
+                        logger.exception('Failed to restore indexes of {}: {}'.format(dst_config['table'], deferred))
+                raise
+            attempt += 1
+            result['retries'] += 1
+            if stats['committed_rid'] is not None:
+                resume_rid = stats['committed_rid']
+                logger.info('Resuming replication from rid {}'.format(resume_rid))
+            elif stats['commits'] > 0:
+                logger.info('Committed rows could not be located by rid, truncating {} and restarting'.format(dst_config['table']))
+                resume_rid = None
+                dst_engine.truncate(dst_config)
+
+    dst_engine.end_insert()
+    result['rebuild_duration'] = rebuild_() if deferred else 0.0
+    if swap:
+        logger.info('Swapping shadow table {} into <dst>...'.format(dst_config['table']))
+        dst_engine.swap_shadow(config['dst'])
+    result['duration'] = time.perf_counter() - start
+    logger.info('Replication finished: {}'.format(result))
+    return result
 
 def incremental_update(src_engine, dst_engine, config):
+    """
+    Load records with rid greater than latest rid in dst. Latest rid of dst is queried only once at start-up,
+    afterwards it is tracked from written batches (set `verify_rid: true` in dst config to re-query it after each sync).
+    With `catch_up` option wide gap of rids is first loaded concurrently (see `dbrep.distributed.catch_up`).
+    """
+    start = time.perf_counter()
     logger.debug('Making request to get <src> latest rid...')
     src_rid = src_engine.get_latest_rid(config['src'])
+    result = {'batches': 0, 'rows': 0, 'commits': 0, 'retries': 0}
     if src_rid is None:
-        raise NotImplemented
+        logger.info('<src> is empty, nothing to replicate.')
+        result['duration'] = time.perf_counter() - start
+        return result
 
     logger.debug('Making request to get <dst> latest rid...')
     dst_rid = dst_engine.get_latest_rid(config['dst'])
 
     logger.info('Latest rids: <src>={}, <dst>={}'.format(src_rid, dst_rid))
+    if config.get('catch_up') and (dst_rid is None or dst_rid < src_rid):
+        from .distributed import catch_up #distributed is built on top of this module
+        caught = catch_up(src_engine, dst_engine, config, dst_rid, src_rid)
+        if caught is not None:
+            add_stats(result, caught)
+            result['catch_up_ranges'] = caught['catch_up_ranges']
+            dst_rid = caught['rid']
     logger.info('Starting replication.')
-    while not dst_rid or dst_rid < src_rid:
-        src_engine.begin_incremental_fetch(config['src'], dst_rid)
-        dst_engine.begin_insert(config['dst'])        
-        run_pull_push(src_engine, dst_engine, config['src'].get('batch_size', 1000), config['dst'].get('batch_size', 1000))
+    policy = parse_retry(config.get('retry'))
+    options = make_pull_push_options(config)
+    attempt = 0
+    while dst_rid is None or dst_rid < src_rid:
+        stats = new_stats()
+        try:
+            src_engine.begin_incremental_fetch(config['src'], dst_rid)
+            dst_engine.begin_insert(config['dst'])
+            run_pull_push(src_engine, dst_engine, rid=config['src']['rid'], stats=stats, dst_config=config['dst'], **options)
+        except Exception as e:
+            add_stats(result, stats, committed_only=True)
+            if not retry_after_error(e, attempt, policy, src_engine, dst_engine):
+                raise
+            attempt += 1
+            result['retries'] += 1
+            if stats['commits'] > 0:
+                dst_rid = stats['committed_rid'] if stats['committed_rid'] is not None else dst_engine.get_latest_rid(config['dst'])
+            logger.info('Resuming replication from <dst> rid {}'.format(dst_rid))
+            continue
+        attempt = 0
+        add_stats(result, stats)
+        if stats['rows'] == 0:
+            logger.info('Nothing left to sync in <src> after rid {}.'.format(dst_rid))
+            break
 
-        logger.info('Finished sync. Updating <dst> rid...')
-        dst_rid = dst_engine.get_latest_rid(config['dst'])
+        if config['dst'].get('verify_rid', False) or stats['max_rid'] is None:
+            logger.info('Finished sync. Updating <dst> rid...')
+            dst_rid = dst_engine.get_latest_rid(config['dst'])
+        else:
+            dst_rid = stats['max_rid']
         logger.info('Latest rids: <src>={} (old), <dst>={} (updated)'.format(src_rid, dst_rid))
-    logger.info('Replication finished.')
\ No newline at end of file
+    dst_engine.end_insert()
+    result['rid'] = dst_rid
+    result['duration'] = time.perf_counter() - start
+    logger.info('Replication finished: {}'.format(result))
+    return result
+
+def merge_update(src_engine, dst_engine, config):
+    """
+    Load records with rid greater than latest rid in dst into staging table and merge it into dst by `key`.
+    Staging table is temporary (lost with connection), hence retry restarts the whole merge.
+    """
+    if 'key' not in config['dst']:
+        raise ValueError('Merge mode requires `key` (primary key column or list of columns) in dst config')
+    if config['dst'].get('writers', 1) != 1 or config['dst'].get('writers_key'):
+        raise ValueError('Merge mode does not support multiple writers, since staging table is local to connection')
+
+    start = time.perf_counter()
+    policy = parse_retry(config.get('retry'))
+    options = make_pull_push_options(config)
+    result = {'batches': 0, 'rows': 0, 'commits': 0, 'retries': 0}
+    attempt = 0
+    while True:
+        try:
+            logger.debug('Making request to get <dst> latest rid...')
+            dst_rid = dst_engine.get_latest_rid(config['dst'])
+
+            logger.info('Latest rid: <dst>={}'.format(dst_rid))
+            logger.info('Starting replication into staging table.')
+            src_engine.begin_incremental_fetch(config['src'], dst_rid)
+            dst_engine.begin_staging(config['dst'])
+            stats = run_pull_push(src_engine, dst_engine, rid=config['src']['rid'], **options)
+
+            logger.info('Merging staging table into <dst>...')
+            dst_engine.merge_staging(config['dst'])
+            add_stats(result, stats)
+            break
+        except Exception as e:
+            if not retry_after_error(e, attempt, policy, src_engine, dst_engine):
+                raise
+            attempt += 1
+            result['retries'] += 1
+    result['duration'] = time.perf_counter() - start
+    logger.info('Replication finished: {}'.format(result))
+    return result
+
+def iter_keys(engine, batch_size, side, throttle = None):
+    """
+    Iterate over tuples of key values fetched after `begin_key_fetch`, skipping ones with NULLs.
+    Raises ValueError if keys are not ascending in Python ordering, which merge join of keys relies on.
+    """
+    last = None
+    while True:
+        _, data = pull_batch(engine, batch_size, throttle)
+        if data is None or len(data) == 0:
+            return
+        for row in data:
+            row = tuple(row)
+            if any(x is None for x in row):
+                continue
+            if last is not None and row < last:
+                raise ValueError('Keys of {} are not ordered as in Python ({} after {}), '
+                                 'collation of key columns should be binary'.format(side, row, last))
+            last = row
+            yield row
+
+def sync_deletes(src_engine, dst_engine, config):
+    """
+    Delete rows of dst with `key` absent from src. Keys of both sides are streamed ordered by key and merge-joined,
+    dst-only keys are deleted by batches of `batch_size` in single dst transaction, so nothing is deleted on failure.
+    Keys of dst are read by clone of dst engine, since cursor could not be kept open on connection which deletes.
+    """
+    if 'key' not in config['dst']:
+        raise ValueError('sync-deletes mode requires `key` (column or list of columns) in dst config')
+    key = [config['dst']['key']] if isinstance(config['dst']['key'], str) else list(config['dst']['key'])
+    src_key = config['src'].get('key', key)
+    src_key = [src_key] if isinstance(src_key, str) else list(src_key)
+    if len(src_key) != len(key):
+        raise ValueError('Keys of src {} and dst {} should have the same number of columns'.format(src_key, key))
+
+    start = time.perf_counter()
+    result = {'batches': 0, 'rows': 0, 'scanned': 0}
+    dst_batch_size = config['dst'].get('batch_size', 1000)
+    logger.info('Streaming keys {} of <src> and <dst>...'.format(key))
+    src_engine.begin_key_fetch(config['src'], src_key)
+    dst_reader = dst_engine.clone()
+    pending = []
+
+    def flush_():
+        dst_engine.delete_keys(config['dst'], key, pending)
+        result['batches'] += 1
+        result['rows'] += len(pending)
+        logger.info('Deleted %s rows absent from <src> (%s in total).', len(pending), result['rows'])
+        pending.clear()
+
+    try:
+        dst_reader.begin_key_fetch(config['dst'], key)
+        src_keys = iter_keys(src_engine, config['src'].get('batch_size', 1000), '<src>', make_throttle(config['src']))
+        dst_keys = iter_keys(dst_reader, dst_batch_size, '<dst>')
+        dst_engine.begin_transaction()
+        try:
+            current = next(src_keys, None)
+            for value in dst_keys:
+                result['scanned'] += 1
+                while current is not None and current < value:
+                    current = next(src_keys, None)
+                if current != value:
+                    pending.append(value)
+                    if len(pending) >= dst_batch_size:
+                        flush_()
+            if pending:
+                flush_()
+            dst_engine.commit()
+        except Exception:
+            dst_engine.rollback()
+            raise
+    finally:
+        dst_reader.close()
+    result['duration'] = time.perf_counter() - start
+    logger.info('Replication finished: {}'.format(result))
+    return result
+
+def can_pushdown(src_engine, dst_engine, config):
+    """
+    Check whether replication could be done on server side: it is enabled by `pushdown: true`, src and dst are colocated
+    and nothing requires rows to pass through dbrep.
+    """
+    if not config.get('pushdown', False) or isinstance(config['dst'], list) or config['mode'] not in ('full-refresh', 'incremental'):
+        return False
+    columns = config['src'].get('columns')
+    if isinstance(columns, str) and columns != 'auto': #raw select list -- names of columns are unknown
+        return False
+    if config['src'].get('cache') or config['dst'].get('defer_indexes') \
+            or any(k in x for x in [config['src'], config['dst']] for k in ['max_rows_per_sec', 'max_bytes_per_sec']):
+        return False
+    if 'pushdown' not in src_engine.features() or 'pushdown' not in dst_engine.features():
+        return False
+    return src_engine.colocated(dst_engine)
+
+def pushdown_replication(src_engine, dst_engine, config):
+    """
+    Replicate by single `insert ... select` executed by dst in one transaction, so that rows never leave the server.
+    Supports full-refresh (with `truncate` or `swap`) and incremental modes.
+    """
+    start = time.perf_counter()
+    mode = config['mode']
+    swap = mode == 'full-refresh' and config['dst'].get('swap', False)
+    dst_config = config['dst']
+    if swap:
+        logger.info('Creating shadow table for <dst>...')
+        dst_config = dst_engine.begin_shadow(config['dst'])
+    columns = config['src'].get('columns')
+    reflected = not columns or columns == 'auto'
+    if reflected:
+        columns = dst_engine.get_columns(dst_config)
+    src_config = dict(config['src'], columns=columns, quote_columns=reflected)
+
+    policy = parse_retry(config.get('retry'))
+    result = {'batches': 1, 'rows': 0, 'commits': 1, 'retries': 0, 'pushdown': True}
+    attempt = 0
+    while True:
+        try:
+            dst_engine.begin_transaction()
+            if mode == 'incremental':
+                dst_rid = dst_engine.get_latest_rid(dst_config)
+                query = src_engine.render_incremental_fetch(src_config, dst_rid)
+                params = src_engine.rid_params(src_config, dst_rid)
+            else:
+                if not swap and config['dst'].get('truncate', False):
+                    dst_engine.truncate(dst_config)
+                query = src_engine.render_full_fetch(src_config)
+                params = {}
+            logger.info('<src> and <dst> are colocated, inserting on server side: {}'.format(query))
+            result['rows'] = dst_engine.insert_select(dst_config, columns, query, params, quote=reflected)
+            dst_engine.commit()
+            break
+        except Exception as e:
+            try:
+                dst_engine.rollback()
+            except Exception:
+                logger.exception('Failed to rollback <dst>')
+            if not retry_after_error(e, attempt, policy, src_engine, dst_engine):
+                if swap:
+                    logger.info('Replication failed, dropping shadow table {}'.format(dst_config['table']))
+                    dst_engine.drop_shadow(config['dst'])
+                raise
+            attempt += 1
+            result['retries'] += 1
+    if mode == 'incremental':
+        result['rid'] = dst_engine.get_latest_rid(dst_config)
+    if swap:
+        logger.info('Swapping shadow table {} into <dst>...'.format(dst_config['table']))
+        dst_engine.swap_shadow(config['dst'])
+    result['duration'] = time.perf_counter() - start
+    logger.info('Replication finished: {}'.format(result))
+    return result
+
+def validate_run_config(run_config):
+    if not isinstance(run_config, dict):
+        raise TypeError('Run should be dict, but got {}!'.format(type(run_config)))
+    if 'src' not in run_config or 'dst' not in run_config or 'mode' not in run_config:
+        raise ValueError('Run should contain mode, src and dst')
+    if isinstance(run_config['dst'], list) and (not run_config['dst'] or not all(isinstance(x, dict) for x in run_config['dst'])):
+        raise TypeError('Dst should be dict or non-empty list of dicts!')
+
+def make_dst_engine(dst_config, full_config, make_engine):
+    """
+    Make engine for dst config, or list of engines if dst is list of destinations.
+    """
+    if not isinstance(dst_config, list):
+        return make_engine(dst_config['conn'], full_config)
+    engines = []
+    try:
+        for x in dst_config:
+            engines.append(make_engine(x['conn'], full_config))
+    except Exception:
+        for engine in engines:
+            engine.close()
+        raise
+    return engines
+
+def resolve_columns(src_config, dst_engine, dst_config):
+    """
+    Resolve `columns: auto` of src config into columns of dst table, so that only them are fetched.
+    """
+    if src_config.get('columns') != 'auto':
+        return src_config
+    columns = dst_engine.get_columns(dst_config)
+    if columns is None:
+        logger.warning('Columns of <dst> are unknown, fetching every column of <src>')
+    return dict(src_config, columns=columns, quote_columns=True) #reflected names are exact, e.g. mixed-case `UserId` on PostgreSQL
+
+def create_dst_table(src_engine, dst_engine, config):
+    """
+    Create dst table (`auto_create: true` in dst config) from reflected types of src table, if it does not exist.
+    """
+    if dst_engine.has_table(config['dst']):
+        return False
+    column_types = src_engine.get_column_types(config['src'])
+    if column_types is None:
+        raise ValueError('auto_create requires src table to reflect types of columns, create {} for query manually'.format(config['dst']['table']))
+    columns = config['src'].get('columns')
+    if isinstance(columns, str) and columns != 'auto':
+        raise ValueError('auto_create does not support raw select list in columns, list columns explicitly')
+    if isinstance(columns, list):
+        types = {name.lower(): (name, x) for name, x in column_types}
+        missing = [x for x in columns if x.lower() not in types]
+        if missing:
+            raise ValueError('Columns {} are absent from src table {}'.format(missing, config['src']['table']))
+        column_types = [types[x.lower()] for x in columns]
+    logger.info('Creating <dst> table {} with columns {}'.format(config['dst']['table'], [x for x, _ in column_types]))
+    dst_engine.create_table(config['dst'], column_types)
+    return True
+
+def run_replication(src_engine, dst_engine, config):
+    """
+    Run replication in mode from config. When `dst` is list of destinations, `dst_engine` should be list of engines.
+    """
+    if not isinstance(config['dst'], list) and config['dst'].get('auto_create') and config['mode'] != 'sync-deletes':
+        create_dst_table(src_engine, dst_engine, config)
+    if can_pushdown(src_engine, dst_engine, config):
+        return pushdown_replication(src_engine, dst_engine, config)
+    if config['src'].get('cache'):
+        cache_config = config['src']['cache']
+        cached_engine = CachedEngine(src_engine, SnapshotCache(cache_config['path'], cache_config.get('max_bytes')))
+        src_config = {k: v for k, v in config['src'].items() if k != 'cache'}
+        result = run_replication(cached_engine, dst_engine, dict(config, src=src_config))
+        result['cached_rows'] = cached_engine.cached_rows
+        return result
+    if isinstance(config['dst'], list):
+        from .fanout import fanout_replication #fanout is built on top of this module
+        return fanout_replication(src_engine, dst_engine, config)
+    config = dict(config, src=resolve_columns(config['src'], dst_engine, config['dst']))
+    modes = {
+        'full-refresh': full_refresh,
+        'incremental': incremental_update,
+        'merge': merge_update,
+        'sync-deletes': sync_deletes,
+    }
+    if config['mode'] not in modes:
+        raise ValueError("Unsupported mode: {}. Should be full-refresh, incremental, merge or sync-deletes".format(config['mode']))
+    return modes[config['mode']](src_engine, dst_engine, config)
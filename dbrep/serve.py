@@ -0,0 +1,174 @@
+"""
+Long-running replication daemon (`dbrep serve`).
+
+Config is loaded once and engines are kept connected between runs. Each replication is run on its own schedule:
+- `interval` -- maximum delay between runs (default is `--interval`)
+- `min_interval` -- delay after run which replicated some rows (defaults to `interval`, i.e. fixed schedule)
+
+After run without new rows the delay doubles from `min_interval` up to `interval`, so active tables are polled
+often and idle tables rarely. SIGHUP reloads config (and reconnects engines), SIGTERM / SIGINT stop the daemon
+after current replication finishes.
+
+Only `incremental` and `merge` replications are served by default: other modes (e.g. `full-refresh` truncating dst)
+repeat the whole load on every run and require `serve: true` in replication config.
+"""
+import logging
+import signal
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from .replication import make_dst_engine, run_replication, validate_run_config
+
+logger = logging.getLogger(__name__)
+
+serve_modes = ['incremental', 'merge']
+
+class ReplicationJob:
+    def __init__(self, name, config, src_engine, dst_engine, default_interval):
+        self.name = name
+        self.config = config
+        self.src_engine = src_engine
+        self.dst_engine = dst_engine
+        self.engines = [src_engine] + (dst_engine if isinstance(dst_engine, list) else [dst_engine])
+        self.interval = float(config.get('interval', default_interval))
+        self.min_interval = float(config.get('min_interval', self.interval))
+        if self.min_interval <= 0 or self.min_interval > self.interval:
+            raise ValueError('Replication {}: min_interval should be in (0, interval], but got {}'.format(name, self.min_interval))
+        self.delay = self.min_interval
+        self.next_run = 0.0
+        self.last_result = None
+
+    def run(self, now):
+        try:
+            self.last_result = run_replication(self.src_engine, self.dst_engine, self.config)
+        except Exception:
+            logger.exception('Replication {} failed, retrying in {}s'.format(self.name, self.interval))
+            self.last_result = None
+            self.delay = self.interval
+            for engine in self.engines:
+                try:
+                    engine.reconnect()
+                except Exception:
+                    logger.exception('Failed to reconnect engine of replication {}'.format(self.name))
+        else:
+            if self.last_result and self.last_result.get('rows', 0) > 0:
+                self.delay = self.min_interval
+            else:
+                self.delay = min(self.delay * 2, self.interval)
+        self.next_run = now + self.delay
+
+    def close(self):
+        for engine in self.engines:
+            try:
+                engine.close()
+            except Exception:
+                logger.exception('Failed to close engine of replication {}'.format(self.name))
+
+
+class ReplicationServer:
+    def __init__(self, load_config: Callable[[], Dict], make_engine: Callable, names: Optional[List[str]] = None,
+                 default_interval: float = 60.0, clock = time.monotonic):
+        self.load_config = load_config
+        self.make_engine = make_engine
+        self.names = names
+        self.default_interval = default_interval
+        self.clock = clock
+        self.jobs = []
+        self.stop_event = threading.Event()
+        self.reload_requested = False
+
+    def make_jobs(self, config):
+        names = self.names or sorted((config.get('replications') or {}).keys())
+        if not names:
+            raise ValueError('No replications to serve: specify them in `replications` section of config')
+        jobs = []
+        try:
+            for name in names:
+                if name not in config.get('replications', {}):
+                    raise KeyError('Replication {} is absent from `replications` section of config'.format(name))
+                run_config = config['replications'][name]
+                validate_run_config(run_config)
+                if run_config['mode'] not in serve_modes and not run_config.get('serve', False):
+                    raise ValueError('Replication {} in mode {} would be repeated on every run: only {} are served, '
+                                     'unless `serve: true` is set'.format(name, run_config['mode'], ', '.join(serve_modes)))
+                src_engine = self.make_engine(run_config['src']['conn'], config)
+                try:
+                    dst_engine = make_dst_engine(run_config['dst'], config, self.make_engine)
+                except Exception:
+                    src_engine.close()
+                    raise
+                jobs.append(ReplicationJob(name, run_config, src_engine, dst_engine, self.default_interval))
+        except Exception:
+            for job in jobs:
+                job.close()
+            raise
+        return jobs
+
+    def reload(self):
+        """
+        Load config and reconnect engines. On failure previous jobs are kept running.
+        """
+        logger.info('Loading config...')
+        try:
+            jobs = self.make_jobs(self.load_config())
+        except Exception:
+            if not self.jobs:
+                raise
+            logger.exception('Failed to reload config, keeping previous one')
+            return
+        for job in self.jobs:
+            job.close()
+        for job in jobs: #tables could be altered along with config
+            for engine in job.engines:
+                engine.forget_tables()
+        self.jobs = jobs
+        logger.info('Serving replications: {}'.format(', '.join(x.name for x in jobs)))
+
+    def run_pending(self):
+        """
+        Run replications which are due. Returns number of seconds until next one is due.
+        """
+        for job in sorted(self.jobs, key=lambda x: x.next_run):
+            if self.stop_event.is_set():
+                break
+            now = self.clock()
+            if job.next_run <= now:
+                logger.info('Running replication {}'.format(job.name))
+                job.run(now)
+        if not self.jobs:
+            return self.default_interval
+        return max(min(x.next_run for x in self.jobs) - self.clock(), 0.0)
+
+    def request_reload(self, *args):
+        self.reload_requested = True
+        self.stop_event.set() #wake up main loop
+
+    def request_stop(self, *args):
+        logger.info('Stopping after current replication...')
+        self.reload_requested = False
+        self.stop_event.set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.request_reload)
+
+    def serve_forever(self):
+        self.reload()
+        try:
+            while True:
+                wait = self.run_pending()
+                self.stop_event.wait(wait)
+                if self.reload_requested:
+                    self.reload_requested = False
+                    self.stop_event.clear()
+                    self.reload()
+                elif self.stop_event.is_set():
+                    break
+        finally:
+            for job in self.jobs:
+                job.close()
+            self.jobs = []
+            logger.info('Stopped.')
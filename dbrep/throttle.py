@@ -0,0 +1,147 @@
+"""
+Throughput throttling for replication loop.
+
+Each side of replication (src or dst config) may specify:
+- `max_rows_per_sec` -- ceiling on rows fetched / inserted per second
+- `max_bytes_per_sec` -- ceiling on (estimated) bytes fetched / inserted per second
+- `target_latency` -- seconds per fetch / insert call; when observed latency exceeds it, rates are halved
+  (down to 5% of ceiling) and recovered by 10% of ceiling per call below it
+- `max_batch_bytes` -- ceiling on (estimated) bytes of one fetched / inserted batch, rows per call are reduced
+  below `batch_size` when rows are large
+"""
+import sys
+import threading
+import time
+from typing import Any, List, Optional
+
+
+def estimate_batch_bytes(batch: List[Any], sample_size: int = 100) -> int:
+    """
+    Estimate memory footprint of batch by `sys.getsizeof` of values in evenly sampled rows.
+    """
+    if not batch:
+        return 0
+    step = max(len(batch) // sample_size, 1)
+    sample = batch[::step]
+    size = sum(sys.getsizeof(row) + sum(sys.getsizeof(x) for x in row) for row in sample)
+    return size * len(batch) // len(sample)
+
+
+class TokenBucket:
+    """
+    Token bucket allowing debt: consuming more than available makes caller sleep until debt is repaid.
+    """
+    def __init__(self, rate: float, burst: Optional[float] = None, clock = time.monotonic, sleep = time.sleep):
+        if rate <= 0:
+            raise ValueError('Rate should be positive, but got {}'.format(rate))
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.clock = clock
+        self.sleep = sleep
+        self.last = clock()
+
+    def consume(self, amount: float) -> float:
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate) - amount
+        self.last = now
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        self.sleep(delay)
+        return delay
+
+
+class Throttle:
+    """
+    Rows/s and bytes/s limiter for one side of replication, optionally adapting to observed latency.
+    """
+    min_scale = 0.05
+    def __init__(self, max_rows_per_sec: Optional[float] = None, max_bytes_per_sec: Optional[float] = None,
+                 target_latency: Optional[float] = None, clock = time.monotonic, sleep = time.sleep):
+        if max_rows_per_sec is None and max_bytes_per_sec is None:
+            raise ValueError('Throttle requires max_rows_per_sec or max_bytes_per_sec')
+        self.max_rows_per_sec = max_rows_per_sec
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.target_latency = target_latency
+        self.scale = 1.0
+        self.rows = TokenBucket(max_rows_per_sec, clock=clock, sleep=sleep) if max_rows_per_sec else None
+        self.bytes = TokenBucket(max_bytes_per_sec, clock=clock, sleep=sleep) if max_bytes_per_sec else None
+        self.delay = 0.0
+
+    def _adapt(self, latency):
+        if self.target_latency is None or latency is None:
+            return
+        if latency > self.target_latency:
+            self.scale = max(self.scale / 2, self.min_scale)
+        else:
+            self.scale = min(self.scale + 0.1, 1.0)
+        if self.rows:
+            self.rows.rate = self.max_rows_per_sec * self.scale
+        if self.bytes:
+            self.bytes.rate = self.max_bytes_per_sec * self.scale
+
+    def __call__(self, batch: List[Any], latency: Optional[float] = None) -> float:
+        """
+        Account for processed batch (and latency of call processing it), sleeping if ceiling is exceeded.
+        Returns time slept.
+        """
+        self._adapt(latency)
+        delay = 0.0
+        if self.rows:
+            delay += self.rows.consume(len(batch))
+        if self.bytes:
+            delay += self.bytes.consume(estimate_batch_bytes(batch))
+        self.delay += delay
+        return delay
+
+
+class BatchBudget:
+    """
+    Caps number of rows per fetch / insert call, so that estimated size of batch stays within `max_batch_bytes`.
+    Size of row is estimated from previous batch, so the first fetch is limited to `probe_rows`.
+    Budget of dst is shared by writer threads (see `dbrep.writers`), hence updates are made under lock.
+    """
+    probe_rows = 16
+    def __init__(self, max_batch_bytes: int, batch_size: int = 1000):
+        if max_batch_bytes <= 0:
+            raise ValueError('max_batch_bytes should be positive, but got {}'.format(max_batch_bytes))
+        self.max_batch_bytes = max_batch_bytes
+        self.batch_size = batch_size
+        self.row_bytes = None
+        self.last = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def rows(self) -> int:
+        with self.lock:
+            row_bytes = self.row_bytes
+        if row_bytes is None:
+            return min(self.batch_size, self.probe_rows)
+        return max(min(self.batch_size, int(self.max_batch_bytes // row_bytes)), 1)
+
+    def observe(self, batch: List[Any]) -> int:
+        """
+        Account for size of batch, returns its estimated bytes.
+        """
+        nbytes = estimate_batch_bytes(batch)
+        with self.lock:
+            self.last = nbytes
+            if batch:
+                self.row_bytes = max(nbytes / len(batch), 1)
+            self.peak = max(self.peak, nbytes)
+        return nbytes
+
+
+def make_batch_budget(config: dict) -> Optional[BatchBudget]:
+    if 'max_batch_bytes' not in config:
+        return None
+    return BatchBudget(config['max_batch_bytes'], config.get('batch_size', 1000))
+
+
+def make_throttle(config: dict) -> Optional[Throttle]:
+    if 'max_rows_per_sec' not in config and 'max_bytes_per_sec' not in config:
+        if 'target_latency' in config:
+            raise ValueError('target_latency requires max_rows_per_sec or max_bytes_per_sec to be set')
+        return None
+    return Throttle(config.get('max_rows_per_sec'), config.get('max_bytes_per_sec'), config.get('target_latency'))
@@ -0,0 +1,239 @@
+"""
+Pool of dst writers (`writers: N` in dst config) fed from single src stream.
+
+Pulled batches are grouped into chunks by `commit_every` (aligned on rid change) and every chunk is inserted in its own
+transaction by one of N dst connections in round-robin. Inserts run concurrently, but chunk is committed only after
+all previous chunks are committed, so committed rows always form complete prefix by rid and latest rid of dst remains
+safe watermark for the next run, even if replication is killed.
+
+With `writers_key` (column or list of columns) rows of every chunk are spread over all writers by hash of key instead,
+so that rows with the same key are always written by the same connection. Chunk is then committed by several
+connections, which is not atomic: when some of them fail, rows beyond last complete chunk are deleted by rid.
+"""
+import concurrent.futures
+import logging
+import threading
+
+from .replication import batch_callbacks, make_rid_getter, new_stats, parse_commit_every, pull_batch, push_batch
+from .throttle import estimate_batch_bytes
+
+logger = logging.getLogger(__name__)
+
+class ChunkCancelled(Exception):
+    """
+    Raised by writer when its chunk can not be committed, because some previous chunk failed.
+    """
+
+class WriterPool:
+    def __init__(self, engine, config, writers, key = None, batch_size = 1000, throttle = None, stats = None, budget = None):
+        if not isinstance(writers, int) or isinstance(writers, bool) or writers < 1:
+            raise ValueError('writers should be positive integer, but got {}'.format(writers))
+        self.config = config
+        self.key = [key] if isinstance(key, str) else key
+        self.batch_size = batch_size
+        self.throttle = throttle
+        self.throttle_lock = threading.Lock()
+        self.budget = budget
+        self.stats = stats if stats is not None else new_stats()
+        self.engines = [engine]
+        self.executors = []
+        try:
+            for _ in range(writers - 1):
+                self.engines.append(engine.clone())
+            for x in self.engines[1:]:
+                x.begin_insert(config)
+        except Exception:
+            self.close()
+            raise
+        self.executors = [concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='dbrep-writer') for _ in self.engines]
+        self.pending = [None] * len(self.engines)
+        self.cond = threading.Condition()
+        self.submitted = 0
+        self.committed = 0
+        self.parts = {}
+        self.inflight = {} #estimated bytes of chunks submitted, but not yet committed
+        self.failed = None
+        self.names = None
+        self.get_rid = None
+        self.get_key = None
+        self.rid = None
+        self.base_rid = None
+
+    def begin(self, names, get_rid, rid = None):
+        self.names = names
+        self.get_rid = get_rid
+        self.rid = rid
+        if self.key:
+            getters = [make_rid_getter(names, x) for x in self.key]
+            if not all(getters):
+                raise ValueError('writers_key {} should be among pulled columns {}'.format(self.key, names))
+            self.get_key = lambda row: tuple(f(row) for f in getters)
+            if get_rid is not None: #lower bound for rows to delete if first chunk is partially committed
+                self.base_rid = self.engines[0].get_latest_rid(dict(self.config, rid=rid))
+
+    def _throttle(self, batch, latency):
+        with self.throttle_lock:
+            self.throttle(batch, latency)
+
+    def _write(self, idx, seq, batches, num_batches, num_rows, last_rid):
+        engine = self.engines[idx]
+        try:
+            engine.begin_transaction()
+            for batch in batches:
+                push_batch(engine, self.names, batch, self.batch_size, self._throttle if self.throttle else None, self.budget)
+            with self.cond:
+                while self.committed < seq and self.failed is None:
+                    self.cond.wait()
+                if self.committed < seq: #committing after failed chunk would leave gap
+                    raise ChunkCancelled()
+            engine.commit()
+            with self.cond:
+                self.stats['commits'] += 1
+                self.parts[seq][0] -= 1
+                if self.parts[seq][0] == 0:
+                    del self.parts[seq]
+                    self.inflight.pop(seq, None)
+                    self.committed += 1
+                    self.stats['committed_batches'] += num_batches
+                    self.stats['committed_rows'] += num_rows
+                    self.stats['committed_rid'] = last_rid
+                    self.cond.notify_all()
+        except Exception as e:
+            try:
+                engine.rollback()
+            except Exception:
+                logger.exception('Failed to rollback writer {}'.format(idx))
+            with self.cond:
+                if self.failed is None and not isinstance(e, ChunkCancelled):
+                    self.failed = e
+                self.cond.notify_all()
+            raise
+
+    def _wait(self, idx):
+        future, self.pending[idx] = self.pending[idx], None
+        if future is None:
+            return
+        try:
+            future.result()
+        except Exception:
+            if self.failed is not None:
+                raise self.failed
+            raise
+
+    def inflight_bytes(self):
+        with self.cond:
+            return sum(self.inflight.values())
+
+    def submit(self, chunk, nbytes = 0):
+        """
+        Send chunk (list of pulled batches, `nbytes` estimated size) to writers, waiting for writers to finish their previous chunks.
+        """
+        seq = self.submitted
+        num_rows = sum(len(x) for x in chunk)
+        last_rid = self.get_rid(chunk[-1][-1]) if self.get_rid else None
+        if self.get_key is None:
+            parts = {seq % len(self.engines): chunk}
+        else:
+            rows = [[] for _ in self.engines]
+            for batch in chunk:
+                for row in batch:
+                    rows[hash(self.get_key(row)) % len(self.engines)].append(row)
+            parts = {i: [x] for i, x in enumerate(rows) if x}
+        with self.cond:
+            self.parts[seq] = [len(parts), len(parts)]
+            self.inflight[seq] = nbytes
+        for idx, batches in parts.items():
+            self._wait(idx)
+            self.pending[idx] = self.executors[idx].submit(self._write, idx, seq, batches, len(chunk), num_rows, last_rid)
+        self.submitted += 1
+
+    def finish(self):
+        for idx in range(len(self.engines)):
+            self._wait(idx)
+        self.stats['max_rid'] = self.stats['committed_rid']
+
+    def abort(self, exc):
+        with self.cond:
+            if self.failed is None:
+                self.failed = exc
+            self.cond.notify_all()
+        for idx in range(len(self.engines)):
+            try:
+                self._wait(idx)
+            except Exception:
+                pass
+        if any(left < total for left, total in self.parts.values()):
+            self._delete_partial()
+
+    def _delete_partial(self):
+        min_rid = self.stats['committed_rid'] if self.committed > 0 else self.base_rid
+        if self.get_rid is None:
+            logger.error('Chunk was partially committed by writers, but rid is unknown: <dst> contains incomplete chunk')
+            return
+        logger.warning('Chunk was partially committed by writers, deleting rows with rid > {} from <dst>'.format(min_rid))
+        for engine in self.engines:
+            try:
+                engine.delete_rows(dict(self.config, rid=self.rid), min_rid)
+                return
+            except Exception:
+                logger.exception('Failed to delete partially committed rows')
+        logger.error('<dst> contains partially committed rows with rid > {}, they should be deleted before next run'.format(min_rid))
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown()
+        for engine in self.engines[1:]:
+            try:
+                engine.close()
+            except Exception:
+                logger.exception('Failed to close writer connection')
+
+def run_pull_push_pool(src_engine, dst_engine, dst_config, writers, writers_key = None, src_batch_size = 1000, dst_batch_size = 1000,
+                       commit_every = None, rid = None, src_throttle = None, dst_throttle = None, stats = None,
+                       src_budget = None, dst_budget = None):
+    """
+    Same as `run_pull_push`, but pushes batches through pool of `writers` dst connections (clones of `dst_engine`).
+    `dst_config` is config of table to insert into, `begin_insert` should be already called on `dst_engine`.
+    """
+    unit, count = parse_commit_every(commit_every)
+    if unit == 'run':
+        raise ValueError('commit_every: run is not supported with multiple writers, since every writer commits its own transaction')
+    if dst_config is None:
+        raise ValueError('Multiple writers require dst config')
+    if stats is None:
+        stats = new_stats()
+    pool = WriterPool(dst_engine, dst_config, writers, writers_key, dst_batch_size, dst_throttle, stats, dst_budget)
+    get_rid = None
+    chunk, size, nbytes = [], 0, 0
+    try:
+        while True:
+            names, data = pull_batch(src_engine, src_batch_size, src_throttle, src_budget)
+            if data is None or len(data) == 0:
+                break
+            if stats['batches'] == 0:
+                get_rid = make_rid_getter(names, rid)
+                pool.begin(names, get_rid, rid)
+            if chunk and size >= count and (get_rid is None or get_rid(data[0]) != get_rid(chunk[-1][-1])):
+                pool.submit(chunk, nbytes)
+                chunk, size, nbytes = [], 0, 0
+            chunk.append(data)
+            size += len(data) if unit == 'rows' else 1
+            if src_budget or dst_budget: #chunks being collected and written are all in memory
+                nbytes += src_budget.last if src_budget else estimate_batch_bytes(data)
+                stats['peak_batch_bytes'] = max(stats.get('peak_batch_bytes', 0), pool.inflight_bytes() + nbytes)
+            stats['batches'] += 1
+            stats['rows'] += len(data)
+            logger.info('Processed %s batch of size %s.', stats['batches'], len(data))
+            for callback in batch_callbacks:
+                callback(stats)
+        if chunk:
+            pool.submit(chunk, nbytes)
+        pool.finish()
+    except Exception as e:
+        pool.abort(e)
+        raise
+    finally:
+        pool.close()
+        if src_throttle or dst_throttle:
+            stats['throttled'] = sum(x.delay for x in [src_throttle, dst_throttle] if x)
+    return stats
@@ -1,3 +1,4 @@
+import copy
 import os
 import yaml
 
@@ -52,6 +53,7 @@ def make_explicit_tests(config):
         res = [v for x in res for v in dbrep.config.expand_config(x, 'config.dst.conns', 'config.dst.conn')]
         res = [v for x in res for v in dbrep.config.expand_config(x, 'tests', 'test')]
         res = [v for x in res for v in dbrep.config.expand_config(x, 'config.modes', 'config.mode')]
+        res = [copy.deepcopy(x) for x in res] #expanded configs share parts, while cleanup below modifies them
         for x in res:
             for k in ['tests', 'configs', 'template', 'templates']:
                 if k in x:
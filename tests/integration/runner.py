@@ -6,7 +6,7 @@ import contextlib
 import errors
 from config import make_explicit_tests
 from dbrep import create_engine, init_factory
-from dbrep.replication import full_refresh, incremental_update
+from dbrep.replication import full_refresh, incremental_update, merge_update
 import dbrep.utils
 import dbrep.config
 from drivers import TestDriverSQLAlchemy
@@ -111,12 +111,14 @@ def run_test_stage(src_driver, dst_driver, src_engine, dst_engine, steps, config
             full_refresh(src_engine, dst_engine, config)
         elif config['mode'] == 'incremental':
             incremental_update(src_engine, dst_engine, config)
+        elif config['mode'] == 'merge':
+            merge_update(src_engine, dst_engine, config)
         else:
             found_handler = False
     except Exception as e:
         raise errors.FailedReplicationError('Failed to run replication!', e) from e
     if not found_handler:
-        raise errors.InvalidTestConfigError("Unsupported mode: {}. Should be full-refresh or incremental".format(config['mode']))
+        raise errors.InvalidTestConfigError("Unsupported mode: {}. Should be full-refresh, incremental or merge".format(config['mode']))
 
 def test_replication(src_keys, src_data, dst_keys, dst_data):
     try:
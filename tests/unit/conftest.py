@@ -0,0 +1,37 @@
+import pytest
+
+
+class FakeClock:
+    """
+    Clock injected into throttles, coordinator and daemon: time moves only by `sleep` or by setting `now`.
+    """
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+    def sleep(self, delay):
+        self.now += delay
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def make_engine():
+    """
+    Factory of engines of SQLite database files: `make_engine(db_path, setup=(), threads=False, **options)` runs `setup`
+    statements, `threads` allows to use connection from other threads. Engines are closed after test.
+    """
+    pytest.importorskip('sqlalchemy')
+    from dbrep.engines.engine_sqlalchemy import SQLAlchemyEngine
+    engines = []
+    def make_engine_(db_path, setup=(), threads=False, **options):
+        conn_str = 'sqlite:///{}{}'.format(db_path, '?check_same_thread=false' if threads else '')
+        engine = SQLAlchemyEngine(dict({'engine': 'sqlalchemy', 'conn-str': conn_str}, **options))
+        engines.append(engine)
+        for cmd in setup:
+            engine._execute(engine.make_query(cmd))
+        return engine
+    yield make_engine_
+    for engine in engines:
+        engine.close()
@@ -0,0 +1,56 @@
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+import dbrep
+
+
+def execute(db_path, query):
+    engine = sqlalchemy.create_engine('sqlite:///{}'.format(db_path))
+    res = [tuple(x) for x in engine.execute(query).fetchall()] if query.startswith('select') else engine.execute(query)
+    engine.dispose()
+    return res
+
+def make_conn(db_path):
+    return {'engine': 'sqlalchemy', 'conn-str': 'sqlite:///{}'.format(db_path)}
+
+
+def test_iter_batches(tmp_path):
+    execute(tmp_path / 'src.db', 'create table test_src (rid integer, col text)')
+    execute(tmp_path / 'src.db', 'insert into test_src values {}'.format(', '.join("({}, 'v{}')".format(i, i) for i in range(1, 11))))
+    src_config = {'conn': make_conn(tmp_path / 'src.db'), 'table': 'test_src', 'rid': 'rid', 'batch_size': 4}
+
+    batches = dbrep.iter_batches(src_config, 'incremental', rid=3)
+    names, batch = next(batches)
+    assert names == ['rid', 'col'] and [tuple(x) for x in batch] == [(4, 'v4'), (5, 'v5'), (6, 'v6'), (7, 'v7')]
+    assert [len(x) for _, x in batches] == [3]
+    assert list(dbrep.iter_batches(src_config, 'incremental', rid=10)) == []
+    assert sum(len(x) for _, x in dbrep.iter_batches(src_config)) == 10
+
+    with pytest.raises(ValueError):
+        dbrep.iter_batches(src_config, 'merge')
+    with pytest.raises(ValueError):
+        dbrep.iter_batches(dict(src_config, rid=None), 'incremental')
+    with pytest.raises(AttributeError):
+        dbrep.read_batches
+
+def test_write_batches(tmp_path):
+    execute(tmp_path / 'src.db', 'create table test_src (rid integer, col text)')
+    execute(tmp_path / 'src.db', 'insert into test_src values {}'.format(', '.join("({}, 'v{}')".format(i, i) for i in range(1, 11))))
+    execute(tmp_path / 'dst.db', 'create table test_dst (rid integer, col text)')
+    execute(tmp_path / 'dst.db', "insert into test_dst values (0, 'old')")
+    src_config = {'conn': make_conn(tmp_path / 'src.db'), 'table': 'test_src', 'rid': 'rid', 'batch_size': 3}
+    dst_config = {'conn': make_conn(tmp_path / 'dst.db'), 'table': 'test_dst', 'rid': 'rid', 'batch_size': 2, 'truncate': True}
+
+    batches = ((names, [(x[0], x[1].upper()) for x in rows if x[0] % 5]) for names, rows in dbrep.iter_batches(src_config))
+    result = dbrep.write_batches(dst_config, batches)
+    assert (result['batches'], result['rows'], result['commits'], result['rid']) == (3, 8, 3, 9) #last batch is empty after filtering and skipped
+    assert execute(tmp_path / 'dst.db', 'select count(*), min(col), max(rid) from test_dst') == [(8, 'V1', 9)]
+
+    def failing():
+        yield ['rid', 'col'], [(11, 'a'), (12, 'b')]
+        yield ['rid', 'col'], [(13, 'c')]
+        raise RuntimeError('boom')
+    with pytest.raises(RuntimeError):
+        dbrep.write_batches(dict(dst_config, truncate=False, commit_every='2 batches'), failing())
+    assert execute(tmp_path / 'dst.db', 'select count(*) from test_dst') == [(8,)] #uncommitted batches are rolled back
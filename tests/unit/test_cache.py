@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+import dbrep.cache
+import dbrep.replication
+
+
+def execute(engine, query, params=None):
+    return engine._execute(engine.make_query(query), params) if params is not None else engine._execute(engine.make_query(query))
+
+def fetch_all(engine, query):
+    return [tuple(x) for x in execute(engine, query).fetchall()]
+
+def insert_rows(engine, rids):
+    execute(engine, 'insert into test_src values (:rid, :col)', [{'rid': i, 'col': str(i)} for i in rids])
+
+def spy_fetches(engine):
+    fetches = []
+    begin_incremental_fetch = engine.begin_incremental_fetch
+    def begin_incremental_fetch_(config, min_rid):
+        fetches.append(min_rid)
+        return begin_incremental_fetch(config, min_rid)
+    engine.begin_incremental_fetch = begin_incremental_fetch_
+    return fetches
+
+
+def test_segment_roundtrip():
+    rows = [(1, 'a', None), (2, 'b', 1.5)]
+    assert dbrep.cache.decode_segment(dbrep.cache.encode_segment(['rid', 'col', 'val'], rows)) == (['rid', 'col', 'val'], rows)
+
+def test_cache_replay(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', ['create table test_src (rid integer, col text)'])
+    insert_rows(src, range(10))
+    fetches = spy_fetches(src)
+    dst1 = make_engine(tmp_path / 'dst1.db', ['create table test_dst (rid integer, col text)'])
+    dst2 = make_engine(tmp_path / 'dst2.db', ['create table test_dst (rid integer, col text)'])
+    config = {
+        'mode': 'incremental',
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 4, 'cache': {'path': str(tmp_path / 'cache')}},
+        'dst': {'table': 'test_dst', 'rid': 'rid'},
+    }
+    result = dbrep.replication.run_replication(src, dst1, config)
+    assert (result['rows'], result['cached_rows'], fetches) == (10, 0, [None])
+
+    insert_rows(src, range(10, 15))
+    result = dbrep.replication.run_replication(src, dst2, config)
+    assert (result['rows'], result['cached_rows'], fetches) == (15, 10, [None, 9])
+    assert fetch_all(dst2, 'select rid from test_dst order by rid') == [(i,) for i in range(15)]
+
+    result = dbrep.replication.run_replication(src, dst1, config)
+    assert (result['rows'], result['cached_rows'], fetches) == (5, 5, [None, 9, 14])
+    assert fetch_all(dst1, 'select rid from test_dst order by rid') == [(i,) for i in range(15)]
+
+    full_config = dict(config, mode='full-refresh', dst=dict(config['dst'], truncate=True))
+    result = dbrep.replication.run_replication(src, dst1, full_config)
+    assert (result['rows'], result['cached_rows']) == (15, 15)
+    assert fetch_all(dst1, 'select count(*) from test_dst') == [(15,)]
+    for engine in [src, dst1, dst2]:
+        engine.close()
+
+def test_cache_eviction(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', ['create table test_src (rid integer, col text)'])
+    insert_rows(src, range(100))
+    cache = dbrep.cache.SnapshotCache(str(tmp_path / 'cache'), max_bytes=1)
+    engine = dbrep.cache.CachedEngine(src, cache)
+    for where in ['rid < 50', 'rid >= 50']:
+        config = {'table': 'test_src', 'rid': 'rid', 'where': where}
+        engine.begin_incremental_fetch(config, None)
+        while engine.fetch_batch(30)[1]:
+            pass
+    assert os.listdir(str(tmp_path / 'cache')) == [dbrep.cache.make_cache_key(config)]
+    src.close()
@@ -1,3 +1,4 @@
+import pytest
 import dbrep.config
 import copy
 
@@ -90,4 +91,39 @@ def test_substitute_config_complex():
 def test_unflatten():
     assert dbrep.config.unflatten_config({'a.b': 3}) == {'a': {'b': 3}}
     assert dbrep.config.unflatten_config([{'a.b': 3}, {'a.b': 4}]) == [{'a': {'b': 3}}, {'a': {'b': 4}}]
-    assert dbrep.config.unflatten_config({'q':{'a.b': 3}}) == {'q':{'a': {'b': 3}}}
\ No newline at end of file
+    assert dbrep.config.unflatten_config({'q':{'a.b': 3}}) == {'q':{'a': {'b': 3}}}
+
+
+def test_instantiate_templates():
+    templates = {
+        'a': {'va': 4, 'vb': 5, 'nested': {'template': 'c'}},
+        'b': {'vb': 7, 'vc': 8},
+        'c': {'vd': [1]},
+    }
+    config = {'templates': ['a', 'b'], 'val': 3}
+    expected = {'templates': ['a', 'b'], 'va': 4, 'vb': 7, 'vc': 8, 'val': 3, 'nested': {'template': 'c', 'vd': [1]}}
+    assert dbrep.config.instantiate_templates(config, templates) == expected
+    assert config == {'templates': ['a', 'b'], 'val': 3}
+    assert templates['a']['nested'] == {'template': 'c'}
+    assert dbrep.config.instantiate_templates({'x': {'template': 'a'}}, templates) == {'x': {'template': 'a'}}
+    with pytest.raises(ValueError):
+        dbrep.config.instantiate_templates({'template': 'unknown'}, templates)
+
+def test_instantiate_templates_cache():
+    templates = {'a': {'nested': {'template': 'b'}}, 'b': {'vb': 1}}
+    cache = {}
+    res = [dbrep.config.instantiate_templates({'template': 'a', 'name': i}, templates, cache=cache) for i in range(1, 4)]
+    assert [x['name'] for x in res] == [1, 2, 3]
+    assert res[0]['nested'] == {'template': 'b', 'vb': 1}
+    assert res[0]['nested'] is res[1]['nested'] is res[2]['nested']
+
+def test_expand_config():
+    config = {'a': {'values': [7, 10], 'b': {'c': 1}}}
+    res = dbrep.config.iter_expand_config(config, 'a.values', 'a.value')
+    assert not isinstance(res, list)
+    res = list(res)
+    assert [x['a']['value'] for x in res] == [7, 10]
+    assert res[0]['a']['b'] is config['a']['b']
+    assert dbrep.config.expand_config(config, 'a.missing', 'a.value') == [config]
+    with pytest.raises(TypeError):
+        dbrep.config.expand_config(config, 'a.b', 'a.value')
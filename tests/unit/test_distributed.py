@@ -0,0 +1,226 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+
+import pytest
+import yaml
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+import dbrep.cli
+from dbrep.distributed import Coordinator, call_coordinator, catch_up, split_rid_range
+from dbrep.engines.engine_base import BaseEngine
+
+
+def execute(tmp_path, name, query):
+    engine = sqlalchemy.create_engine('sqlite:///{}'.format(tmp_path / name))
+    res = [tuple(x) for x in engine.execute(query).fetchall()] if query.startswith('select') else engine.execute(query)
+    engine.dispose()
+    return res
+
+
+def test_split_rid_range():
+    assert split_rid_range(0, 10, 3) == [(0, 3), (3, 6), (6, 10)]
+    assert split_rid_range(0, 2, 5) == [(0, 1), (1, 2)]
+    assert split_rid_range(5, 5, 2) == []
+    assert split_rid_range(0.0, 1.0, 2) == [(0.0, 0.5), (0.5, 1.0)]
+    with pytest.raises(TypeError):
+        split_rid_range('a', 'b', 2)
+    with pytest.raises(ValueError):
+        split_rid_range(0, 10, 0)
+
+def test_coordinator_reassigns_expired_and_failed_partitions(clock):
+    coordinator = Coordinator({}, [(None, 5), (5, 10)], lease_timeout=10, max_attempts=2, clock=clock)
+    assert coordinator.lease('a')['task'] == {'id': 0, 'min_rid': None, 'max_rid': 5, 'attempt': 1}
+    assert coordinator.lease('b')['task']['id'] == 1
+    assert coordinator.lease('c') == {'task': None, 'finished': False}
+
+    clock.now = 8
+    assert coordinator.heartbeat('a', 0, 100) == {'ok': True}
+    clock.now = 12 #lease of b expired, a renewed its lease
+    assert coordinator.lease('c')['task'] == {'id': 1, 'min_rid': 5, 'max_rid': 10, 'attempt': 2}
+    assert coordinator.heartbeat('b', 1) == {'ok': False}
+    assert coordinator.complete('b', 1, {'rows': 5}) == {'ok': False}
+
+    assert coordinator.complete('a', 0, {'batches': 1, 'rows': 5, 'commits': 1}) == {'ok': True}
+    assert coordinator.fail('c', 1, 'boom') == {'ok': True} #second attempt -- partition fails
+    assert coordinator.finished.is_set()
+    result = coordinator.result()
+    assert (result['rows'], result['retries'], result['failed']) == (5, 2, [1])
+
+
+def test_distributed_replication_with_worker_processes(tmp_path):
+    execute(tmp_path, 'src.db', 'create table test_src (rid integer, col text)')
+    execute(tmp_path, 'dst.db', 'create table test_dst (rid integer, col text)')
+    execute(tmp_path, 'src.db', 'insert into test_src values {}'.format(', '.join("({}, 'v{}')".format(i, i) for i in range(1, 201))))
+    execute(tmp_path, 'dst.db', "insert into test_dst values (1, 'left by failed worker')")
+    config = {
+        'connections': {
+            'src': {'engine': 'sqlalchemy', 'conn-str': 'sqlite:///{}'.format(tmp_path / 'src.db')},
+            'dst': {'engine': 'sqlalchemy', 'conn-str': 'sqlite:///{}'.format(tmp_path / 'dst.db')},
+        },
+        'run': {
+            'mode': 'full-refresh',
+            'src': {'conn': 'src', 'table': 'test_src', 'rid': 'rid', 'batch_size': 10},
+            'dst': {'conn': 'dst', 'table': 'test_dst', 'commit_every': 2},
+        },
+    }
+    (tmp_path / 'dbrep.yaml').write_text(yaml.safe_dump(config)) #workers load config themselves
+    (tmp_path / 'dbrep.cred').write_text('{}')
+    servers = []
+    ready = threading.Event()
+    def on_ready(server):
+        servers.append(server)
+        ready.set()
+    results = []
+    thread = threading.Thread(target=lambda: results.append(dbrep.cli.coordinate(config, ('127.0.0.1', 0), partitions=4,
+                                                                                 lease_timeout=1.0, ready=on_ready)))
+    thread.start()
+    assert ready.wait(10)
+    url = servers[0].url
+    # worker which leased first partition and died
+    assert call_coordinator(url, '/lease', {'worker': 'dead'})['task']['id'] == 0
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.getcwd()] + sys.path))
+    workers = [subprocess.Popen([sys.executable, '-c', 'from dbrep.cli import cli_dbrep; cli_dbrep()', 'worker',
+                                 '-f', str(tmp_path / 'dbrep.yaml'), '-c', str(tmp_path / 'dbrep.cred'),
+                                 '--coordinator', url, '--name', 'worker-{}'.format(i)], env=env) for i in range(2)]
+    for worker in workers:
+        assert worker.wait(60) == 0
+    thread.join(10)
+
+    assert results[0]['rows'] == 200 and results[0]['partitions'] == 4 and results[0]['retries'] == 1
+    assert execute(tmp_path, 'dst.db', 'select count(*), count(distinct rid), min(col) from test_dst') == [(200, 200, 'v1')]
+
+
+def test_incremental_catch_up(tmp_path, make_engine):
+    from dbrep.replication import run_replication
+    execute(tmp_path, 'src.db', 'create table test_src (rid integer, col text)')
+    execute(tmp_path, 'dst.db', 'create table test_dst (rid integer, col text)')
+    execute(tmp_path, 'src.db', 'insert into test_src values {}'.format(', '.join("({}, 'v{}')".format(i, i) for i in range(1, 201))))
+    execute(tmp_path, 'dst.db', 'insert into test_dst values {}'.format(', '.join("({}, 'v{}')".format(i, i) for i in range(1, 11))))
+    execute(tmp_path, 'dst.db', "create trigger fail_150 before insert on test_dst when new.rid = 150 begin select raise(abort, 'boom'); end")
+    src, dst = make_engine(tmp_path / 'src.db', threads=True), make_engine(tmp_path / 'dst.db', threads=True)
+    config = {
+        'mode': 'incremental',
+        'catch_up': {'min_gap': 50, 'workers': 1, 'partitions': 6}, #SQLite does not accept concurrent writers
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 10},
+        'dst': {'table': 'test_dst', 'rid': 'rid'},
+    }
+    # ranges (10, 41], (41, 73], (73, 105], (105, 136], (136, 168], (168, 200] -- ranges after the failed one are not committed
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        run_replication(src, dst, config)
+    assert execute(tmp_path, 'dst.db', 'select count(*), count(distinct rid), max(rid) from test_dst') == [(136, 136, 136)]
+
+    execute(tmp_path, 'dst.db', 'drop trigger fail_150')
+    result = run_replication(src, dst, config)
+    assert (result['rows'], result['rid'], result['catch_up_ranges']) == (64, 200, 6)
+    assert execute(tmp_path, 'dst.db', 'select count(*), count(distinct rid), max(rid) from test_dst') == [(200, 200, 200)]
+
+    execute(tmp_path, 'src.db', "insert into test_src values (201, 'v201')") #narrow gap is loaded by one stream
+    result = run_replication(src, dst, config)
+    assert (result['rows'], result['rid'], 'catch_up_ranges' in result) == (1, 201, False)
+    execute(tmp_path, 'src.db', "insert into test_src values (202, 'v202')")
+    with pytest.raises(ValueError):
+        run_replication(src, dst, dict(config, catch_up={'min_gap': 0}))
+    src.close()
+    dst.close()
+
+class OrderedDst(BaseEngine):
+    """
+    Transactional dst keeping committed rids in memory, which (unlike SQLite) accepts concurrent writers.
+    """
+    def __init__(self, committed, fail_rid=None):
+        self.committed = committed
+        self.fail_rid = fail_rid
+        self.pending = []
+
+    def clone(self):
+        return OrderedDst(self.committed, self.fail_rid)
+
+    def begin_insert(self, config):
+        pass
+
+    def begin_transaction(self):
+        self.pending = []
+
+    def insert_batch(self, names, batch):
+        if any(x[0] == self.fail_rid for x in batch):
+            raise RuntimeError('boom')
+        time.sleep(0.02 / batch[0][0]) #later ranges finish first
+        self.pending += [x[0] for x in batch]
+
+    def commit(self):
+        self.committed.append(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+    def close(self):
+        pass
+
+def test_catch_up_commits_in_order(tmp_path, make_engine):
+    execute(tmp_path, 'src.db', 'create table test_src (rid integer, col text)')
+    execute(tmp_path, 'src.db', 'insert into test_src values {}'.format(', '.join("({}, 'v{}')".format(i, i) for i in range(1, 41))))
+    src = make_engine(tmp_path / 'src.db', threads=True)
+    config = {
+        'catch_up': {'min_gap': 1, 'workers': 4, 'partitions': 8},
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 2},
+        'dst': {'table': 'test_dst', 'rid': 'rid', 'commit_every': 1},
+    }
+    committed = []
+    result = catch_up(src, OrderedDst(committed), config, 0, 40)
+    assert (result['rows'], result['rid'], result['commits']) == (40, 40, 8)
+    assert [x for rids in committed for x in rids] == list(range(1, 41)) #one transaction per range, in order of ranges
+
+    committed = []
+    with pytest.raises(RuntimeError):
+        catch_up(src, OrderedDst(committed, fail_rid=22), config, 0, 40)
+    assert [x for rids in committed for x in rids] == list(range(1, 21))
+    src.close()
+
+def test_coordinator_requires_token(tmp_path):
+    execute(tmp_path, 'src.db', 'create table test_src (rid integer, col text)')
+    execute(tmp_path, 'dst.db', 'create table test_dst (rid integer, col text)')
+    execute(tmp_path, 'src.db', "insert into test_src values (1, 'a'), (2, 'b')")
+    config = {
+        'connections': {
+            'src': {'engine': 'sqlalchemy', 'conn-str': 'sqlite:///{}'.format(tmp_path / 'src.db')},
+            'dst': {'engine': 'sqlalchemy', 'conn-str': 'sqlite:///{}'.format(tmp_path / 'dst.db')},
+        },
+        'replications': {'test': {'mode': 'full-refresh', 'src': {'conn': 'src', 'table': 'test_src', 'rid': 'rid'},
+                                  'dst': {'conn': 'dst', 'table': 'test_dst'}}},
+        'run': 'test',
+    }
+    with pytest.raises(ValueError):
+        dbrep.cli.coordinate(config, ('0.0.0.0', 0))
+
+    servers = []
+    ready = threading.Event()
+    def on_ready(server):
+        servers.append(server)
+        ready.set()
+    results = []
+    thread = threading.Thread(target=lambda: results.append(dbrep.cli.coordinate(config, ('127.0.0.1', 0), partitions=1,
+                                                                                 ready=on_ready, token='secret')))
+    thread.start()
+    assert ready.wait(10)
+    url = servers[0].url
+    with pytest.raises(urllib.error.HTTPError):
+        call_coordinator(url, '/lease', {'worker': 'intruder'})
+    response = call_coordinator(url, '/lease', {'worker': 'w'}, token='secret')
+    assert response['job']['run'] == 'test' and 'conn-str' not in json.dumps(response)
+    call_coordinator(url, '/fail', {'worker': 'w', 'task': 0}, token='secret')
+
+    # worker with different replication config refuses to load partition
+    other = dict(config, replications={'test': dict(config['replications']['test'], mode='incremental')})
+    with pytest.raises(ValueError):
+        dbrep.cli.work(other, url, 'w', token='secret')
+    assert dbrep.cli.work(config, url, 'w', token='secret') == 1
+    thread.join(10)
+    assert results[0]['rows'] == 2
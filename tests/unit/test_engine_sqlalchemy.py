@@ -0,0 +1,236 @@
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+import dbrep.replication
+
+
+def execute(engine, query):
+    return engine._execute(engine.make_query(query))
+
+def fetch_all(engine, query):
+    return [tuple(x) for x in execute(engine, query).fetchall()]
+
+
+@pytest.mark.parametrize('src_raw,dst_raw', [(True, True), (True, False), (False, True)])
+def test_raw_dbapi(tmp_path, src_raw, dst_raw, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (rid integer, "Col Name" text, val real)',
+        "insert into test_src values (1, 'a', 0.5), (2, 'b', null), (3, 'c', 1.5)",
+    ], raw_dbapi=src_raw)
+    dst = make_engine(tmp_path / 'dst.db', ['create table test_dst (rid integer, "Col Name" text, val real)'], raw_dbapi=dst_raw)
+
+    src.begin_full_fetch({'table': 'test_src'})
+    names, batch = src.fetch_batch(2)
+    assert names == ['rid', 'Col Name', 'val']
+    assert [tuple(x) for x in batch] == [(1, 'a', 0.5), (2, 'b', None)]
+
+    dst.begin_insert({'table': 'test_dst'})
+    dst.insert_batch(names, batch) #outside of transaction is committed right away
+    dst.begin_transaction()
+    dst.insert_batch(names, src.fetch_batch(2)[1])
+    dst.rollback()
+    assert fetch_all(dst, 'select * from test_dst order by rid') == [(1, 'a', 0.5), (2, 'b', None)]
+
+    config = {
+        'mode': 'incremental',
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 2},
+        'dst': {'table': 'test_dst', 'rid': 'rid', 'batch_size': 1},
+    }
+    result = dbrep.replication.run_replication(src, dst, config)
+    assert (result['rows'], result['rid']) == (1, 3)
+    assert fetch_all(dst, 'select * from test_dst order by rid') == [(1, 'a', 0.5), (2, 'b', None), (3, 'c', 1.5)]
+    src.close()
+    dst.close()
+
+def test_render_columns_and_where(tmp_path, make_engine):
+    engine = make_engine(tmp_path / 'src.db')
+    config = {'table': 'test_src', 'rid': 'rid', 'columns': ['rid', 'Col Name'], 'where': 'val > 0'}
+    assert engine.render_incremental_fetch(config, 5) == 'select rid, "Col Name" from test_src where rid > 5 and (val > 0) order by rid'
+    assert engine.render_incremental_fetch(config, None) == 'select rid, "Col Name" from test_src where (val > 0) order by rid'
+    assert engine.render_full_fetch({'table': 'test_src', 'columns': 'rid, val * 2 as val'}) == 'select rid, val * 2 as val from test_src'
+    assert engine.render_full_fetch({'table': 'test_src'}) == 'select * from test_src'
+    engine.close()
+
+def test_columns_auto_and_where(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (rid integer, "Col Name" text, blob text, val real)',
+        "insert into test_src values (1, 'a', 'x', 0.5), (2, 'b', 'y', -1), (3, 'c', 'z', 1.5), (4, 'd', 'w', -2)",
+    ])
+    dst = make_engine(tmp_path / 'dst.db', ['create table test_dst (rid integer, "Col Name" text)'])
+    config = {
+        'mode': 'incremental',
+        'src': {'table': 'test_src', 'rid': 'rid', 'columns': 'auto', 'where': 'val > 0'},
+        'dst': {'table': 'test_dst', 'rid': 'rid'},
+    }
+    assert dst.get_columns(config['dst']) == ['rid', 'Col Name']
+    result = dbrep.replication.run_replication(src, dst, config)
+    assert (result['rows'], result['rid']) == (2, 3)
+    assert fetch_all(dst, 'select * from test_dst order by rid') == [(1, 'a'), (3, 'c')]
+    assert src.get_latest_rid(config['src']) == 3
+    assert src.count_rows(config['src'], 1) == 1
+    src.close()
+    dst.close()
+
+def test_columns_auto_quotes_reflected_names(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db')
+    dst = make_engine(tmp_path / 'dst.db', ['create table test_dst (rid integer, "UserId" integer, "Col Name" text)'])
+    src_config = dbrep.replication.resolve_columns({'table': 'test_src', 'columns': 'auto'}, dst, {'table': 'test_dst'})
+    assert src.render_full_fetch(src_config) == 'select rid, "UserId", "Col Name" from test_src' #would be case-folded unquoted
+    assert src.render_full_fetch({'table': 'test_src', 'columns': ['rid', 'UserId']}) == 'select rid, UserId from test_src'
+
+def test_auto_create_and_typed_insert(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (rid integer, name varchar(20), created date, val real, extra text)',
+        "insert into test_src values (1, 'a', '2024-01-02', 1.5, 'x'), (2, 'b', '2024-01-03', 2.25, 'y')",
+    ])
+    dst = make_engine(tmp_path / 'dst.db')
+    config = {
+        'mode': 'incremental',
+        'src': {'table': 'test_src', 'rid': 'rid', 'columns': ['rid', 'name', 'created', 'val'], 'reflect': True},
+        'dst': {'table': 'test_dst', 'rid': 'rid', 'auto_create': True, 'type_map': {'String': 'text'}},
+    }
+    assert [(x, type(t).__name__) for x, t in src.get_column_types(config['src'])] == \
+        [('rid', 'Integer'), ('name', 'String'), ('created', 'Date'), ('val', 'Float'), ('extra', 'Text')]
+    result = dbrep.replication.run_replication(src, dst, config)
+    assert result['rows'] == 2
+    assert fetch_all(dst, "select sql from sqlite_master where name = 'test_dst'") == \
+        [('CREATE TABLE test_dst (rid INTEGER, name text, created DATE, val FLOAT)',)]
+    assert fetch_all(dst, 'select * from test_dst order by rid') == [(1, 'a', '2024-01-02', 1.5), (2, 'b', '2024-01-03', 2.25)]
+
+    # reflected table is cached per process and insert statement is built once per begin_insert
+    dst.begin_insert(config['dst'])
+    table = dst.active_insert(col_names=None)
+    assert table is dbrep.engines.engine_sqlalchemy.reflected_tables[(dst.connection_config['conn-str'], 'test_dst')]
+    assert isinstance(table.c.created.type, sqlalchemy.Date)
+    dst.insert_batch(['rid', 'name'], [(3, 'c')])
+    statement = dst.active_statement
+    dst.insert_batch(['rid', 'name'], [(4, 'd')])
+    assert dst.active_statement is statement
+
+    # column added after table was cached -- stale reflection is dropped on compile error
+    execute(dst, 'alter table test_dst add column extra text')
+    dst.begin_insert(config['dst'])
+    dst.insert_batch(['rid', 'extra'], [(5, 'e')])
+    assert fetch_all(dst, 'select extra from test_dst where rid = 5') == [('e',)]
+    dst.forget_tables()
+    assert (dst.connection_config['conn-str'], 'test_dst') not in dbrep.engines.engine_sqlalchemy.reflected_tables
+    src.close()
+    dst.close()
+
+@pytest.mark.parametrize('raw', [False, True])
+def test_composite_rid(tmp_path, raw, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (updated_at text, id integer, col text)',
+        "insert into test_src values ('2024-01-01', 1, 'a'), ('2024-01-01', 2, 'b'), ('2024-01-02', 1, 'c'), ('2024-01-02', 3, 'd')",
+    ], raw_dbapi=raw)
+    dst = make_engine(tmp_path / 'dst.db', ['create table test_dst (updated_at text, id integer, col text)'], raw_dbapi=raw)
+    config = {
+        'mode': 'incremental',
+        'src': {'table': 'test_src', 'rid': ['updated_at', 'id'], 'batch_size': 3},
+        'dst': {'table': 'test_dst', 'rid': ['updated_at', 'id']},
+    }
+    assert src.get_latest_rid(config['src']) == ('2024-01-02', 3)
+    assert src.get_earliest_rid(config['src']) == ('2024-01-01', 1)
+    assert src.count_rows(config['src'], ('2024-01-01', 2)) == 2
+    result = dbrep.replication.run_replication(src, dst, config)
+    assert (result['rows'], result['rid']) == (4, ('2024-01-02', 3))
+
+    # new row shares timestamp of watermark -- it is not skipped
+    execute(src, "insert into test_src values ('2024-01-02', 4, 'e'), ('2024-01-03', 0, 'f')")
+    result = dbrep.replication.run_replication(src, dst, config)
+    assert (result['rows'], result['rid']) == (2, ('2024-01-03', 0))
+    assert fetch_all(dst, 'select col from test_dst order by updated_at, id') == [('a',), ('b',), ('c',), ('d',), ('e',), ('f',)]
+
+    dst.delete_rows(config['dst'], ('2024-01-02', 1), ('2024-01-02', 4))
+    assert fetch_all(dst, 'select col from test_dst order by updated_at, id') == [('a',), ('b',), ('c',), ('f',)]
+    src.close()
+    dst.close()
+
+def test_expanded_rid_comparison(tmp_path, make_engine):
+    engine = make_engine(tmp_path / 'test.db', [
+        'create table test (a integer, b integer)',
+        'insert into test values {}'.format(', '.join('({}, {})'.format(a, b) for a in range(3) for b in range(3))),
+    ])
+    after = dbrep.engines.engine_sqlalchemy.make_expanded_comparison(['a', 'b'], '>', 'lo')
+    upto = dbrep.engines.engine_sqlalchemy.make_expanded_comparison(['a', 'b'], '<=', 'hi')
+    assert after == '(a >= :lo0 and ((a > :lo0) or (a = :lo0 and b > :lo1)))'
+    res = engine._execute(engine.make_query('select a, b from test where {} and {} order by a, b'.format(after, upto)),
+                          {'lo0': 0, 'lo1': 1, 'hi0': 2, 'hi1': 0}).fetchall()
+    assert [tuple(x) for x in res] == [(0, 2), (1, 0), (1, 1), (1, 2), (2, 0)]
+    engine.close()
+
+def test_load_profile(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (rid integer, col text)',
+        "insert into test_src values (1, 'a'), (2, 'b'), (3, 'c')",
+    ], load_profile=True)
+    dst = make_engine(tmp_path / 'dst.db', ['create table test_dst (rid integer, col text)'],
+                      load_profile={'insert': {'cache_size': None, 'temp_store': None}})
+    pragmas = lambda engine: tuple(fetch_all(engine, 'pragma {}'.format(x))[0][0] for x in ['synchronous', 'journal_mode', 'cache_size', 'query_only'])
+    src_default, dst_default = pragmas(src), pragmas(dst)
+
+    src.begin_full_fetch({'table': 'test_src'})
+    assert pragmas(src)[2:] == (-262144, 1)
+    dst.begin_insert({'table': 'test_dst'})
+    assert pragmas(dst) == (0, 'memory', dst_default[2], 0)
+    dst.begin_transaction()
+    dst.insert_batch(*src.fetch_batch(2))
+    dst.rollback() #journal is still kept
+    dst.insert_batch(*src.fetch_batch(2))
+    assert src.fetch_batch(2)[1] == []
+    assert pragmas(src) == src_default
+    dst.end_insert()
+    assert pragmas(dst) == dst_default
+    assert fetch_all(dst, 'select * from test_dst') == [(3, 'c')]
+
+    config = {'mode': 'full-refresh', 'src': {'table': 'test_src'}, 'dst': {'table': 'test_dst', 'truncate': True}}
+    assert dbrep.replication.run_replication(src, dst, config)['rows'] == 3
+    assert (pragmas(src), pragmas(dst)) == (src_default, dst_default)
+    src.close()
+    dst.close()
+
+def test_stream_results_with_max_batch_bytes(tmp_path, monkeypatch, make_engine):
+    engine = make_engine(tmp_path / 'src.db')
+    streamed = []
+    monkeypatch.setattr(engine, '_execute', lambda query, *args: streamed.append(query.get_execution_options().get('stream_results')))
+    monkeypatch.setattr(engine.engine.dialect, 'supports_server_side_cursors', True) #pysqlite has no server-side cursors
+    engine.begin_full_fetch({'table': 'test_src'})
+    engine.begin_full_fetch({'table': 'test_src', 'max_batch_bytes': 1 << 20})
+    assert streamed == [None, True]
+    engine.close()
+
+def test_oracle_staging_and_shadow_ddl(tmp_path, monkeypatch, make_engine):
+    engine = make_engine(tmp_path / 'dst.db')
+    scripts = []
+    monkeypatch.setattr(engine, '_execute_script', lambda statements, params=None: scripts.append(statements))
+    engine.dialect = 'oracle' #DDL is only rendered
+    engine.begin_staging({'table': 'test_dst'})
+    engine.drop_shadow({'table': 'test_dst'})
+    assert scripts[0][1] == 'create global temporary table test_dst_dbrep_stage on commit preserve rows as select * from test_dst where 1=0'
+    assert all('if exists' not in x and x.startswith('begin execute immediate') for x in [scripts[0][0], scripts[1][0]])
+    engine.close()
+
+def test_estimate_rows_with_where(tmp_path, monkeypatch, make_engine):
+    engine = make_engine(tmp_path / 'src.db')
+    monkeypatch.setattr(engine, '_execute', lambda *args: pytest.fail('statistics should not be queried'))
+    engine.dialect = 'postgresql' #statistics describe the whole table
+    assert engine.estimate_rows({'table': 'test_src', 'where': 'rid > 10'}) is None
+    engine.close()
+
+def test_postgresql_swap_passes_serial_sequences(tmp_path, monkeypatch, make_engine):
+    engine = make_engine(tmp_path / 'dst.db')
+    scripts = []
+    class Result:
+        def fetchall(self):
+            return [('public.test_dst_id_seq', 'Id')]
+    monkeypatch.setattr(engine, '_execute', lambda query, params=None: Result())
+    monkeypatch.setattr(engine, '_execute_script', lambda statements, params=None: scripts.append(statements))
+    engine.dialect = 'postgresql' #DDL is only rendered
+    engine.swap_shadow({'table': 'test_dst'})
+    assert scripts == [[
+        'alter sequence public.test_dst_id_seq owned by test_dst_dbrep_shadow."Id"',
+        'alter table test_dst rename to test_dst_dbrep_old',
+        'alter table test_dst_dbrep_shadow rename to test_dst',
+        'drop table test_dst_dbrep_old',
+    ]]
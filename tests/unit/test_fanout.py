@@ -0,0 +1,118 @@
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+import dbrep.fanout
+import dbrep.replication
+
+
+def fetch_all(engine, query):
+    return [tuple(x) for x in engine._execute(engine.make_query(query)).fetchall()]
+
+
+def test_skip_written():
+    get_rid = lambda row: row[0]
+    batch = [(1,), (2,), (2,), (3,)]
+    assert dbrep.fanout.skip_written(batch, get_rid, None) == batch
+    assert dbrep.fanout.skip_written(batch, get_rid, 0) == batch
+    assert dbrep.fanout.skip_written(batch, get_rid, 2) == [(3,)]
+    assert dbrep.fanout.skip_written(batch, get_rid, 3) == []
+
+def test_fanout_incremental(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', ['create table test_src (rid integer, col text)'], threads=True)
+    src._execute(src.make_query('insert into test_src values (:rid, :col)'), [{'rid': i, 'col': str(i)} for i in range(10)])
+    dst_empty = make_engine(tmp_path / 'dst0.db', ['create table test_dst (rid integer, col text)'], threads=True)
+    dst_behind = make_engine(tmp_path / 'dst1.db', ['create table test_dst (rid integer, col text)', "insert into test_dst values (4, '4')"], threads=True)
+    dst_broken = make_engine(tmp_path / 'dst2.db', ['create table test_dst (rid integer, col text)'], threads=True)
+    scans = []
+    begin_incremental_fetch = src.begin_incremental_fetch
+    src.begin_incremental_fetch = lambda config, min_rid: scans.append(min_rid) or begin_incremental_fetch(config, min_rid)
+    insert_batch = dst_broken.insert_batch
+    def broken_insert_batch(names, batch):
+        if batch[0][0] >= 6:
+            raise RuntimeError('Disk full')
+        insert_batch(names, batch)
+    dst_broken.insert_batch = broken_insert_batch
+
+    config = {
+        'mode': 'incremental',
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 3},
+        'dst': [
+            {'table': 'test_dst', 'rid': 'rid', 'batch_size': 2},
+            {'table': 'test_dst', 'rid': 'rid', 'batch_size': 1},
+            {'table': 'test_dst', 'rid': 'rid'},
+        ],
+    }
+    with pytest.raises(dbrep.fanout.FanoutError) as exc:
+        dbrep.replication.run_replication(src, [dst_empty, dst_behind, dst_broken], config)
+    assert scans == [None]
+    result = exc.value.result
+    assert result['rows'] == 10
+    assert [x['rows'] for x in result['destinations']] == [10, 5, 6]
+    assert [x['error'] for x in result['destinations']] == [None, None, 'Disk full']
+    assert fetch_all(dst_empty, 'select rid from test_dst order by rid') == [(i,) for i in range(10)]
+    assert fetch_all(dst_behind, 'select rid from test_dst order by rid') == [(i,) for i in range(4, 10)]
+    assert fetch_all(dst_broken, 'select rid from test_dst order by rid') == [(i,) for i in range(6)]
+
+    dst_broken.insert_batch = insert_batch
+    result = dbrep.replication.run_replication(src, [dst_empty, dst_behind, dst_broken], config)
+    assert scans == [None, 5]
+    assert [x['rows'] for x in result['destinations']] == [0, 0, 4]
+    assert fetch_all(dst_broken, 'select count(*) from test_dst') == [(10,)]
+    for engine in [src, dst_empty, dst_behind, dst_broken]:
+        engine.close()
+
+@pytest.mark.parametrize('mode,broken', [('incremental', 'get_latest_rid'), ('full-refresh', 'truncate')])
+def test_fanout_setup_failure(tmp_path, mode, broken, make_engine):
+    src = make_engine(tmp_path / 'src.db', ['create table test_src (rid integer, col text)', "insert into test_src values (1, 'a'), (2, 'b')"], threads=True)
+    dst_ok = make_engine(tmp_path / 'dst0.db', ['create table test_dst (rid integer, col text)'], threads=True)
+    dst_broken = make_engine(tmp_path / 'dst1.db', ['create table test_dst (rid integer, col text)'], threads=True)
+    def fail(*args):
+        raise RuntimeError('Connection lost')
+    setattr(dst_broken, broken, fail)
+    config = {
+        'mode': mode,
+        'src': {'table': 'test_src', 'rid': 'rid'},
+        'dst': [{'table': 'test_dst', 'rid': 'rid', 'truncate': True}, {'table': 'test_dst', 'rid': 'rid', 'truncate': True}],
+    }
+    with pytest.raises(dbrep.fanout.FanoutError) as exc:
+        dbrep.replication.run_replication(src, [dst_ok, dst_broken], config)
+    assert [(x['rows'], x['error']) for x in exc.value.result['destinations']] == [(2, None), (0, 'Connection lost')]
+    assert fetch_all(dst_ok, 'select count(*) from test_dst') == [(2,)]
+    for engine in [src, dst_ok, dst_broken]:
+        engine.close()
+
+def test_fanout_requires_rid_column(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', ['create table test_src (rid integer, col text)', "insert into test_src values (1, 'a'), (2, 'b')"], threads=True)
+    dst_empty = make_engine(tmp_path / 'dst0.db', ['create table test_dst (rid integer, col text)'], threads=True)
+    dst_ahead = make_engine(tmp_path / 'dst1.db', ['create table test_dst (rid integer, col text)', "insert into test_dst values (1, 'a')"], threads=True)
+    config = {
+        'mode': 'incremental',
+        'src': {'table': 'test_src', 'rid': 'rid', 'columns': ['col']},
+        'dst': [{'table': 'test_dst', 'rid': 'rid'}, {'table': 'test_dst', 'rid': 'rid'}],
+    }
+    with pytest.raises(ValueError, match='requires rid'):
+        dbrep.replication.run_replication(src, [dst_empty, dst_ahead], config)
+    assert fetch_all(dst_ahead, 'select count(*) from test_dst') == [(1,)] #row with rid 1 is not duplicated
+    assert fetch_all(dst_empty, 'select count(*) from test_dst') == [(0,)]
+
+def test_fanout_batch_callbacks(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', ['create table test_src (rid integer, col text)', "insert into test_src values (1, 'a'), (2, 'b'), (3, 'c')"], threads=True)
+    dsts = [make_engine(tmp_path / 'dst{}.db'.format(i), ['create table test_dst (rid integer, col text)'], threads=True) for i in range(2)]
+    config = {
+        'mode': 'full-refresh',
+        'src': {'table': 'test_src', 'batch_size': 2},
+        'dst': [{'table': 'test_dst'}, {'table': 'test_dst'}],
+    }
+    seen = []
+    callback = lambda stats: seen.append(stats['batches'])
+    dbrep.replication.add_batch_callback(callback)
+    try:
+        dbrep.replication.run_replication(src, dsts, config)
+    finally:
+        dbrep.replication.remove_batch_callback(callback)
+    assert seen == [1, 2] #e.g. memory snapshots of `--profile mem`
+
+def test_fanout_unsupported_mode(tmp_path):
+    with pytest.raises(ValueError):
+        dbrep.fanout.fanout_replication(None, [None], {'mode': 'merge', 'src': {}, 'dst': [{}]})
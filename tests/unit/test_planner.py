@@ -0,0 +1,38 @@
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+import dbrep.planner
+
+
+def test_plan_replication(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', ['create table test_src (rid integer, col text)'])
+    src._execute(src.make_query('insert into test_src values (:rid, :col)'), [{'rid': i, 'col': str(i)} for i in range(100)])
+    dst = make_engine(tmp_path / 'dst.db', [
+        'create table test_dst (rid integer, col text)',
+        "insert into test_dst values (49, '49')",
+    ])
+    config = {
+        'mode': 'incremental',
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 10},
+        'dst': {'table': 'test_dst', 'rid': 'rid', 'batch_size': 10},
+    }
+    plan = dbrep.planner.plan_replication(src, dst, config, sample_batches=2)
+    assert plan['src_rid'] == 99
+    assert plan['dst_rid'] == 49
+    assert plan['rows'] == 50
+    assert plan['sampled_rows'] == 20
+    assert src.active_cursor is None #unread rest of increment does not keep cursor open
+    assert plan['src_plan']
+    assert (plan['insert_rows_per_sec'], plan['duration']) == (None, None) #dst is not touched by default
+    assert 'Rows to replicate: 50' in dbrep.planner.format_plan(plan)
+    assert 'Insert throughput: unknown' in dbrep.planner.format_plan(plan)
+    assert dst._execute(dst.make_query('select count(*) from test_dst')).scalar() == 1
+
+    plan = dbrep.planner.plan_replication(src, dst, dict(config, mode='full-refresh'), sample_batches=20, insert=True)
+    assert plan['rows'] == 100
+    assert plan['sampled_rows'] == 100
+    assert plan['insert_rows_per_sec'] and plan['duration'] is not None
+    assert dst._execute(dst.make_query('select count(*) from test_dst')).scalar() == 1
+    src.close()
+    dst.close()
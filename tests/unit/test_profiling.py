@@ -0,0 +1,54 @@
+import pstats
+import threading
+import time
+
+import pytest
+
+import dbrep.profiling
+import dbrep.replication
+
+
+def fake_run(num_batches):
+    stats = {'batches': 0}
+    for _ in range(num_batches):
+        stats['batches'] += 1
+        for callback in dbrep.replication.batch_callbacks:
+            callback(stats)
+    return sum(range(10000))
+
+def test_profile_cpu(tmp_path):
+    output = str(tmp_path / 'prof')
+    with dbrep.profiling.profile_run('cpu', output, top=5):
+        fake_run(3)
+    assert pstats.Stats(output + '.pstats').total_calls > 0
+    assert (tmp_path / 'prof.collapsed').exists()
+
+def test_profile_mem(tmp_path):
+    output = str(tmp_path / 'prof')
+    with dbrep.profiling.profile_run('mem', output, top=5, every=2):
+        fake_run(5)
+    report = (tmp_path / 'prof.mem.txt').read_text()
+    assert 'Snapshot after batch 2' in report
+    assert 'Snapshot after batch 4' in report
+    assert 'Snapshot after batch end' in report
+    assert dbrep.replication.batch_callbacks == []
+
+def test_profile_invalid():
+    with pytest.raises(ValueError):
+        dbrep.profiling.profile_run('disk')
+
+def test_profile_cpu_samples_other_threads(tmp_path):
+    output = str(tmp_path / 'prof')
+    stop = threading.Event()
+    def busy_():
+        while not stop.is_set():
+            sum(range(1000))
+    thread = threading.Thread(target=busy_, name='dbrep-writer-test')
+    with dbrep.profiling.profile_run('cpu', output, top=5):
+        thread.start()
+        time.sleep(0.1)
+        stop.set()
+        thread.join()
+    stacks = (tmp_path / 'prof.collapsed').read_text().splitlines()
+    assert any(x.startswith('dbrep-writer-test;') and 'busy_' in x for x in stacks)
+    assert not any(x.startswith('dbrep-sampler;') for x in stacks)
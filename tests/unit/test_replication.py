@@ -0,0 +1,362 @@
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+import dbrep.replication
+from dbrep.engines.engine_sqlalchemy import SQLAlchemyEngine
+
+
+def execute(engine, query):
+    return engine._execute(engine.make_query(query))
+
+def fetch_all(engine, query):
+    return [tuple(x) for x in execute(engine, query).fetchall()]
+
+
+def test_merge_update(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (id integer, rid integer, col text)',
+        "insert into test_src values (1, 1, 'a'), (2, 2, 'b'), (3, 3, 'c')",
+    ])
+    dst = make_engine(tmp_path / 'dst.db', [
+        'create table test_dst (id integer primary key, rid integer, col text)',
+    ])
+    config = {
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 2},
+        'dst': {'table': 'test_dst', 'rid': 'rid', 'key': 'id', 'batch_size': 2},
+    }
+    dbrep.replication.merge_update(src, dst, config)
+    assert fetch_all(dst, 'select * from test_dst order by id') == [(1, 1, 'a'), (2, 2, 'b'), (3, 3, 'c')]
+
+    execute(src, "update test_src set rid = 4, col = 'bb' where id = 2")
+    execute(src, "insert into test_src values (4, 5, 'd')")
+    dbrep.replication.merge_update(src, dst, config)
+    assert fetch_all(dst, 'select * from test_dst order by id') == [(1, 1, 'a'), (2, 4, 'bb'), (3, 3, 'c'), (4, 5, 'd')]
+
+    dbrep.replication.merge_update(src, dst, config)
+    assert fetch_all(dst, 'select count(*) from test_dst') == [(4,)]
+    src.close()
+    dst.close()
+
+def test_merge_update_commits_on_rid_change(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (id integer, rid integer, col text)',
+        "insert into test_src values (1, 1, 'a'), (2, 1, 'b'), (3, 2, 'c')",
+    ])
+    dst = make_engine(tmp_path / 'dst.db', ['create table test_dst (id integer primary key, rid integer, col text)'])
+    config = {
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 1},
+        'dst': {'table': 'test_dst', 'rid': 'rid', 'key': 'id', 'commit_every': 1},
+    }
+    result = dbrep.replication.merge_update(src, dst, config)
+    assert (result['batches'], result['rows'], result['commits']) == (3, 3, 2) #no commit between rows of rid 1
+    assert fetch_all(dst, 'select * from test_dst order by id') == [(1, 1, 'a'), (2, 1, 'b'), (3, 2, 'c')]
+
+def test_merge_update_requires_key(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', ['create table test_src (id integer, rid integer)'])
+    dst = make_engine(tmp_path / 'dst.db', ['create table test_dst (id integer, rid integer)'])
+    with pytest.raises(ValueError):
+        dbrep.replication.merge_update(src, dst, {'src': {'table': 'test_src', 'rid': 'rid'}, 'dst': {'table': 'test_dst', 'rid': 'rid'}})
+
+def test_sync_deletes(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (a integer, b text)',
+        "insert into test_src values (1, 'x'), (2, 'x'), (2, 'y'), (5, 'x'), (7, 'x')",
+    ])
+    dst = make_engine(tmp_path / 'dst.db', [
+        'create table test_dst (a integer, b text, col text)',
+        "insert into test_dst values (0, 'x', ''), (1, 'x', ''), (2, 'x', ''), (2, 'z', ''), (3, 'x', ''), "
+        "(4, 'x', ''), (5, 'x', ''), (8, 'x', ''), (9, 'x', ''), (null, 'x', '')",
+    ])
+    config = {
+        'mode': 'sync-deletes',
+        'src': {'table': 'test_src', 'batch_size': 2},
+        'dst': {'table': 'test_dst', 'key': ['a', 'b'], 'batch_size': 2},
+    }
+    result = dbrep.replication.run_replication(src, dst, config)
+    assert (result['rows'], result['batches'], result['scanned']) == (6, 3, 9)
+    assert dst.active_cursor is None #keys of dst are read by its clone
+    assert fetch_all(dst, 'select a, b from test_dst order by a, b') == [(None, 'x'), (1, 'x'), (2, 'x'), (5, 'x')]
+
+    execute(src, 'delete from test_src')
+    dbrep.replication.run_replication(src, dst, dict(config, src=dict(config['src'], where='a > 100')))
+    assert fetch_all(dst, 'select a, b from test_dst') == [(None, 'x')]
+    src.close()
+    dst.close()
+
+def test_sync_deletes_load_profile(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (a integer)',
+        'insert into test_src values (1), (3)',
+    ], load_profile=True)
+    dst = make_engine(tmp_path / 'dst.db', [
+        'create table test_dst (a integer)',
+        'insert into test_dst values (1), (2), (3), (4)',
+    ], load_profile=True)
+    config = {
+        'mode': 'sync-deletes',
+        'src': {'table': 'test_src', 'batch_size': 2},
+        'dst': {'table': 'test_dst', 'key': 'a', 'batch_size': 2},
+    }
+    result = dbrep.replication.run_replication(src, dst, config) #keys of dst are not fetched read-only
+    assert result['rows'] == 2
+    assert fetch_all(dst, 'select a from test_dst order by a') == [(1,), (3,)]
+    src.close()
+    dst.close()
+
+def test_sync_deletes_rejects_case_insensitive_order(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', ['create table test_src (k text collate nocase)', "insert into test_src values ('a'), ('B')"])
+    dst = make_engine(tmp_path / 'dst.db', ['create table test_dst (k text collate nocase)', "insert into test_dst values ('a'), ('B'), ('c')"])
+    config = {'mode': 'sync-deletes', 'src': {'table': 'test_src'}, 'dst': {'table': 'test_dst', 'key': 'k', 'batch_size': 1}}
+    with pytest.raises(ValueError):
+        dbrep.replication.run_replication(src, dst, config)
+    assert fetch_all(dst, 'select count(*) from test_dst') == [(3,)]
+    src.close()
+    dst.close()
+
+def test_full_refresh_swap(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (rid integer, col text)',
+        "insert into test_src values (1, 'a'), (2, 'b'), (3, 'c')",
+    ])
+    dst = make_engine(tmp_path / 'dst.db', [
+        'create table test_dst (rid integer primary key, col varchar(8) not null)',
+        'create index test_dst_col on test_dst (col)',
+        "insert into test_dst values (7, 'old')",
+    ])
+    config = {
+        'src': {'table': 'test_src', 'batch_size': 2},
+        'dst': {'table': 'test_dst', 'swap': True},
+    }
+    def describe():
+        inspector = sqlalchemy.inspect(dst.engine)
+        return (inspector.get_table_names(), [(x['name'], str(x['type']), x['nullable']) for x in inspector.get_columns('test_dst')],
+                inspector.get_pk_constraint('test_dst')['constrained_columns'], [(x['name'], x['column_names']) for x in inspector.get_indexes('test_dst')])
+    original = describe()
+    assert original[1][1] == ('col', 'VARCHAR(8)', False)
+    for _ in range(2): #table keeps its definition and indexes over repeated swaps
+        dbrep.replication.full_refresh(src, dst, config)
+        assert fetch_all(dst, 'select * from test_dst order by rid') == [(1, 'a'), (2, 'b'), (3, 'c')]
+        assert describe() == original
+    src.close()
+    dst.close()
+
+def test_full_refresh_truncate(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (rid integer, col text)',
+        "insert into test_src values (1, 'a')",
+    ])
+    dst = make_engine(tmp_path / 'dst.db', [
+        'create table test_dst (rid integer, col text)',
+        "insert into test_dst values (7, 'old')",
+    ])
+    dbrep.replication.full_refresh(src, dst, {'src': {'table': 'test_src'}, 'dst': {'table': 'test_dst', 'truncate': True}})
+    assert fetch_all(dst, 'select * from test_dst') == [(1, 'a')]
+    src.close()
+    dst.close()
+
+def test_full_refresh_defer_indexes(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (rid integer, col text)',
+        "insert into test_src values (1, 'a'), (2, 'b'), (3, 'c')",
+    ])
+    dst = make_engine(tmp_path / 'dst.db', [
+        'create table test_dst (rid integer, col text)',
+        'create index ix_test_dst_col on test_dst (col)',
+        'create unique index ux_test_dst_rid on test_dst (rid)',
+    ])
+    config = {
+        'src': {'table': 'test_src', 'batch_size': 2},
+        'dst': {'table': 'test_dst', 'defer_indexes': True, 'rebuild_workers': 2},
+    }
+    result = dbrep.replication.full_refresh(src, dst, config)
+    assert result['rows'] == 3
+    assert result['rebuild_duration'] > 0
+    assert fetch_all(dst, 'select * from test_dst order by rid') == [(1, 'a'), (2, 'b'), (3, 'c')]
+    indexes = sqlalchemy.inspect(dst.engine).get_indexes('test_dst')
+    assert sorted((x['name'], bool(x['unique'])) for x in indexes) == [('ix_test_dst_col', False), ('ux_test_dst_rid', True)]
+    src.close()
+    dst.close()
+
+def test_parse_commit_every():
+    assert dbrep.replication.parse_commit_every(None) == ('batches', 1)
+    assert dbrep.replication.parse_commit_every(5) == ('batches', 5)
+    assert dbrep.replication.parse_commit_every('5') == ('batches', 5)
+    assert dbrep.replication.parse_commit_every('5 batches') == ('batches', 5)
+    assert dbrep.replication.parse_commit_every('1000 rows') == ('rows', 1000)
+    assert dbrep.replication.parse_commit_every('run') == ('run', None)
+    with pytest.raises(ValueError):
+        dbrep.replication.parse_commit_every('10 bytes')
+    with pytest.raises(ValueError):
+        dbrep.replication.parse_commit_every(0)
+    with pytest.raises(TypeError):
+        dbrep.replication.parse_commit_every(1.5)
+
+def test_incremental_commit_every(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (rid integer, col text)',
+        "insert into test_src values (1, 'a'), (2, 'b'), (2, 'c'), (3, 'd'), (4, 'e'), (5, 'f')",
+    ])
+    dst = make_engine(tmp_path / 'dst.db', ['create table test_dst (rid integer, col text)'])
+    src.begin_incremental_fetch({'table': 'test_src', 'rid': 'rid'}, None)
+    dst.begin_insert({'table': 'test_dst'})
+    stats = dbrep.replication.run_pull_push(src, dst, 2, 1, commit_every=1, rid='rid')
+    # batch boundary between (2, 'b') and (2, 'c') splits rid=2, so commit is postponed
+    assert (stats['batches'], stats['rows'], stats['commits'], stats['max_rid']) == (3, 6, 2, 5)
+    assert fetch_all(dst, 'select count(*) from test_dst') == [(6,)]
+
+    src.begin_incremental_fetch({'table': 'test_src', 'rid': 'rid'}, None)
+    stats = dbrep.replication.run_pull_push(src, dst, 2, 2, commit_every='run', rid='rid')
+    assert stats['commits'] == 1
+    src.close()
+    dst.close()
+
+class RecordingEngine:
+    def __init__(self, engine):
+        self.engine = engine
+        self.sizes = []
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+    def fetch_batch(self, batch_size):
+        names, batch = self.engine.fetch_batch(batch_size)
+        self.sizes.append(len(batch))
+        return names, batch
+    def insert_batch(self, names, batch):
+        self.sizes.append(len(batch))
+        self.engine.insert_batch(names, batch)
+
+def test_max_batch_bytes(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', ['create table test_src (rid integer, col text)'])
+    execute(src, 'insert into test_src values {}'.format(', '.join("({}, '{}')".format(i, 'x' * (10 if i <= 100 else 10000)) for i in range(200))))
+    dst = make_engine(tmp_path / 'dst.db', ['create table test_dst (rid integer, col text)'])
+    src, dst = RecordingEngine(src), RecordingEngine(dst)
+    config = {
+        'mode': 'incremental',
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 50, 'max_batch_bytes': 100000},
+        'dst': {'table': 'test_dst', 'rid': 'rid', 'batch_size': 50, 'max_batch_bytes': 50000},
+    }
+    result = dbrep.replication.run_replication(src, dst, config)
+    assert result['rows'] == 200
+    assert max(src.sizes[-5:]) < 10 and max(dst.sizes[-5:]) < 5 #large rows are fetched and inserted by few
+    assert src.sizes[0] == dst.sizes[0] == 16 and max(src.sizes) == 50 #first fetch probes row size
+    assert 100000 < result['peak_batch_bytes'] < 500000 #batch where rows grow is sized by previous small rows
+    assert fetch_all(dst, 'select count(*) from test_dst') == [(200,)]
+    src.close()
+    dst.close()
+
+def test_incremental_update_tracks_rid(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', [
+        'create table test_src (rid integer, col text)',
+        "insert into test_src values (0, 'z'), (1, 'a'), (2, 'b'), (3, 'c')",
+    ])
+    dst = make_engine(tmp_path / 'dst.db', ['create table test_dst (rid integer, col text)'])
+    calls = []
+    get_latest_rid = dst.get_latest_rid
+    dst.get_latest_rid = lambda config: calls.append(config) or get_latest_rid(config)
+    config = {
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 3},
+        'dst': {'table': 'test_dst', 'rid': 'rid'},
+    }
+    result = dbrep.replication.incremental_update(src, dst, config)
+    assert result['rows'] == 4
+    assert result['rid'] == 3
+    assert len(calls) == 1
+
+    execute(src, "insert into test_src values (4, 'd')")
+    result = dbrep.replication.incremental_update(src, dst, dict(config, dst=dict(config['dst'], verify_rid=True)))
+    assert result['rows'] == 1
+    assert len(calls) == 3
+    assert fetch_all(dst, 'select * from test_dst order by rid') == [(0, 'z'), (1, 'a'), (2, 'b'), (3, 'c'), (4, 'd')]
+    src.close()
+    dst.close()
+
+def make_flaky(engine, fail_on):
+    calls = []
+    insert_batch = engine.insert_batch
+    def flaky_insert_batch(names, batch):
+        calls.append(len(batch))
+        if len(calls) in fail_on:
+            raise ConnectionError('Connection reset')
+        return insert_batch(names, batch)
+    engine.insert_batch = flaky_insert_batch
+    return calls
+
+def test_parse_retry():
+    assert dbrep.replication.parse_retry(None)['attempts'] == 0
+    assert dbrep.replication.parse_retry(3) == {'attempts': 3, 'backoff': 1.0, 'max_backoff': 60.0}
+    assert dbrep.replication.parse_retry({'attempts': 2, 'backoff': 0})['backoff'] == 0
+    with pytest.raises(ValueError):
+        dbrep.replication.parse_retry({'tries': 2})
+    with pytest.raises(TypeError):
+        dbrep.replication.parse_retry('3')
+
+@pytest.mark.parametrize('mode', ['incremental', 'full-refresh'])
+def test_retry_resumes_from_committed_rid(tmp_path, mode, make_engine):
+    src = make_engine(tmp_path / 'src.db', ['create table test_src (rid integer, col text)'])
+    execute(src, 'insert into test_src values ' + ', '.join("({0}, '{0}')".format(i) for i in range(10)))
+    dst = make_engine(tmp_path / 'dst.db', ['create table test_dst (rid integer, col text)'])
+    calls = make_flaky(dst, fail_on=[4])
+    config = {
+        'mode': mode,
+        'retry': {'attempts': 1, 'backoff': 0},
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 2},
+        'dst': {'table': 'test_dst', 'rid': 'rid', 'batch_size': 2},
+    }
+    run = dbrep.replication.full_refresh if mode == 'full-refresh' else dbrep.replication.incremental_update
+    result = run(src, dst, config)
+    assert result['retries'] == 1
+    assert result['rows'] == 10
+    assert calls == [2] * 6 # 3 batches committed before failure were not re-inserted
+    assert fetch_all(dst, 'select rid from test_dst order by rid') == [(i,) for i in range(10)]
+    src.close()
+    dst.close()
+
+def test_retry_gives_up(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'src.db', ["create table test_src (rid integer, col text)", "insert into test_src values (1, 'a')"])
+    dst = make_engine(tmp_path / 'dst.db', ['create table test_dst (rid integer, col text)'])
+    make_flaky(dst, fail_on=[1, 2])
+    config = {
+        'retry': {'attempts': 1, 'backoff': 0},
+        'src': {'table': 'test_src', 'rid': 'rid'},
+        'dst': {'table': 'test_dst', 'rid': 'rid'},
+    }
+    with pytest.raises(ConnectionError):
+        dbrep.replication.incremental_update(src, dst, config)
+    src.close()
+    dst.close()
+
+def test_pushdown(tmp_path, make_engine):
+    src = make_engine(tmp_path / 'db.db', [
+        'create table test_src (rid integer, col text, extra text)',
+        "insert into test_src values (1, 'a', 'x'), (2, 'b', 'y'), (3, 'c', 'z')",
+        'create table test_dst (col text, rid integer)',
+        "insert into test_dst values ('a', 1)",
+    ])
+    dst = make_engine(tmp_path / 'db.db')
+    fetch_batch = src.fetch_batch
+    src.fetch_batch = lambda batch_size: pytest.fail('Rows should not be fetched')
+    config = {
+        'mode': 'incremental',
+        'pushdown': True,
+        'src': {'table': 'test_src', 'rid': 'rid'},
+        'dst': {'table': 'test_dst', 'rid': 'rid'},
+    }
+    assert src.colocated(dst)
+    result = dbrep.replication.run_replication(src, dst, config)
+    assert (result['pushdown'], result['rows'], result['rid']) == (True, 2, 3)
+    assert fetch_all(dst, 'select * from test_dst order by rid') == [('a', 1), ('b', 2), ('c', 3)]
+
+    result = dbrep.replication.run_replication(src, dst, dict(config, mode='full-refresh', dst=dict(config['dst'], swap=True)))
+    assert (result['pushdown'], result['rows']) == (True, 3)
+    assert fetch_all(dst, 'select * from test_dst order by rid') == [('a', 1), ('b', 2), ('c', 3)]
+
+    assert not dbrep.replication.can_pushdown(src, dst, {k: v for k, v in config.items() if k != 'pushdown'}) #opt-in
+    assert not dbrep.replication.can_pushdown(src, dst, dict(config, src=dict(config['src'], columns='rid, col')))
+    other = make_engine(tmp_path / 'other.db')
+    assert not src.colocated(other)
+    options = SQLAlchemyEngine({'engine': 'sqlalchemy', 'conn-str': 'sqlite:///{}?check_same_thread=false'.format(tmp_path / 'db.db')})
+    assert not src.colocated(options) #connection options (e.g. search_path) may change what is read
+    options.close()
+    src.fetch_batch = fetch_batch
+    for engine in [src, dst, other]:
+        engine.close()
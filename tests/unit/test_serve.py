@@ -0,0 +1,86 @@
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+import dbrep
+import dbrep.cli
+import dbrep.serve
+
+
+def make_config(tmp_path):
+    for name in ['src', 'dst']:
+        engine = sqlalchemy.create_engine('sqlite:///{}'.format(tmp_path / (name + '.db')))
+        engine.execute('create table test_{} (rid integer, col text)'.format(name))
+        engine.dispose()
+    return {
+        'connections': {
+            'src': {'engine': 'sqlalchemy', 'conn-str': 'sqlite:///{}'.format(tmp_path / 'src.db')},
+            'dst': {'engine': 'sqlalchemy', 'conn-str': 'sqlite:///{}'.format(tmp_path / 'dst.db')},
+        },
+        'replications': {
+            'inc': {
+                'mode': 'incremental',
+                'interval': 8, 'min_interval': 1,
+                'src': {'conn': 'src', 'table': 'test_src', 'rid': 'rid'},
+                'dst': {'conn': 'dst', 'table': 'test_dst', 'rid': 'rid'},
+            },
+        },
+    }
+
+def execute(tmp_path, name, query):
+    engine = sqlalchemy.create_engine('sqlite:///{}'.format(tmp_path / name))
+    res = [tuple(x) for x in engine.execute(query).fetchall()] if query.startswith('select') else engine.execute(query)
+    engine.dispose()
+    return res
+
+
+def test_replication_server_adaptive_polling(tmp_path, clock):
+    dbrep.init_factory()
+    config = make_config(tmp_path)
+    server = dbrep.serve.ReplicationServer(lambda: config, dbrep.cli.make_engine, clock=clock)
+    server.reload()
+    assert [x.name for x in server.jobs] == ['inc']
+
+    execute(tmp_path, 'src.db', "insert into test_src values (1, 'a'), (2, 'b')")
+    assert server.run_pending() == 1
+    assert execute(tmp_path, 'dst.db', 'select count(*) from test_dst') == [(2,)]
+
+    delays = []
+    for _ in range(4): #no new rows -- delay doubles up to interval
+        clock.now += server.run_pending()
+        delays.append(server.jobs[0].delay)
+    assert delays == [1, 2, 4, 8]
+
+    execute(tmp_path, 'src.db', "insert into test_src values (3, 'c')")
+    clock.now += server.run_pending()
+    assert server.jobs[0].delay == 1
+    assert execute(tmp_path, 'dst.db', 'select count(*) from test_dst') == [(3,)]
+
+    server.request_stop()
+    server.serve_forever() #reloads config, runs pending once and stops
+    assert server.jobs == []
+
+def test_replication_server_keeps_jobs_on_bad_reload(tmp_path):
+    dbrep.init_factory()
+    configs = [make_config(tmp_path), {'replications': {}}]
+    server = dbrep.serve.ReplicationServer(lambda: configs.pop(0), dbrep.cli.make_engine)
+    server.reload()
+    jobs = server.jobs
+    server.reload()
+    assert server.jobs is jobs
+    for job in jobs:
+        job.close()
+
+def test_replication_server_rejects_full_refresh(tmp_path):
+    dbrep.init_factory()
+    config = make_config(tmp_path)
+    config['replications']['inc']['mode'] = 'full-refresh'
+    server = dbrep.serve.ReplicationServer(lambda: config, dbrep.cli.make_engine)
+    with pytest.raises(ValueError):
+        server.reload()
+
+    config['replications']['inc']['serve'] = True
+    server.reload()
+    assert [x.name for x in server.jobs] == ['inc']
+    for job in server.jobs:
+        job.close()
@@ -0,0 +1,67 @@
+import concurrent.futures
+
+import pytest
+
+import dbrep.throttle
+
+
+def test_estimate_batch_bytes():
+    assert dbrep.throttle.estimate_batch_bytes([]) == 0
+    small = dbrep.throttle.estimate_batch_bytes([(1, 'a')] * 10)
+    large = dbrep.throttle.estimate_batch_bytes([(1, 'a' * 10000)] * 10)
+    assert 0 < small < large
+    assert dbrep.throttle.estimate_batch_bytes([(1, 'a')] * 1000) == pytest.approx(small * 100, rel=0.01)
+
+def test_token_bucket(clock):
+    bucket = dbrep.throttle.TokenBucket(100, clock=clock, sleep=clock.sleep)
+    assert bucket.consume(100) == 0.0
+    assert bucket.consume(50) == pytest.approx(0.5)
+    assert clock.now == pytest.approx(0.5)
+    clock.now += 10 #idle time refills bucket only up to burst
+    assert bucket.consume(100) == 0.0
+    assert bucket.consume(100) == pytest.approx(1.0)
+
+def test_throttle_rows_per_sec(clock):
+    throttle = dbrep.throttle.Throttle(max_rows_per_sec=1000, clock=clock, sleep=clock.sleep)
+    for _ in range(10):
+        throttle([(1,)] * 500)
+    assert clock.now == pytest.approx(4.0)
+    assert throttle.delay == pytest.approx(4.0)
+
+def test_throttle_adaptive(clock):
+    throttle = dbrep.throttle.Throttle(max_rows_per_sec=1000, target_latency=0.1, clock=clock, sleep=clock.sleep)
+    throttle([(1,)] * 10, latency=1.0)
+    assert throttle.scale == 0.5
+    assert throttle.rows.rate == 500
+    for _ in range(10):
+        throttle([(1,)] * 10, latency=1.0)
+    assert throttle.scale == dbrep.throttle.Throttle.min_scale
+    for _ in range(20):
+        throttle([(1,)] * 10, latency=0.01)
+    assert throttle.scale == 1.0
+
+def test_make_throttle():
+    assert dbrep.throttle.make_throttle({}) is None
+    assert dbrep.throttle.make_throttle({'max_bytes_per_sec': 1e6}).bytes.rate == 1e6
+    with pytest.raises(ValueError):
+        dbrep.throttle.make_throttle({'target_latency': 1})
+
+def test_batch_budget():
+    budget = dbrep.throttle.make_batch_budget({'max_batch_bytes': 100000, 'batch_size': 1000})
+    assert budget.rows() == dbrep.throttle.BatchBudget.probe_rows
+    size = budget.observe([('x' * 1000,)] * 10)
+    assert budget.peak == size and size > 10000
+    assert 50 <= budget.rows() < 100
+    budget.observe([(1,)] * 10) #small rows -- capped by batch_size
+    assert budget.rows() == 1000
+    assert dbrep.throttle.make_batch_budget({}) is None
+    with pytest.raises(ValueError):
+        dbrep.throttle.BatchBudget(0)
+
+def test_batch_budget_shared_by_threads():
+    budget = dbrep.throttle.BatchBudget(100000)
+    batches = [[('x' * (10 * i),)] * 10 for i in range(1, 200)]
+    with concurrent.futures.ThreadPoolExecutor(4) as executor: #as writers of `dbrep.writers` do
+        sizes = list(executor.map(budget.observe, batches))
+    assert budget.peak == max(sizes)
+    assert 1 <= budget.rows() <= budget.batch_size
@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+import dbrep.replication
+from dbrep.engines.engine_base import BaseEngine
+
+
+def make_src(make_engine, db_path, num_rows):
+    src = make_engine(db_path, ['create table test_src (rid integer, col text)'])
+    src._execute(src.make_query('insert into test_src values (:rid, :col)'), [{'rid': i, 'col': str(i % 3)} for i in range(num_rows)])
+    return src
+
+class MemoryEngine(BaseEngine):
+    """
+    Transactional dst keeping rows in memory, which (unlike SQLite) accepts concurrent writers.
+    """
+    def __init__(self, rows=None, fail=None, fail_clones=None):
+        self.rows = rows if rows is not None else []
+        self.lock = threading.Lock()
+        self.fail = fail or {}
+        self.fail_clones = fail_clones or {}
+        self.pending = []
+        self.inserted = []
+        self.clones = []
+
+    def clone(self):
+        res = MemoryEngine(self.rows, self.fail_clones)
+        res.lock = self.lock
+        self.clones.append(res)
+        return res
+
+    def check_(self, name, *args):
+        if name in self.fail and self.fail[name](*args):
+            raise RuntimeError('Writer failed')
+
+    def get_latest_rid(self, config):
+        with self.lock:
+            return max((x[0] for x in self.rows), default=None)
+
+    def begin_insert(self, config):
+        pass
+
+    def begin_transaction(self):
+        self.pending = []
+
+    def insert_batch(self, names, batch):
+        self.check_('insert_batch', batch)
+        time.sleep(0.001 * (len(self.clones) + 1)) #let writers overtake each other
+        self.pending += [tuple(x) for x in batch]
+        self.inserted += [x[0] for x in batch]
+
+    def commit(self):
+        self.check_('commit')
+        with self.lock:
+            self.rows += self.pending
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+    def delete_rows(self, config, min_rid=None):
+        with self.lock:
+            self.rows[:] = [x for x in self.rows if min_rid is not None and x[0] <= min_rid]
+
+    def close(self):
+        pass
+
+def test_writers_incremental(tmp_path, make_engine):
+    src = make_src(make_engine, tmp_path / 'src.db', 25)
+    dst = MemoryEngine()
+    config = {
+        'mode': 'incremental',
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 3},
+        'dst': {'table': 'test_dst', 'rid': 'rid', 'batch_size': 2, 'writers': 3},
+    }
+    result = dbrep.replication.run_replication(src, dst, config)
+    assert (result['rows'], result['batches'], result['commits'], result['rid']) == (25, 9, 9, 24)
+    assert sorted(x[0] for x in dst.rows) == list(range(25))
+    assert len(dst.clones) == 2
+    src.close()
+
+def test_writers_commit_prefix(tmp_path, make_engine):
+    src = make_src(make_engine, tmp_path / 'src.db', 25)
+    dst = MemoryEngine(fail_clones={'insert_batch': lambda batch: batch[0][0] == 9})
+    config = {
+        'mode': 'incremental',
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 3},
+        'dst': {'table': 'test_dst', 'rid': 'rid', 'writers': 2},
+    }
+    with pytest.raises(RuntimeError):
+        dbrep.replication.run_replication(src, dst, config)
+    # batch [9, 12) is written by clone, so later batches of main writer must not be committed
+    assert sorted(x[0] for x in dst.rows) == list(range(9))
+
+    dst.fail_clones = {}
+    result = dbrep.replication.run_replication(src, dst, config)
+    assert (result['rows'], result['rid']) == (16, 24)
+    assert sorted(x[0] for x in dst.rows) == list(range(25))
+    src.close()
+
+def test_writers_key(tmp_path, make_engine):
+    src = make_src(make_engine, tmp_path / 'src.db', 20)
+    dst = MemoryEngine([(-1, 'old')], fail_clones={'commit': lambda: True})
+    config = {
+        'mode': 'incremental',
+        'src': {'table': 'test_src', 'rid': 'rid', 'batch_size': 5},
+        'dst': {'table': 'test_dst', 'rid': 'rid', 'writers': 2, 'writers_key': 'rid', 'commit_every': 'run'},
+    }
+    with pytest.raises(ValueError):
+        dbrep.replication.run_replication(src, dst, config)
+
+    config['dst']['commit_every'] = 2
+    with pytest.raises(RuntimeError): #main writer commits its part of chunk, which is deleted afterwards
+        dbrep.replication.run_replication(src, dst, config)
+    assert dst.rows == [(-1, 'old')]
+
+    dst.fail_clones = {}
+    dst.inserted = []
+    result = dbrep.replication.run_replication(src, dst, config)
+    assert (result['rows'], result['rid']) == (20, 19)
+    assert sorted(x[0] for x in dst.rows) == list(range(-1, 20))
+    assert dst.inserted and dst.clones[-1].inserted
+    assert sorted(dst.inserted + dst.clones[-1].inserted) == list(range(20))
+    src.close()
+
+def test_writers_unsupported(tmp_path):
+    with pytest.raises(ValueError):
+        dbrep.replication.merge_update(None, None, {'src': {}, 'dst': {'key': 'id', 'writers': 2}})